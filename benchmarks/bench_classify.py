@@ -0,0 +1,97 @@
+"""`classify_device` against the previous implementation and a single-regex matcher.
+
+Run from the repository root: `python -m benchmarks.bench_classify`.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+import string
+import time
+
+from wiretapper.classify import RULES, _category, classify_device, classify_many
+
+
+def classify_device_scan(name: str | None, original_type: str) -> str:
+    # The implementation this replaced: a list of substring scans per category.
+    if not name:
+        return original_type
+    name_upper = name.upper()
+    for category, keywords in RULES:
+        if any(k in name_upper for k in list(keywords)):
+            return category
+    return original_type
+
+
+# One anchored alternation of lookaheads, one branch per category in rule order;
+# `lastgroup` names the first category with a keyword anywhere in the name.
+_ALTERNATION = re.compile(
+    "(?s)(?:"
+    + "|".join(
+        f"(?=.*?(?:{'|'.join(map(re.escape, keywords))}))(?P<{category}>)"
+        for category, keywords in RULES
+    )
+    + ")"
+)
+
+
+def classify_device_regex(name: str | None, original_type: str) -> str:
+    if not name:
+        return original_type
+    match = _ALTERNATION.match(name.upper())
+    return (match.lastgroup if match else None) or original_type
+
+
+def _corpus(n: int, *, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    keywords = [k for _, ks in RULES for k in ks]
+    ssids = [
+        "".join(rng.choices(string.ascii_letters + string.digits + "-_ ", k=rng.randint(4, 20)))
+        + (rng.choice(keywords).lower() if rng.random() < 0.3 else "")
+        for _ in range(n // 10)
+    ]
+    return [rng.choice(ssids) for _ in range(n)]
+
+
+def _banners(n: int, *, seed: int = 11) -> list[str]:
+    rng = random.Random(seed)
+    words = ["HTTP/1.1 200 OK", "Server: nginx", "Content-Type: text/html", "X-Powered-By: PHP"]
+    return [
+        "\r\n".join(rng.choices(words, k=60)) + (" hikvision" if rng.random() < 0.2 else "")
+        for _ in range(n)
+    ]
+
+
+def _bench(label: str, fn, names: list[str]) -> float:
+    started = time.perf_counter()
+    fn(names)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34}{len(names) / elapsed:>14,.0f} names/s")
+    return elapsed
+
+
+def main() -> None:
+    ssids = _corpus(200_000)
+    banners = _banners(5_000)
+    for names in (ssids, banners):
+        expected = [classify_device_scan(n, "router") for n in names]
+        assert expected == classify_many(names, "router")
+        assert expected == [classify_device_regex(n, "router") for n in names]
+
+    print("SSIDs (200k, 10% distinct)")
+    _bench("  keyword scans", lambda ns: [classify_device_scan(n, "router") for n in ns], ssids)
+    _bench("  one alternation regex", lambda ns: [classify_device_regex(n, "r") for n in ns], ssids)
+    _bench("  prebuilt rules, no memo", lambda ns: [_category(n.upper()) for n in ns], ssids)
+    _bench("  classify_device (memoized)", lambda ns: [classify_device(n, "r") for n in ns], ssids)
+    _bench("  classify_many", lambda ns: classify_many(ns, "router"), ssids)
+    print("Shodan banners (5k, ~2 KiB each)")
+    _bench("  keyword scans", lambda ns: [classify_device_scan(n, "iot") for n in ns], banners)
+    _bench(
+        "  one alternation regex", lambda ns: [classify_device_regex(n, "i") for n in ns], banners
+    )
+    _bench("  classify_many", lambda ns: classify_many(ns, "iot"), banners)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Offline load test: the app against a local stub of every upstream provider.
+
+Starts `stub_upstream.StubUpstream`, points the app at it with `upstream_override`,
+serves the app on a local port and drives `/nearby`, `/searchzz`,
+`/api/geo/towers` and `/api/geo/celltower` from `--concurrency` client threads.
+Reports throughput, p50/p95/p99 latency and errors per route, upstream calls per
+stub endpoint and RSS growth, and writes them as JSON to compare versions.
+
+Run from the repository root: `python -m benchmarks.bench_load [--out run.json]
+[--baseline old.json]`. `--spread` is the number of distinct locations per route
+(fewer means more cache hits).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any
+
+import requests
+from werkzeug.serving import make_server
+
+import wiretapper
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+
+from .stub_upstream import StubConfig, StubUpstream
+
+ROUTES = ("nearby", "search", "towers", "celltower")
+RELAXED_QUOTAS = tuple(
+    (provider, "per_s=0,concurrency=64")
+    for provider in ("wigle", "shodan", "unwiredlabs", "opencellid")
+)
+
+
+def _rss_bytes() -> int:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _git_rev() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _path(route: str, rng: random.Random, spread: int) -> str:
+    i = rng.randrange(spread)
+    lat, lon = 51.4 + (i % 50) * 0.01, -0.2 + (i // 50) * 0.01
+    if route == "nearby":
+        mode = ("wifi", "bluetooth")[i % 2]
+        return f"/nearby?lat={lat:.4f}&lon={lon:.4f}&mode={mode}"
+    if route == "search":
+        kind = ("location", "ssid", "bssid")[i % 3]
+        query = {"location": f"{lat:.4f},{lon:.4f}", "ssid": f"net-{i}"}.get(
+            kind, f"00:11:22:33:{i >> 8 & 255:02x}:{i & 255:02x}"
+        )
+        return f"/searchzz?type={kind}&query={query}"
+    if route == "towers":
+        return f"/api/geo/towers?lat={lat:.4f}&lon={lon:.4f}"
+    return f"/api/geo/celltower?lat={lat:.4f}&lon={lon:.4f}"
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _drive(base: str, args: argparse.Namespace) -> tuple[dict[str, list[float]], Counter[str]]:
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: Counter[str] = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def _worker(seed: int) -> None:
+        rng = random.Random(seed)
+        session = requests.Session()
+        mine: dict[str, list[float]] = defaultdict(list)
+        failed: Counter[str] = Counter()
+        while time.monotonic() < deadline:
+            route = rng.choice(args.routes)
+            started = time.perf_counter()
+            try:
+                r = session.get(base + _path(route, rng, args.spread), timeout=30)
+                ok = r.status_code == 200
+            except requests.RequestException:
+                ok = False
+            mine[route].append(time.perf_counter() - started)
+            if not ok:
+                failed[route] += 1
+        with lock:
+            for route, values in mine.items():
+                latencies[route].extend(values)
+            errors.update(failed)
+
+    workers = [threading.Thread(target=_worker, args=(i,)) for i in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    stub_config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        records=args.records,
+    )
+    stub = StubUpstream(stub_config).start()
+    settings = Settings(
+        "bench",
+        "bench",
+        "bench",
+        "bench",
+        debug=False,
+        rate_limit_rpm=10**9,
+        quota_specs=() if args.real_quotas else RELAXED_QUOTAS,
+        upstream_override=stub.url,
+    )
+    app = create_app(settings)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    rss_before = _rss_bytes()
+    started = time.perf_counter()
+    latencies, errors = _drive(base, args)
+    elapsed = time.perf_counter() - started
+    rss_after = _rss_bytes()
+    server.shutdown()
+    stub.stop()
+
+    routes: dict[str, Any] = {}
+    for route in args.routes:
+        values = sorted(latencies.get(route, []))
+        routes[route] = {
+            "requests": len(values),
+            "errors": errors[route],
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 2),
+        }
+    return {
+        "version": wiretapper.__version__,
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in {"out", "baseline", "routes"}
+        }
+        | {"routes": list(args.routes)},
+        "elapsed_s": round(elapsed, 2),
+        "routes": routes,
+        "upstream_calls": stub.call_counts(),
+        "rss_bytes": {"before": rss_before, "after": rss_after, "growth": rss_after - rss_before},
+    }
+
+
+def _report(result: dict[str, Any], baseline: dict[str, Any] | None) -> None:
+    def _delta(route: str, key: str) -> str:
+        if baseline is None or route not in baseline.get("routes", {}):
+            return ""
+        old = baseline["routes"][route][key]
+        new = result["routes"][route][key]
+        return f" ({(new - old) / old:+.0%})" if old else ""
+
+    print(f"{'route':<10} {'req/s':>14} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} errors")
+    for route, r in result["routes"].items():
+        print(
+            f"{route:<10} {str(r['rps']) + _delta(route, 'rps'):>14}"
+            f" {str(r['p50_ms']) + _delta(route, 'p50_ms'):>16}"
+            f" {str(r['p95_ms']) + _delta(route, 'p95_ms'):>16}"
+            f" {str(r['p99_ms']) + _delta(route, 'p99_ms'):>16} {r['errors']}"
+        )
+    print("upstream calls:", json.dumps(result["upstream_calls"], sort_keys=True))
+    rss = result["rss_bytes"]
+    print(
+        f"rss: {rss['after'] / 2**20:,.1f} MiB (+{rss['growth'] / 2**20:,.1f} MiB during the run)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--spread", type=int, default=200, help="distinct locations")
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=StubConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--records", type=int, default=StubConfig.records)
+    parser.add_argument(
+        "--real-quotas", action="store_true", help="keep the default per-provider quotas"
+    )
+    parser.add_argument("--out", type=Path, help="write the result as JSON")
+    parser.add_argument("--baseline", type=Path, help="a previous --out to compare against")
+    args = parser.parse_args()
+    if args.spread < 1 or args.concurrency < 1:
+        parser.error("--spread and --concurrency must be at least 1")
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    result = run(args)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    _report(result, baseline)
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Rate limiter at 1M distinct clients: throughput of `allow()` and memory held.
+
+Run from the repository root: `python -m benchmarks.bench_ratelimit [clients]`.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+import tracemalloc
+
+from wiretapper.ratelimit import RateLimiter
+
+
+def main(clients: int = 1_000_000) -> None:
+    keys = [f"nearby:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+
+    tracemalloc.start()
+    traced = RateLimiter(max_keys=clients)
+    for key in keys:
+        traced.allow(key, per_minute=60)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    limiter = RateLimiter(max_keys=clients)
+    started = time.perf_counter()
+    for key in keys:
+        limiter.allow(key, per_minute=60)
+    fill_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for key in keys:
+        limiter.allow(key, per_minute=60)
+    hit_s = time.perf_counter() - started
+
+    bounded = RateLimiter(max_keys=clients // 10)
+    started = time.perf_counter()
+    for key in keys:
+        bounded.allow(key, per_minute=60)
+    evict_s = time.perf_counter() - started
+
+    stats = limiter.stats()
+    print(f"clients:            {clients:,}")
+    print(f"insert:             {clients / fill_s:,.0f} allow()/s")
+    print(f"existing bucket:    {clients / hit_s:,.0f} allow()/s")
+    print(f"at 10% bound:       {clients / evict_s:,.0f} allow()/s (evicting)")
+    print(f"traced memory:      {held / 2**20:,.1f} MiB ({held / clients:.0f} B/client)")
+    print(f"/api/status bytes:  {stats['approx_bytes'] / 2**20:,.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
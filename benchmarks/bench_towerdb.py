@@ -0,0 +1,79 @@
+"""Import and query the local tower index on a synthetic OpenCellID export.
+
+Run from the repository root: `python -m benchmarks.bench_towerdb [--rows N]`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from wiretapper import lookups, tiles, towerdb
+
+_HEADER = (
+    "radio,mcc,net,area,cell,unit,lon,lat,range,samples,changeable,created,updated,averageSignal"
+)
+
+
+def _export(path: Path, rows: int, *, seed: int = 3) -> None:
+    # Towers clustered around a few hundred "cities", like the real export.
+    rng = random.Random(seed)
+    cities = [(rng.uniform(-55, 70), rng.uniform(-170, 175)) for _ in range(400)]
+    radios = ("GSM", "UMTS", "LTE", "NR")
+    with gzip.open(path, "wt", compresslevel=1) as f:
+        f.write(_HEADER + "\n")
+        for cell in range(rows):
+            lat, lon = rng.choice(cities)
+            f.write(
+                f"{rng.choice(radios)},{rng.randint(200, 700)},{rng.randint(1, 99)},"
+                f"{rng.randint(1, 65000)},{cell},,{lon + rng.gauss(0, 0.3):.6f},"
+                f"{lat + rng.gauss(0, 0.3):.6f},1000,{rng.randint(1, 900)},1,0,0,0\n"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export = Path(tmp) / "cell_towers.csv.gz"
+        started = time.perf_counter()
+        _export(export, args.rows)
+        print(f"synthetic export     {args.rows:>12,} rows in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        towerdb.import_csv(Path(tmp) / "index", [export])
+        elapsed = time.perf_counter() - started
+        print(f"import               {args.rows / elapsed:>12,.0f} rows/s ({elapsed:.1f}s)")
+
+        index = towerdb.TowerIndex(Path(tmp) / "index")
+        rng = random.Random(5)
+        # Query where towers are: around a random tower, as `/api/geo/towers` would.
+        keys = [int(i) for i in rng.sample(range(index.rows), args.queries)]
+        points = [(float(index.columns["lat"][i]), float(index.columns["lon"][i])) for i in keys]
+        samples: list[float] = []
+        found = 0
+        for lat, lon in points:
+            bbox = tiles.bbox_around(lat, lon, lookups.TOWERS_DELTA)
+            started = time.perf_counter()
+            found += len(index.query(bbox))
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        print(
+            f"query ({lookups.TOWERS_DELTA} deg box)  "
+            f"p50 {statistics.median(samples):.3f} ms"
+            f"  p99 {samples[int(len(samples) * 0.99)]:.3f} ms"
+            f"  ({found / len(points):.0f} towers each)"
+        )
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
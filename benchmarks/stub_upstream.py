@@ -0,0 +1,261 @@
+"""A local stub of the Wigle, UnwiredLabs, OpenCellID and Shodan APIs.
+
+Each request sleeps for a configurable latency, fails with a configurable rate,
+and answers with generated records placed around the queried location. Wigle
+searches are paged with `searchAfter` like the real API.
+
+Standalone, from the repository root:
+
+    python -m benchmarks.stub_upstream --port 8099 --latency-ms 80 --records 300
+
+then run the app with `WIRETAPPER_UPSTREAM_OVERRIDE=http://127.0.0.1:8099`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 20.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    records: int = 100  # per Wigle search, OpenCellID area and Shodan search
+    cells: int = 10  # per UnwiredLabs answer
+
+
+def _rng(*parts: object) -> random.Random:
+    # Same query, same answer: repeated lookups return the same records.
+    return random.Random(zlib.crc32(repr(parts).encode()))
+
+
+def _around(rng: random.Random, lat: float, lon: float, spread: float) -> tuple[float, float]:
+    return lat + rng.uniform(-spread, spread), lon + rng.uniform(-spread, spread)
+
+
+def _mac(rng: random.Random) -> str:
+    return ":".join(f"{rng.randrange(256):02x}" for _ in range(6))
+
+
+class StubUpstream:
+    def __init__(self, config: StubConfig, *, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config
+        self.calls: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                stub._handle(self, None)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                stub._handle(self, json.loads(self.rfile.read(length) or b"{}"))
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> StubUpstream:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-upstream", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def call_counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+    def _handle(self, handler: BaseHTTPRequestHandler, body: dict[str, Any] | None) -> None:
+        parts = urlsplit(handler.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        routes = {
+            "/api/v2/network/search": self._wigle,
+            "/api/v2/bluetooth/search": self._wigle,
+            "/v2/process.php": self._unwired,
+            "/cell/getInArea": self._get_in_area,
+            "/ajax/getCells.php": self._ajax_cells,
+            "/shodan/host/search": self._shodan,
+        }
+        route = routes.get(parts.path)
+        with self._lock:
+            self.calls[parts.path] += 1
+        config = self.config
+        time.sleep(max(0.0, config.latency_ms + random.uniform(-1, 1) * config.jitter_ms) / 1000)
+        if route is None:
+            return self._send(handler, 404, {"error": "unknown endpoint"})
+        if random.random() < config.error_rate:
+            return self._send(handler, config.error_status, {"error": "stub failure"})
+        self._send(handler, 200, route(parts.path, query, body or {}))
+
+    def _send(self, handler: BaseHTTPRequestHandler, status: int, payload: Any) -> None:
+        data = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _wigle(self, path: str, query: dict[str, str], body: dict[str, Any]) -> dict[str, Any]:
+        if "latrange1" in query:
+            lat = (float(query["latrange1"]) + float(query["latrange2"])) / 2
+            lon = (float(query["longrange1"]) + float(query["longrange2"])) / 2
+        else:
+            lat, lon = 51.5, -0.1
+        key = query.get("ssid") or query.get("netid") or f"{lat:.4f},{lon:.4f}"
+        offset = int(query.get("searchAfter") or 0)
+        per_page = int(query.get("resultsPerPage") or 100)
+        count = min(per_page, max(0, self.config.records - offset))
+        results = []
+        for i in range(offset, offset + count):
+            rng = _rng(path, key, i)
+            trilat, trilong = _around(rng, lat, lon, 0.01)
+            results.append(
+                {
+                    "trilat": trilat,
+                    "trilong": trilong,
+                    "ssid": query.get("ssid") or f"net-{rng.randrange(10**6)}",
+                    "netid": query.get("netid") or _mac(rng),
+                    "name": f"dev-{i}" if "bluetooth" in path else None,
+                    "level": -rng.randrange(30, 95),
+                    "lastupdt": "2026-01-01T00:00:00.000Z",
+                }
+            )
+        more = offset + count < self.config.records
+        return {
+            "success": True,
+            "totalResults": self.config.records,
+            "results": results,
+            "searchAfter": str(offset + count) if more else None,
+        }
+
+    def _unwired(self, path: str, query: dict[str, str], body: dict[str, Any]) -> dict[str, Any]:
+        lat, lon = float(body.get("lat", 0.0)), float(body.get("lon", 0.0))
+        cells = []
+        for i in range(self.config.cells):
+            rng = _rng(path, round(lat, 4), round(lon, 4), i)
+            clat, clon = _around(rng, lat, lon, 0.005)
+            cells.append(
+                {"lat": clat, "lon": clon, "cellid": rng.randrange(10**7), "accuracy": 500}
+            )
+        return {"status": "ok", "cells": cells}
+
+    def _cells(self, path: str, bbox: list[float]) -> list[dict[str, Any]]:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        cells = []
+        for i in range(self.config.records):
+            rng = _rng(path, bbox, i)
+            cells.append(
+                {
+                    "lat": rng.uniform(min_lat, max_lat),
+                    "lon": rng.uniform(min_lon, max_lon),
+                    "cellid": rng.randrange(10**7),
+                    "lac": rng.randrange(10**4),
+                    "mcc": 234,
+                    "mnc": rng.randrange(1, 30),
+                    "samples": rng.randrange(1, 500),
+                    "radio": rng.choice(["GSM", "UMTS", "LTE"]),
+                }
+            )
+        return cells
+
+    def _get_in_area(self, path: str, query: dict[str, str], body: dict[str, Any]) -> Any:
+        bbox = [float(v) for v in query["BBOX"].split(",")]  # lat,lon,lat,lon
+        return {"count": self.config.records, "cells": self._cells(path, bbox)}
+
+    def _ajax_cells(self, path: str, query: dict[str, str], body: dict[str, Any]) -> Any:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in query["bbox"].split(","))
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [cell["lon"], cell["lat"]]},
+                "properties": {
+                    "cellid": cell["cellid"],
+                    "area": cell["lac"],
+                    "mcc": cell["mcc"],
+                    "net": cell["mnc"],
+                    "samples": cell["samples"],
+                    "radio": cell["radio"],
+                },
+            }
+            for cell in self._cells(path, [min_lat, min_lon, max_lat, max_lon])
+        ]
+        return {"type": "FeatureCollection", "features": features}
+
+    def _shodan(self, path: str, query: dict[str, str], body: dict[str, Any]) -> dict[str, Any]:
+        text = query.get("query", "")
+        lat, lon = 51.5, -0.1
+        if text.startswith("geo:"):
+            lat, lon = (float(v) for v in text[4:].split(",")[:2])
+        limit = int(query.get("limit") or self.config.records)
+        matches = []
+        for i in range(min(limit, self.config.records)):
+            rng = _rng(path, text, i)
+            mlat, mlon = _around(rng, lat, lon, 0.01)
+            matches.append(
+                {
+                    "ip_str": f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+                    "port": rng.choice([22, 80, 443, 554, 8080]),
+                    "data": "HTTP/1.1 200 OK\r\nServer: stub\r\n" + "x" * rng.randrange(200),
+                    "location": {"latitude": mlat, "longitude": mlon},
+                }
+            )
+        return {"total": len(matches), "matches": matches}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=StubConfig.jitter_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--error-status", type=int, default=StubConfig.error_status)
+    parser.add_argument("--records", type=int, default=StubConfig.records)
+    parser.add_argument("--cells", type=int, default=StubConfig.cells)
+    args = parser.parse_args()
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        records=args.records,
+        cells=args.cells,
+    )
+    stub = StubUpstream(config, host=args.host, port=args.port)
+    print(f"stub upstream on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ const ui = {
   searchBtn: document.getElementById("btn-search"),
   towersBtn: document.getElementById("btn-towers"),
   celltowerBtn: document.getElementById("btn-celltower"),
+  deviceTilesBtn: document.getElementById("btn-device-tiles"),
 
   lat: document.getElementById("lat"),
   lon: document.getElementById("lon"),
@@ -106,14 +107,54 @@ function markerIcon(type) {
   });
 }
 
-async function fetchJson(url, params) {
+async function readNdjson(res, onRecord, reqId) {
+  // Streamed responses: `{provider, devices}` records, then `{meta}` or `{error}`.
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const data = { devices: [] };
+  let buffer = "";
+  const handle = (line) => {
+    if (!line.trim()) return;
+    const record = JSON.parse(line);
+    if (record.error) {
+      const suffix = reqId ? `\n\nRequest ID: ${reqId}` : "";
+      throw new Error(`${record.error}${suffix}`);
+    }
+    if (record.devices) {
+      for (const d of record.devices) data.devices.push(d);
+      onRecord(record);
+    }
+    if (record.meta) data.meta = record.meta;
+  };
+  try {
+    for (;;) {
+      const { value, done } = await reader.read();
+      buffer += decoder.decode(value, { stream: !done });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      for (const line of lines) handle(line);
+      if (done) break;
+    }
+    handle(buffer);
+  } catch (e) {
+    reader.cancel().catch(() => {});
+    throw e;
+  }
+  return data;
+}
+
+async function fetchJson(url, params, { onRecord } = {}) {
   const qs = new URLSearchParams(params ?? {});
+  if (onRecord) qs.set("stream", "ndjson");
   const full = qs.toString() ? `${url}?${qs}` : url;
   const res = await fetch(full);
   const ct = res.headers.get("content-type") || "";
+  const reqId = res.headers.get("x-request-id") || "";
+  if (res.ok && onRecord && ct.includes("application/x-ndjson") && res.body) {
+    return { data: await readNdjson(res, onRecord, reqId), reqId };
+  }
   const isJson = ct.includes("application/json");
   const data = isJson ? await res.json() : await res.text();
-  const reqId = res.headers.get("x-request-id") || "";
   if (!res.ok) {
     const msg =
       (isJson && data && (data.error || data.message)) ||
@@ -121,11 +162,12 @@ async function fetchJson(url, params) {
     const suffix = reqId ? `\n\nRequest ID: ${reqId}` : "";
     throw new Error(`${msg}${suffix}`);
   }
+  if (onRecord && isJson && data && Array.isArray(data.devices)) onRecord({ devices: data.devices });
   return { data, reqId };
 }
 
 function setBusy(isBusy) {
-  const buttons = [ui.nearbyBtn, ui.searchBtn, ui.towersBtn, ui.celltowerBtn];
+  const buttons = [ui.nearbyBtn, ui.searchBtn, ui.towersBtn, ui.celltowerBtn, ui.deviceTilesBtn];
   for (const b of buttons) b.disabled = isBusy;
 }
 
@@ -142,10 +184,54 @@ cluster.addTo(map);
 const towersLayer = L.layerGroup().addTo(map);
 const focusLayer = L.layerGroup().addTo(map);
 
+// Above this many devices the browser stops clustering markers itself and draws
+// the server's per-viewport clusters (`/api/clusters`) instead.
+const CLIENT_MARKER_LIMIT = 1500;
+const serverClusterLayer = L.layerGroup().addTo(map);
+let serverClusterMode = null;
+
+async function refreshServerClusters() {
+  if (!serverClusterMode) return;
+  const b = map.getBounds();
+  const bbox = [b.getSouth(), b.getWest(), b.getNorth(), b.getEast()].map((v) => v.toFixed(6)).join(",");
+  const { data } = await fetchJson("/api/clusters", { bbox, zoom: map.getZoom(), mode: serverClusterMode });
+  serverClusterLayer.clearLayers();
+  if (data.points) {
+    addDeviceMarkers(data.points, serverClusterLayer);
+    return;
+  }
+  for (const c of data.clusters || []) {
+    const size = c.count < 10 ? "small" : c.count < 100 ? "medium" : "large";
+    const m = L.marker([c.lat, c.lon], {
+      icon: L.divIcon({
+        className: `marker-cluster marker-cluster-${size}`,
+        html: `<div><span>${c.count}</span></div>`,
+        iconSize: [40, 40],
+      }),
+    });
+    const histogram = Object.entries(c.types || {})
+      .map(([t, n]) => `<div>${safeText(t)}: ${n}</div>`)
+      .join("");
+    m.bindPopup(`<b>${c.count} device(s)</b>${histogram}`);
+    m.on("dblclick", () => map.setView([c.lat, c.lon], map.getZoom() + 2));
+    m.addTo(serverClusterLayer);
+  }
+}
+
+map.on("moveend", () => {
+  refreshServerClusters().catch(() => {});
+});
+
 function clearAll() {
   cluster.clearLayers();
   towersLayer.clearLayers();
   focusLayer.clearLayers();
+  serverClusterLayer.clearLayers();
+  serverClusterMode = null;
+  if (mapTiles) {
+    map.removeLayer(mapTiles);
+    mapTiles = null;
+  }
   state.devices = [];
   state.towers = [];
   state.selected = null;
@@ -154,7 +240,7 @@ function clearAll() {
   setStatus("Cleared");
 }
 
-function addDeviceMarkers(devices) {
+function addDeviceMarkers(devices, layer = cluster) {
   for (const d of devices) {
     const lat = Number(d.lat);
     const lon = Number(d.lon);
@@ -173,11 +259,11 @@ function addDeviceMarkers(devices) {
     if (d.info) parts.push(`<div>${safeText(d.info)}</div>`);
     if (type) parts.push(`<div>Type: ${type}</div>`);
     m.bindPopup(parts.join(""));
-    cluster.addLayer(m);
+    layer.addLayer(m);
   }
 }
 
-function addTowerMarkers(towers) {
+function addTowerMarkers(towers, layer = towersLayer) {
   for (const t of towers) {
     const lat = Number(t.lat);
     const lon = Number(t.lon);
@@ -192,7 +278,7 @@ function addTowerMarkers(towers) {
     const id = safeText(t.id || "");
     m.on("click", () => openDrawer(`Tower ${id || ""}`.trim(), t));
     m.bindPopup(`<b>Cell tower</b><div>ID: ${id}</div>`);
-    m.addTo(towersLayer);
+    m.addTo(layer);
   }
 }
 
@@ -472,14 +558,35 @@ ui.nearbyBtn.addEventListener("click", async () => {
     focusLatLon(lat, lon);
     setBusy(true);
     setStatus("Querying nearby…");
-    const { data } = await fetchJson("/nearby", { lat, lon, mode: ui.mode.value });
+    let shown = 0;
+    const { data } = await fetchJson(
+      "/nearby",
+      { lat, lon, mode: ui.mode.value },
+      {
+        onRecord: (record) => {
+          if (shown < CLIENT_MARKER_LIMIT) addDeviceMarkers(record.devices.slice(0, CLIENT_MARKER_LIMIT - shown));
+          shown += record.devices.length;
+          setStatus(`Querying nearby… ${shown} device(s)`);
+        },
+      },
+    );
     const devices = data.devices || [];
     state.devices = devices;
     state.lastExport = data;
-    addDeviceMarkers(devices);
+    if (devices.length > CLIENT_MARKER_LIMIT) {
+      cluster.clearLayers();
+      serverClusterMode = ui.mode.value;
+    }
     renderResults(devices, ui.mode.value);
-    setStatus(`Nearby: ${devices.length} device(s)${data.meta && data.meta.cached ? " (cached)" : ""}`);
+    const freshness = data.meta && data.meta.freshness && data.meta.freshness !== "fresh" ? `, ${data.meta.freshness}` : "";
+    setStatus(`Nearby: ${devices.length} device(s)${data.meta && data.meta.cached ? ` (cached${freshness})` : ""}`);
+    const providers = (data.meta && data.meta.providers) || {};
+    const degraded = Object.entries(providers).filter(([, p]) => p.status !== "ok");
+    if (degraded.length) {
+      showToast("warn", "Partial results", degraded.map(([name, p]) => `${name}: ${p.status}`).join(", "));
+    }
     if (devices.length) map.setView([lat, lon], Math.max(14, map.getZoom()));
+    if (serverClusterMode) await refreshServerClusters();
   } catch (e) {
     setStatus("Ready");
     showToast("bad", "Nearby failed", safeText(e.message || e));
@@ -496,11 +603,21 @@ ui.searchBtn.addEventListener("click", async () => {
     clearAll();
     setBusy(true);
     setStatus("Searching…");
-    const { data } = await fetchJson("/searchzz", { type, query });
+    let shown = 0;
+    const { data } = await fetchJson(
+      "/searchzz",
+      { type, query },
+      {
+        onRecord: (record) => {
+          addDeviceMarkers(record.devices);
+          shown += record.devices.length;
+          setStatus(`Searching… ${shown} result(s)`);
+        },
+      },
+    );
     const devices = data.devices || [];
     state.devices = devices;
     state.lastExport = data;
-    addDeviceMarkers(devices);
     renderResults(devices, type);
     setStatus(`Search: ${devices.length} result(s)`);
     if (devices.length) {
@@ -515,45 +632,141 @@ ui.searchBtn.addEventListener("click", async () => {
   }
 });
 
+// Tower and device layers are tile-backed (`/tiles/<layer>/{z}/{x}/{y}.geojson`): pans
+// fetch only the tiles that came into view, and the browser caches each tile URL.
+// A throttled (429) or failed (5xx) tile is retried with back-off; one that still
+// fails is dropped, so the next pan or zoom asks for it again.
+const TILE_RETRIES = 4;
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+const GeoJsonTiles = L.GridLayer.extend({
+  initialize(url, options) {
+    this._url = url;
+    this._items = new Map();
+    L.setOptions(this, options);
+    this.on("tileunload", (e) => {
+      const key = this._tileCoordsToKey(e.coords);
+      const entry = this._items.get(key);
+      if (entry) this.options.target.removeLayer(entry.group);
+      this._items.delete(key);
+      this.options.onChange?.(this.items());
+    });
+    this.on("tileerror", (e) => {
+      this._removeTile(this._tileCoordsToKey(e.coords));
+      this.options.onError?.(e.error);
+    });
+  },
+
+  async _load(url) {
+    for (let attempt = 0; ; attempt++) {
+      const res = await fetch(url);
+      if (res.ok) return res.json();
+      const retryable = res.status === 429 || res.status >= 500;
+      if (!retryable || attempt >= TILE_RETRIES || !this._map) {
+        const body = await res.json().catch(() => ({}));
+        throw new Error(body.error || `Tile request failed (HTTP ${res.status})`);
+      }
+      const retryAfter = Number(res.headers.get("Retry-After"));
+      await sleep(retryAfter > 0 ? retryAfter * 1000 : 500 * 2 ** attempt);
+    }
+  },
+
+  createTile(coords, done) {
+    const tile = document.createElement("div");
+    const key = this._tileCoordsToKey(coords);
+    this._load(L.Util.template(this._url, coords))
+      .then((fc) => {
+        const items = (fc.features || []).map((f) => ({
+          ...f.properties,
+          lat: f.geometry.coordinates[1],
+          lon: f.geometry.coordinates[0],
+        }));
+        const group = L.layerGroup();
+        this.options.addMarkers(items, group);
+        if (this._map && this._tiles[key]) {
+          this.options.target.addLayer(group);
+          this._items.set(key, { group, items });
+          this.options.onChange?.(this.items());
+        }
+        done(null, tile);
+      })
+      .catch((e) => done(e, tile));
+    return tile;
+  },
+
+  items() {
+    return [...this._items.values()].flatMap((entry) => entry.items);
+  },
+});
+
+let mapTiles = null;
+
+async function showTiles(layer, label, { target, addMarkers, kind }) {
+  const { lat, lon } = parseLatLon();
+  if (mapTiles) map.removeLayer(mapTiles);
+  target.clearLayers();
+  focusLatLon(lat, lon);
+  const { data: tilejson } = await fetchJson(`/tiles/${layer}.json`);
+  map.setView([lat, lon], Math.max(tilejson.minzoom, map.getZoom()));
+  let warned = false;
+  mapTiles = new GeoJsonTiles(tilejson.tiles[0], {
+    minZoom: tilejson.minzoom,
+    maxZoom: tilejson.maxzoom,
+    target,
+    addMarkers,
+    onChange: (items) => {
+      if (kind === "cell_tower") state.towers = items;
+      else state.devices = items;
+      state.lastExport = items;
+      renderResults(items, kind);
+      setStatus(`${label}: ${items.length}`);
+    },
+    onError: (e) => {
+      // One toast per layer; the failed tiles are asked for again on the next move.
+      if (warned) return;
+      warned = true;
+      showToast("warn", `${label}: some tiles failed`, `${safeText(e.message || e)}\n\nPan or zoom to retry.`);
+    },
+  }).addTo(map);
+  setStatus(`${label}: loading tiles…`);
+}
+
+function showTowerTiles(layer, label) {
+  return showTiles(layer, label, { target: towersLayer, addMarkers: addTowerMarkers, kind: "cell_tower" });
+}
+
+ui.deviceTilesBtn.addEventListener("click", async () => {
+  const mode = ui.mode.value;
+  try {
+    await showTiles(mode, mode === "bluetooth" ? "Bluetooth tiles" : "Wi-Fi tiles", {
+      target: cluster,
+      addMarkers: addDeviceMarkers,
+      kind: mode,
+    });
+  } catch (e) {
+    setStatus("Ready");
+    showToast("bad", "Device tiles failed", safeText(e.message || e));
+  }
+});
+
 ui.towersBtn.addEventListener("click", async () => {
   try {
-    const { lat, lon } = parseLatLon();
-    towersLayer.clearLayers();
-    focusLatLon(lat, lon);
-    setBusy(true);
-    setStatus("Fetching towers…");
-    const { data } = await fetchJson("/api/geo/towers", { lat, lon });
-    state.towers = Array.isArray(data) ? data : [];
-    state.lastExport = data;
-    addTowerMarkers(state.towers);
-    renderResults(state.towers, "cell_tower");
-    setStatus(`Towers: ${state.towers.length}`);
+    await showTowerTiles("towers", "Towers");
   } catch (e) {
     setStatus("Ready");
     showToast("bad", "Towers failed", safeText(e.message || e));
-  } finally {
-    setBusy(false);
   }
 });
 
 ui.celltowerBtn.addEventListener("click", async () => {
   try {
-    const { lat, lon } = parseLatLon();
-    towersLayer.clearLayers();
-    focusLatLon(lat, lon);
-    setBusy(true);
-    setStatus("Fetching GeoJSON towers…");
-    const { data } = await fetchJson("/api/geo/celltower", { lat, lon });
-    state.towers = Array.isArray(data) ? data : [];
-    state.lastExport = data;
-    addTowerMarkers(state.towers);
-    renderResults(state.towers, "cell_tower");
-    setStatus(`GeoJSON towers: ${state.towers.length}`);
+    await showTowerTiles("celltower", "GeoJSON towers");
   } catch (e) {
     setStatus("Ready");
     showToast("bad", "Celltower failed", safeText(e.message || e));
-  } finally {
-    setBusy(false);
   }
 });
 
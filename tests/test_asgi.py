@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+
+from wiretapper import metrics
+from wiretapper.asgi import create_asgi_app
+from wiretapper.config import Settings
+from wiretapper.services import http
+from wiretapper.services.aio import wigle as aio_wigle
+
+httpx = pytest.importorskip("httpx")
+
+
+def _settings() -> Settings:
+    return Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        debug=False,
+    )
+
+
+async def _get(app: Any, url: str, **kwargs: Any) -> Any:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.get(url, **kwargs)
+
+
+def test_nearby_runs_as_a_coroutine(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def network_search(**kwargs: Any) -> AsyncIterator[dict[str, Any]]:
+        await asyncio.sleep(0)
+        yield {"trilat": 70.0, "trilong": 80.0, "ssid": "Harbour", "netid": "11:22"}
+
+    monkeypatch.setattr(aio_wigle, "network_search_bbox", network_search)
+    app = create_asgi_app(_settings())
+
+    r = asyncio.run(_get(app, "/nearby?lat=70.0001&lon=80.0001"))
+    assert r.status_code == 200
+    body = r.json()
+    assert [d["ssid"] for d in body["devices"]] == ["Harbour"]
+    assert body["meta"]["providers"]["wigle"]["status"] == "ok"
+    assert r.headers["X-Request-ID"]
+    assert r.headers["ETag"]
+
+    r = asyncio.run(_get(app, "/nearby?lat=70.0001&lon=80.0001&stream=ndjson"))
+    records = [json.loads(line) for line in r.text.splitlines()]
+    assert records[0]["devices"][0]["ssid"] == "Harbour"
+    assert records[-1]["meta"]["cached"] is True
+
+    r = asyncio.run(_get(app, "/nearby"))
+    assert r.status_code == 400
+
+
+def test_nearby_records_request_metrics() -> None:
+    series = (
+        'wiretapper_request_duration_seconds_count{route="/nearby",method="GET",status="400"}',
+        'wiretapper_response_size_bytes_count{route="/nearby"}',
+    )
+
+    def _counts() -> list[float]:
+        text = metrics.render()
+        found = (re.search(rf"^{re.escape(name)} (\S+)$", text, re.MULTILINE) for name in series)
+        return [float(match.group(1)) if match else 0.0 for match in found]
+
+    before = _counts()
+    r = asyncio.run(_get(create_asgi_app(_settings()), "/nearby"))
+    assert r.status_code == 400
+    assert [after - was for after, was in zip(_counts(), before, strict=True)] == [1.0, 1.0]
+
+
+def test_other_routes_go_through_flask() -> None:
+    app = create_asgi_app(_settings())
+    r = asyncio.run(_get(app, "/api/status"))
+    assert r.status_code == 200
+    assert r.json()["providers"]["wigle"] is True
+
+
+def test_async_wigle_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    cursors: list[Any] = []
+
+    class _Response:
+        status_code = 200
+
+        def __init__(self, data: dict[str, Any]) -> None:
+            self._data = data
+
+        def json(self) -> dict[str, Any]:
+            return self._data
+
+    async def _fake_get(url: str, *, params: dict[str, Any], auth: Any) -> _Response:
+        cursors.append(params.get("searchAfter"))
+        page = int(params.get("searchAfter") or 0)
+        return _Response(
+            {"results": [{"netid": f"{page}:{i}"} for i in range(2)], "searchAfter": str(page + 1)}
+        )
+
+    monkeypatch.setattr(aio_wigle, "get", _fake_get)
+    monkeypatch.setattr(aio_wigle.blocking, "RESULTS_PER_PAGE", 2)
+
+    async def _run() -> tuple[list[dict[str, Any]], bool]:
+        found = aio_wigle.search_by_ssid(api_name="n", api_token="t", ssid="x", max_pages=3)
+        return [record async for record in found], found.truncated
+
+    records, truncated = asyncio.run(_run())
+    assert len(records) == 6
+    assert cursors == [None, "1", "2"]
+    assert truncated is True
+
+
+def test_async_acquire_shares_the_concurrency_cap() -> None:
+    scheduler = http._Scheduler("test", http.Quota(concurrency=1))
+
+    async def _run() -> None:
+        await scheduler.acquire_async(priority=0, max_wait_s=0.5)
+        waiter = asyncio.ensure_future(scheduler.acquire_async(priority=0, max_wait_s=0.5))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        scheduler.release()
+        await waiter
+        assert scheduler.stats()["in_flight"] == 1
+
+    asyncio.run(_run())
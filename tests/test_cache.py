@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from wiretapper import cache, fanout
+from wiretapper.cache import MemoryBackend, SQLiteBackend
+
+
+def test_lru_evicts_least_recently_used() -> None:
+    c = MemoryBackend(max_items=2, max_bytes=1_000_000)
+    c.set("wigle:a", [1], ttl_s=60)
+    c.set("wigle:b", [2], ttl_s=60)
+    assert c.get("wigle:a") == [1]
+    c.set("shodan:c", [3], ttl_s=60)
+
+    assert c.get("wigle:b") is None
+    assert c.get("wigle:a") == [1]
+    stats = c.stats()
+    assert stats["items"] == 2
+    assert stats["evictions"] == 1
+    assert stats["namespaces"]["wigle"]["hits"] == 2
+    assert stats["namespaces"]["shodan"]["items"] == 1
+
+
+def test_byte_budget_and_expiry_sweep() -> None:
+    c = MemoryBackend(max_items=100, max_bytes=2_000)
+    for i in range(20):
+        c.set(f"search:{i}", "x" * 200, ttl_s=60)
+    stats = c.stats()
+    assert 0 < stats["bytes"] <= 2_000
+    assert stats["evictions"] > 0
+
+    c.set("opencellid:short", [1, 2, 3], ttl_s=0.01)
+    time.sleep(0.02)
+    assert c.purge_expired() == 1
+    assert c.stats()["namespaces"]["opencellid"]["expirations"] == 1
+
+
+def test_stale_value_is_served_while_revalidating() -> None:
+    calls: list[int] = []
+
+    def fetch() -> list[int]:
+        calls.append(1)
+        time.sleep(0.05)
+        return [len(calls)]
+
+    value, freshness = cache.get_or_fetch("test:swr", fetch, ttl_s=0.01, hard_ttl_s=60)
+    assert (value, freshness) == ([1], cache.MISS)
+
+    time.sleep(0.02)
+    value, freshness = cache.get_or_fetch("test:swr", fetch, ttl_s=0.01, hard_ttl_s=60)
+    assert (value, freshness) == ([1], cache.REVALIDATING)
+    value, freshness = cache.get_or_fetch("test:swr", fetch, ttl_s=0.01, hard_ttl_s=60)
+    assert (value, freshness) == ([1], cache.STALE)
+
+    time.sleep(0.1)
+    assert cache.get("test:swr") == [2]
+    assert len(calls) == 2
+
+
+def test_full_revalidation_queue_serves_stale_without_refreshing() -> None:
+    calls: list[int] = []
+
+    def fetch() -> list[int]:
+        calls.append(1)
+        return [len(calls)]
+
+    cache.get_or_fetch("test:full", fetch, ttl_s=0.01, hard_ttl_s=60)
+    time.sleep(0.02)
+    release = threading.Event()
+    fanout.configure(max_workers=16, revalidate_workers=1)
+    try:
+        while fanout.submit_revalidation(release.wait):
+            pass
+        value, freshness = cache.get_or_fetch("test:full", fetch, ttl_s=0.01, hard_ttl_s=60)
+        assert (value, freshness) == ([1], cache.STALE)
+        assert len(calls) == 1
+    finally:
+        release.set()
+        fanout.configure(max_workers=16)
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path: Path) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    writer = SQLiteBackend(path, max_items=3, max_bytes=1_000_000)
+    reader = SQLiteBackend(path, max_items=3, max_bytes=1_000_000)
+
+    writer.set("wigle:wifi:16:1:2", [{"trilat": 1.5, "ssid": "x" * 2000}], ttl_s=60)
+    writer.set("opencellid:tile", b"\x00\x01", ttl_s=60)
+    assert reader.get("wigle:wifi:16:1:2") == [{"trilat": 1.5, "ssid": "x" * 2000}]
+    assert reader.get("opencellid:tile") == b"\x00\x01"
+
+    for i in range(10):
+        writer.set(f"search:{i}", [i], ttl_s=60)
+    writer.purge_expired()
+    assert reader.stats()["items"] == 3
+
+
+def test_sqlite_hits_do_not_wait_for_writers(tmp_path: Path) -> None:
+    path = str(tmp_path / "cache.sqlite3")
+    c = SQLiteBackend(path, max_items=10, max_bytes=1_000_000)
+    c.set("wigle:a", [1], ttl_s=60)
+
+    # Another process holds the write lock: hits still read, misses stay misses.
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert c.lookup("wigle:a") == ([1], False)
+        assert c.lookup("wigle:b") == (None, False)
+        c.set("wigle:b", [2], ttl_s=60)  # skipped, not raised
+    finally:
+        other.execute("ROLLBACK")
+    assert c.get("wigle:b") is None
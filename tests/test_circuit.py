@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import json
+import time
+from collections.abc import Iterator
+
+import pytest
+import requests
+
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.errors import CircuitOpenError, UpstreamError
+from wiretapper.services import breaker, http, opencellid, wigle
+
+SHODAN_URL = "https://api.shodan.io/shodan/host/search"
+
+
+@pytest.fixture(autouse=True)
+def _restore_breakers() -> Iterator[None]:
+    # Drop Shodan's 1 req/s spacing so the tests don't wait between calls.
+    http.configure_quotas({"shodan": http.Quota()}, max_wait_s=1.0)
+    yield
+    breaker.configure(breaker.Policy())
+    http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
+
+
+def _fake_session(monkeypatch: pytest.MonkeyPatch, statuses: list[int]) -> list[str]:
+    calls: list[str] = []
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = statuses[min(len(calls), len(statuses)) - 1]
+        response._content = b"[]"
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    return calls
+
+
+def test_breaker_trips_on_server_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = _fake_session(monkeypatch, [500])
+    breaker.configure(breaker.Policy(min_calls=3))
+
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            http.get(SHODAN_URL)
+    with pytest.raises(CircuitOpenError) as exc:
+        http.get(SHODAN_URL)
+
+    assert len(calls) == 3
+    assert exc.value.status_code == 503
+    assert exc.value.retry_after_s
+    stats = breaker.stats()["shodan"]
+    assert stats["state"] == breaker.OPEN
+    assert stats["trips"] == 1
+    assert stats["rejected"] == 1
+    assert breaker.stats()["wigle"]["state"] == breaker.CLOSED
+
+
+def test_half_open_probe_closes_circuit(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = _fake_session(monkeypatch, [500, 500, 200])
+    breaker.configure(breaker.Policy(min_calls=2, open_s=0.05))
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            http.get(SHODAN_URL)
+    assert breaker.stats()["shodan"]["state"] == breaker.OPEN
+
+    time.sleep(0.06)
+    assert http.get(SHODAN_URL).status_code == 200
+    assert len(calls) == 3
+    assert breaker.stats()["shodan"]["state"] == breaker.CLOSED
+
+
+def test_client_errors_do_not_trip(monkeypatch: pytest.MonkeyPatch) -> None:
+    _fake_session(monkeypatch, [404])
+    breaker.configure(breaker.Policy(min_calls=2))
+
+    for _ in range(4):
+        with pytest.raises(UpstreamError):
+            http.get(SHODAN_URL)
+    stats = breaker.stats()["shodan"]
+    assert stats["state"] == breaker.CLOSED
+    assert stats["calls"] == 0
+
+
+def test_nearby_skips_open_circuit(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        wigle,
+        "network_search_bbox",
+        lambda **kwargs: [{"trilat": 63.0, "trilong": 73.0, "ssid": "Mill", "netid": "11:22"}],
+    )
+    monkeypatch.setattr(opencellid, "unwiredlabs_process", lambda **kwargs: {"status": "ok"})
+    settings = Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key="key",
+        shodan_api_key="key",
+        debug=False,
+    )
+    client = create_app(settings).test_client()
+    circuit = breaker.get("shodan")
+    assert circuit is not None
+    for _ in range(settings.circuit_min_calls):
+        circuit.record(failed=True, latency_s=0.01, error="ConnectionError")
+
+    r = client.get("/nearby?lat=63.0001&lon=73.0001")
+    assert r.status_code == 200
+    body = r.get_json()
+    assert [d["ssid"] for d in body["devices"]] == ["Mill"]
+    assert body["meta"]["providers"]["shodan"]["status"] == "skipped"
+    assert client.get("/api/status").get_json()["circuits"]["shodan"]["state"] == "open"
+
+
+def test_search_skips_open_circuit_for_every_type() -> None:
+    settings = Settings(
+        wigle_api_name=None,
+        wigle_api_token=None,
+        opencellid_api_key=None,
+        shodan_api_key="key",
+        debug=False,
+    )
+    client = create_app(settings).test_client()
+    circuit = breaker.get("shodan")
+    assert circuit is not None
+    for _ in range(settings.circuit_min_calls):
+        circuit.record(failed=True, latency_s=0.01, error="ConnectionError")
+
+    r = client.get("/searchzz?type=network&query=org:Example&stream=ndjson")
+    assert r.status_code == 200
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert records[-1]["meta"]["skipped"] == ["shodan"]
@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from wiretapper.classify import classify_device, classify_many
+
+
+def test_first_matching_category_wins() -> None:
+    # "SAMSUNG CAR" hits both tv and car keywords: car comes first in the rules.
+    assert classify_device("Samsung Car Kit", "router") == "car"
+    assert classify_device("BRAVIA-4K", "router") == "tv"
+    assert classify_device("Garmin Dash Cam 57", "router") == "dashcam"
+    assert classify_device("Garmin Venu", "router") == "iot"
+    assert classify_device("front door ring", "router") == "camera"
+    assert classify_device("linksys", "router") == "router"
+    assert classify_device(None, "bluetooth") == "bluetooth"
+    assert classify_device("x" * 4096 + "reolink", "iot_device") == "camera"
+
+
+def test_classify_many_matches_classify_device() -> None:
+    names = ["Tesla Model 3", None, "Sony WH-1000XM4", "Tesla Model 3", "home-net"]
+    assert classify_many(names, "bluetooth") == [
+        classify_device(name, "bluetooth") for name in names
+    ]
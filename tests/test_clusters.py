@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from wiretapper import clusters
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.services import opencellid, shodan, wigle
+
+
+def _devices(n: int) -> list[dict[str, object]]:
+    rng = random.Random(3)
+    return [
+        {
+            "lat": 48.85 + rng.uniform(-0.05, 0.05),
+            "lon": 2.35 + rng.uniform(-0.05, 0.05),
+            "type": rng.choice(["router", "camera", "car"]),
+        }
+        for _ in range(n)
+    ] + [{"lat": None, "lon": 2.0, "type": "router"}]
+
+
+def test_numpy_and_python_aggregation_agree(monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("numpy")
+    devices = _devices(2000)
+    vectorized = clusters.aggregate(devices, zoom=12)
+    monkeypatch.setattr(clusters, "np", None)
+    assert clusters.aggregate(devices, zoom=12) == vectorized
+
+
+def test_clusters_bounded_by_grid_not_devices() -> None:
+    found = clusters.aggregate(_devices(5000), zoom=10)
+    assert sum(c["count"] for c in found) == 5000
+    assert len(found) <= 9  # 0.1 degree box at zoom 10 spans at most 3x3 64 px cells
+    assert set().union(*(c["types"] for c in found)) == {"router", "camera", "car"}
+
+
+def test_clusters_endpoint_reads_cached_tiles(monkeypatch: pytest.MonkeyPatch) -> None:
+    networks = [
+        {"trilat": 60.1 + i * 1e-4, "trilong": 25.1, "ssid": f"Net{i}", "netid": f"00:{i:02x}"}
+        for i in range(20)
+    ]
+    monkeypatch.setattr(wigle, "network_search_bbox", lambda **kwargs: networks)
+    monkeypatch.setattr(opencellid, "unwiredlabs_process", lambda **kwargs: {"status": "ok"})
+    monkeypatch.setattr(shodan, "host_search", lambda **kwargs: [])
+    settings = Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key="key",
+        shodan_api_key="key",
+        debug=False,
+    )
+    client = create_app(settings).test_client()
+    assert client.get("/nearby?lat=60.1&lon=25.1").status_code == 200
+
+    r = client.get("/api/clusters?bbox=60.09,25.09,60.11,25.11&zoom=12")
+    body = r.get_json()
+    assert r.status_code == 200
+    assert body["meta"] == {"devices": 20, "complete": True}
+    assert sum(c["count"] for c in body["clusters"]) == 20
+    assert "points" not in body
+
+    r = client.get("/api/clusters?bbox=60.09,25.09,60.11,25.11&zoom=18")
+    assert len(r.get_json()["points"]) == 20
+    assert client.get("/api/clusters?bbox=1,2,3&zoom=5").status_code == 400
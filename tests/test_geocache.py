@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from typing import Any
+
+from wiretapper import geocache, tiles
+
+
+def test_nearby_queries_reuse_cached_tiles() -> None:
+    calls: list[tiles.BBox] = []
+
+    def fetch(bbox: tiles.BBox) -> list[dict[str, Any]]:
+        calls.append(bbox)
+        min_lat, min_lon, max_lat, max_lon = bbox
+        return [
+            {
+                "lat": min_lat + (max_lat - min_lat) * i / 10,
+                "lon": min_lon + (max_lon - min_lon) / 2,
+            }
+            for i in range(10)
+        ]
+
+    coords = geocache.float_coords("lat", "lon")
+    first, freshness = geocache.get_bbox(
+        "test:reuse",
+        tiles.bbox_around(40.0, -3.0, 0.01),
+        zoom=16,
+        ttl_s=60,
+        fetch=fetch,
+        coords=coords,
+    )
+    assert freshness == "miss"
+    assert len(calls) == 1
+    assert all(
+        tiles.contains(tiles.bbox_around(40.0, -3.0, 0.01), r["lat"], r["lon"]) for r in first
+    )
+
+    # ~20 m away: fully covered by the tiles fetched above.
+    _, freshness = geocache.get_bbox(
+        "test:reuse",
+        tiles.bbox_around(40.0002, -3.0002, 0.005),
+        zoom=16,
+        ttl_s=60,
+        fetch=fetch,
+        coords=coords,
+    )
+    assert freshness == "fresh"
+    assert len(calls) == 1
+
+    # Panning east only fetches the tiles that are not cached yet.
+    geocache.get_bbox(
+        "test:reuse",
+        tiles.bbox_around(40.0, -2.99, 0.01),
+        zoom=16,
+        ttl_s=60,
+        fetch=fetch,
+        coords=coords,
+    )
+    assert len(calls) == 2
+    assert calls[1][1] > calls[0][1]
+
+
+def test_point_queries_share_a_tile() -> None:
+    calls: list[tuple[float, float]] = []
+
+    def fetch(lat: float, lon: float) -> dict[str, Any]:
+        calls.append((lat, lon))
+        return {"status": "ok", "cells": []}
+
+    x, y = tiles.lonlat_to_tile(-3.0, 40.0, 16)
+    min_lat, min_lon, max_lat, max_lon = tiles.tile_bounds(16, x, y)
+    for lat, lon in [(min_lat + 1e-5, min_lon + 1e-5), (max_lat - 1e-5, max_lon - 1e-5)]:
+        geocache.get_point("test:point", lat, lon, zoom=16, ttl_s=60, fetch=fetch)
+    assert calls == [tiles.tile_center(16, x, y)]
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from typing import Any
+
+import pytest
+
+from wiretapper import tiles
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.services import opencellid
+
+
+def test_tower_tiles_are_cached_and_immutable(monkeypatch: pytest.MonkeyPatch) -> None:
+    z, x, y = 15, 18000, 10000
+    min_lat, min_lon, max_lat, max_lon = tiles.tile_bounds(z, x, y)
+    lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    calls: list[str] = []
+
+    def get_in_area(*, key: str, bbox: str) -> dict[str, Any]:
+        calls.append(bbox)
+        return {"cells": [{"cellid": 7, "lat": lat, "lon": lon, "mcc": 1, "radio": "LTE"}]}
+
+    monkeypatch.setattr(opencellid, "get_in_area", get_in_area)
+    settings = Settings(
+        wigle_api_name=None,
+        wigle_api_token=None,
+        opencellid_api_key="key",
+        shodan_api_key=None,
+        debug=False,
+    )
+    client = create_app(settings).test_client()
+
+    tilejson = client.get("/tiles/towers.json").get_json()
+    url = tilejson["tiles"][0].format(z=z, x=x, y=y)
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.mimetype == "application/geo+json"
+    assert "immutable" in r.headers["Cache-Control"]
+    (feature,) = r.get_json()["features"]
+    assert feature["geometry"]["coordinates"] == [round(lon, 6), round(lat, 6)]
+    assert feature["properties"]["id"] == "7"
+
+    assert client.get(url).get_data() == r.get_data()
+    assert len(calls) == 1
+
+    assert client.get("/tiles/towers/3/1/1.geojson").status_code == 400
+    assert client.get(f"/tiles/nope/{z}/{x}/{y}.geojson").status_code == 404
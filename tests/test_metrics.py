@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import re
+import threading
+
+from wiretapper import metrics
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+
+TEST_COUNTER = metrics.Metric("wiretapper_test_total", "counter", "Test counter.", ("name",))
+TEST_SECONDS = metrics.Metric(
+    "wiretapper_test_seconds", "histogram", "Test histogram.", ("name",), (0.1, 1.0)
+)
+
+
+def _value(text: str, series: str) -> float:
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.MULTILINE)
+    assert match, series
+    return float(match.group(1))
+
+
+def test_per_thread_counters_are_summed() -> None:
+    def _work() -> None:
+        for _ in range(1000):
+            metrics.inc(TEST_COUNTER, "threads")
+
+    workers = [threading.Thread(target=_work) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    metrics.inc(TEST_COUNTER, "threads", value=2)
+
+    # Finished threads are folded into the retired shard and keep counting.
+    for _ in range(2):
+        assert _value(metrics.render(), 'wiretapper_test_total{name="threads"}') == 4002
+
+
+def test_histogram_exposition() -> None:
+    for value in (0.05, 0.5, 5.0):
+        metrics.observe(TEST_SECONDS, value, 'quote"d')
+
+    text = metrics.render()
+    assert "# TYPE wiretapper_test_seconds histogram" in text
+    series = 'wiretapper_test_seconds_bucket{name="quote\\"d",le="%s"}'
+    assert _value(text, series % "0.1") == 1
+    assert _value(text, series % "1") == 2
+    assert _value(text, series % "+Inf") == 3
+    assert _value(text, 'wiretapper_test_seconds_count{name="quote\\"d"}') == 3
+    assert _value(text, 'wiretapper_test_seconds_sum{name="quote\\"d"}') == 5.55
+
+
+def test_metrics_route_reports_requests_and_rejections() -> None:
+    settings = Settings(None, None, None, None, debug=False, rate_limit_rpm=1)
+    client = create_app(settings).test_client()
+    client.get("/nearby?lat=1.5&lon=2.5")
+    assert client.get("/nearby?lat=1.5&lon=2.5").status_code == 429
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    text = r.get_data(as_text=True)
+    ok = 'wiretapper_request_duration_seconds_count{route="/nearby",method="GET",status="200"}'
+    assert _value(text, ok) >= 1
+    assert _value(text, 'wiretapper_ratelimit_rejected_total{bucket="nearby"}') >= 1
+    assert "# TYPE wiretapper_upstream_in_flight gauge" in text
+    assert 'wiretapper_upstream_in_flight{provider="wigle"} 0' in text
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import json
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from wiretapper import geocache, ratelimit
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.errors import UpstreamError
+from wiretapper.services import http, opencellid, shodan, wigle
+
+
+def _settings(**overrides: object) -> Settings:
+    values: dict[str, object] = {
+        "wigle_api_name": "name",
+        "wigle_api_token": "token",
+        "opencellid_api_key": "key",
+        "shodan_api_key": "key",
+        "debug": False,
+        "provider_deadline_s": 0.3,
+    }
+    values.update(overrides)
+    return Settings(**values)  # type: ignore[arg-type]
+
+
+def test_nearby_returns_partial_results(monkeypatch: pytest.MonkeyPatch) -> None:
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        return [{"trilat": 10.0, "trilong": 20.0, "ssid": "Office", "netid": "aa:bb"}]
+
+    def unwiredlabs_process(**kwargs: object) -> dict[str, object]:
+        raise UpstreamError("Upstream API error: HTTP 500", status_code=500)
+
+    def host_search(**kwargs: object) -> list[dict[str, object]]:
+        time.sleep(1.0)
+        return []
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+    monkeypatch.setattr(opencellid, "unwiredlabs_process", unwiredlabs_process)
+    monkeypatch.setattr(shodan, "host_search", host_search)
+
+    client = create_app(_settings()).test_client()
+    started = time.monotonic()
+    r = client.get("/nearby?lat=10.0001&lon=20.0001")
+    assert time.monotonic() - started < 0.9
+
+    assert r.status_code == 200
+    body = r.get_json()
+    assert [d["ssid"] for d in body["devices"]] == ["Office"]
+    providers = body["meta"]["providers"]
+    assert providers["wigle"]["status"] == "ok"
+    assert providers["opencellid"]["status"] == "error"
+    assert providers["shodan"]["status"] == "timeout"
+    assert set(providers["wigle"]) >= {"status", "latency_ms", "cached"}
+
+
+def test_unexpected_provider_errors_fail_only_that_provider(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def host_search(**kwargs: object) -> list[dict[str, object]]:
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    def unwiredlabs_process(**kwargs: object) -> dict[str, object]:
+        return {"status": "ok", "cells": [{"lat": 12.0, "lon": 22.0, "cellid": 7, "radio": "LTE"}]}
+
+    monkeypatch.setattr(shodan, "host_search", host_search)
+    monkeypatch.setattr(opencellid, "unwiredlabs_process", unwiredlabs_process)
+
+    client = create_app(_settings(wigle_api_name=None, wigle_api_token=None)).test_client()
+    r = client.get("/nearby?lat=12.0001&lon=22.0001")
+    assert r.status_code == 200
+    body = r.get_json()
+    assert body["devices"] and body["meta"]["providers"]["opencellid"]["status"] == "ok"
+    assert body["meta"]["providers"]["shodan"] == {
+        "status": "error",
+        "latency_ms": mock.ANY,
+        "cached": False,
+        "error": "Internal error (ValueError)",
+    }
+
+    r = client.get("/nearby?lat=12.0001&lon=22.0001&stream=ndjson")
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert records[-1]["meta"]["providers"]["shodan"]["status"] == "error"
+
+
+def test_nearby_flags_truncated_wigle_results(monkeypatch: pytest.MonkeyPatch) -> None:
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        return geocache.Partial(
+            [{"trilat": 11.0, "trilong": 21.0, "ssid": "Dense", "netid": "ee:ff"}]
+        )
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+
+    client = create_app(_settings(opencellid_api_key=None, shodan_api_key=None)).test_client()
+    meta = client.get("/nearby?lat=11.0001&lon=21.0001").get_json()["meta"]
+    assert meta["truncated"] is True
+    assert meta["providers"]["wigle"]["truncated"] is True
+
+
+def test_nearby_fails_when_every_provider_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    def failing(**kwargs: object) -> object:
+        raise UpstreamError("Upstream request failed")
+
+    monkeypatch.setattr(wigle, "bluetooth_search_bbox", failing)
+
+    client = create_app(_settings()).test_client()
+    r = client.get("/nearby?lat=10.0002&lon=20.0002&mode=bluetooth")
+    assert r.status_code == 502
+    assert r.get_json()["meta"]["providers"]["wigle"]["status"] == "error"
+
+    r = client.get("/nearby?lat=10.0002&lon=20.0002&mode=bluetooth&stream=sse")
+    events = r.get_data(as_text=True).strip().split("\n\n")
+    assert events[-1].startswith("event: error\ndata: ")
+
+
+def test_nearby_streams_ndjson_then_meta(monkeypatch: pytest.MonkeyPatch) -> None:
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        return [{"trilat": 30.0, "trilong": 40.0, "ssid": "Cafe", "netid": "cc:dd"}]
+
+    def host_search(**kwargs: object) -> list[dict[str, object]]:
+        time.sleep(0.2)
+        return []
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+    monkeypatch.setattr(opencellid, "unwiredlabs_process", lambda **kwargs: {"status": "ok"})
+    monkeypatch.setattr(shodan, "host_search", host_search)
+
+    client = create_app(_settings()).test_client()
+    r = client.get("/nearby?lat=30.0001&lon=40.0001&stream=ndjson")
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert records[0] == {"provider": "wigle", "devices": [mock.ANY]}
+    assert records[0]["devices"][0]["ssid"] == "Cafe"
+    assert list(records[-1]) == ["meta"]
+    assert records[-1]["meta"]["providers"]["shodan"]["status"] == "ok"
+
+    r = client.get("/nearby?lat=30.0001&lon=40.0001", headers={"Accept": "text/event-stream"})
+    assert r.mimetype == "text/event-stream"
+    events = r.get_data(as_text=True).strip().split("\n\n")
+    assert events[0].startswith("event: devices\ndata: ")
+    assert events[-1].startswith("event: meta\ndata: ")
+
+
+def test_batch_nearby_shares_lookups_per_tile(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[object] = []
+
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        calls.append(kwargs["bbox"])
+        return [{"trilat": 50.0, "trilong": 60.0, "ssid": "Depot", "netid": "ee:ff"}]
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+    client = create_app(_settings(opencellid_api_key=None, shodan_api_key=None)).test_client()
+
+    body = {"points": [[50.00001, 60.00001], {"lat": 50.00002, "lon": 60.00002}, [-50, -60]]}
+    r = client.post("/api/batch/nearby", json=body)
+    assert r.status_code == 200
+    assert r.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert sorted(rec["index"] for rec in records[:-1]) == [0, 1, 2]
+    assert records[-1]["meta"] == {"queries": 3, "lookups": 2, "upstream_calls": 2}
+    assert len(calls) == 2
+
+    r = client.post("/api/batch/nearby", json=body)
+    records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert records[-1]["meta"]["upstream_calls"] == 0
+    assert len(calls) == 2
+
+    r = client.post("/api/batch/nearby", json={"points": [[1, 2]], "modes": ["lte"]})
+    assert r.status_code == 400
+
+
+def test_batch_waits_for_quota_and_is_charged_for_upstream_calls(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        time.sleep(0.02)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"results": []}'
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    settings = _settings(
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        rate_limit_rpm=5,
+        quota_specs=(("wigle", "per_s=0,concurrency=1"),),
+        quota_max_wait_s=0.01,
+    )
+    client = create_app(settings).test_client()
+    try:
+        body = {"points": [[52.0 + i / 10, 13.0] for i in range(6)]}
+        r = client.post("/api/batch/nearby", json=body)
+        records = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+        # Every lookup outlasts the normal quota wait, and every one is admitted.
+        statuses = {rec["meta"]["providers"]["wigle"]["status"] for rec in records[:-1]}
+        assert statuses == {"ok"}
+        assert records[-1]["meta"]["upstream_calls"] == 6
+
+        # One token at admission and five for the calls after the first: the
+        # second batch is refused.
+        assert client.post("/api/batch/nearby", json=body).status_code == 429
+
+        # Answered from cached tiles, a batch costs only its admission token.
+        ratelimit.clear()
+        for _ in range(5):
+            r = client.post("/api/batch/nearby", json=body)
+            assert r.status_code == 200
+            assert json.loads(r.get_data(as_text=True).splitlines()[-1])["meta"] == {
+                "queries": 6,
+                "lookups": 6,
+                "upstream_calls": 0,
+            }
+        assert client.post("/api/batch/nearby", json=body).status_code == 429
+    finally:
+        http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
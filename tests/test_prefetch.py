@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Iterator
+
+import pytest
+import requests
+
+from wiretapper import cli, prefetch
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.services import http
+
+
+@pytest.fixture(autouse=True)
+def _restore() -> Iterator[None]:
+    yield
+    prefetch.configure(prefetch.Policy())
+    http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
+
+
+def _fake_session(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    queries: list[str] = []
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        queries.append(kwargs["params"]["query"])  # type: ignore[index]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"matches": []}'
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    return queries
+
+
+def _settings(**overrides: object) -> Settings:
+    values: dict[str, object] = {
+        "debug": False,
+        "shodan_api_key": "key",
+        "quota_specs": (("shodan", "per_s=0,concurrency=8"),),
+    }
+    values.update(overrides)
+    return Settings(None, None, None, **values)  # type: ignore[arg-type]
+
+
+def test_neighbours_nearest_ring_first() -> None:
+    cell = prefetch.cell_of("wifi", 10.005, 20.005)
+    assert cell == ("wifi", 500, 1000)
+    around = prefetch.neighbours(cell, 2)
+    assert len(around) == 24 and cell not in around
+    assert set(around[:8]) == {
+        ("wifi", 500 + dr, 1000 + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+    } - {cell}
+    assert prefetch.cell_center(cell) == pytest.approx((10.01, 20.01))
+
+
+def test_nearby_prefetches_neighbours_and_counts_hits(monkeypatch: pytest.MonkeyPatch) -> None:
+    queries = _fake_session(monkeypatch)
+    client = create_app(_settings(prefetch_rings=1)).test_client()
+
+    assert client.get("/nearby?lat=33.301&lon=44.301").status_code == 200
+    deadline = time.monotonic() + 5.0
+    while prefetch.stats()["cells_warmed"] < 8 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(queries) == 9
+
+    # A pan by one box width lands on what was prefetched.
+    r = client.get("/nearby?lat=33.321&lon=44.301")
+    assert r.get_json()["meta"]["cached"] is True
+    stats = client.get("/api/status").get_json()["prefetch"]
+    assert stats["hits"] == 1
+    assert stats["hit_rate"] == round(1 / stats["cells_warmed"], 3)
+
+
+def test_prefetch_keeps_quota_reserve(monkeypatch: pytest.MonkeyPatch) -> None:
+    queries = _fake_session(monkeypatch)
+    http.configure_quotas({"shodan": http.Quota(per_day=4)}, max_wait_s=1.0)
+    settings = _settings()
+    outcomes = [
+        prefetch.warm_cell(settings, ("wifi", 1700, 2200 + i), at=(34.01, 44.01 + i), reserve=0.5)
+        for i in range(4)
+    ]
+    assert [o["shodan"] for o in outcomes] == ["warmed", "warmed", "skipped", "skipped"]
+    assert len(queries) == 2
+
+
+def test_warm_command_fills_an_area(monkeypatch: pytest.MonkeyPatch) -> None:
+    queries = _fake_session(monkeypatch)
+    monkeypatch.setenv("SHODAN_API_KEY", "key")
+    monkeypatch.setenv("WIRETAPPER_QUOTA_SHODAN", "per_s=0,concurrency=8")
+    assert cli.main(["warm", "--bbox", "36.001,46.001,36.039,46.019", "--modes", "wifi"]) == 0
+    # Shodan answers per tile: every tile of the two cells, once.
+    assert len(queries) > 2 and len(set(queries)) == len(queries)
+    warmed = len(queries)
+    assert cli.main(["warm", "--bbox", "36.001,46.001,36.039,46.019"]) == 0
+    assert len(queries) == warmed
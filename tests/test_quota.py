@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator
+
+import pytest
+import requests
+
+from wiretapper.errors import QuotaExceededError
+from wiretapper.services import http
+
+
+@pytest.fixture(autouse=True)
+def _restore_quotas() -> Iterator[None]:
+    yield
+    http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
+
+
+def _fake_session(
+    monkeypatch: pytest.MonkeyPatch, status: int, headers: dict[str, str]
+) -> list[str]:
+    calls: list[str] = []
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    return calls
+
+
+def test_daily_budget_fails_fast(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = _fake_session(monkeypatch, 200, {})
+    http.configure_quotas({"shodan": http.Quota(per_day=2, concurrency=1)}, max_wait_s=0.1)
+
+    http.get("https://api.shodan.io/shodan/host/search")
+    http.get("https://api.shodan.io/shodan/host/search")
+    with pytest.raises(QuotaExceededError, match="daily quota spent"):
+        http.get("https://api.shodan.io/shodan/host/search")
+
+    assert len(calls) == 2
+    stats = http.quota_stats()["shodan"]
+    assert stats["remaining_today"] == 0
+    assert stats["rejected"] == 1
+
+
+def test_retry_after_blocks_provider(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = _fake_session(monkeypatch, 429, {"Retry-After": "30"})
+    http.configure_quotas({"wigle": http.Quota()}, max_wait_s=0.1)
+
+    with pytest.raises(QuotaExceededError) as first:
+        http.get("https://api.wigle.net/api/v2/network/search")
+    assert first.value.retry_after_s == 30
+    with pytest.raises(QuotaExceededError, match="retry after"):
+        http.get("https://api.wigle.net/api/v2/network/search")
+    assert len(calls) == 1
+
+
+def test_interactive_calls_overtake_background() -> None:
+    scheduler = http._Scheduler("test", http.Quota(concurrency=1))
+    scheduler.acquire(priority=http.PRIORITY_INTERACTIVE, max_wait_s=1.0)
+    order: list[str] = []
+
+    def _call(name: str, priority: int) -> None:
+        scheduler.acquire(priority=priority, max_wait_s=5.0)
+        order.append(name)
+        scheduler.release()
+
+    background = threading.Thread(target=_call, args=("background", http.PRIORITY_BACKGROUND))
+    background.start()
+    while scheduler.stats()["queued"] < 1:
+        time.sleep(0.01)
+    interactive = threading.Thread(target=_call, args=("interactive", http.PRIORITY_INTERACTIVE))
+    interactive.start()
+    while scheduler.stats()["queued"] < 2:
+        time.sleep(0.01)
+
+    scheduler.release()
+    background.join()
+    interactive.join()
+    assert order == ["interactive", "background"]
+
+
+def test_upstream_override_keeps_path_and_provider(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = _fake_session(monkeypatch, 200, {})
+    http.configure_quotas({"shodan": http.Quota(per_day=1)}, max_wait_s=0.1)
+    http.configure_upstream("http://127.0.0.1:8099/")
+    try:
+        http.get_json("https://api.shodan.io/shodan/host/search", params={"query": "x"})
+        # Still charged to the provider named by the original host.
+        with pytest.raises(QuotaExceededError):
+            http.get_json("https://api.shodan.io/shodan/host/search")
+    finally:
+        http.configure_upstream(None)
+    assert calls == ["http://127.0.0.1:8099/shodan/host/search"]
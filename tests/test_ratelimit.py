@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+
+from wiretapper import ratelimit
+from wiretapper.ratelimit import RateLimiter, SQLiteRateLimiter
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_limiter_is_bounded_and_expires_idle_buckets() -> None:
+    clock = _Clock()
+    limiter = RateLimiter(max_keys=3, clock=clock)
+
+    assert limiter.allow("a", per_minute=1)
+    assert not limiter.allow("a", per_minute=1)
+    for key in ("b", "c", "d"):
+        assert limiter.allow(key, per_minute=1)
+    stats = limiter.stats()
+    assert stats["buckets"] == 3
+    assert stats["evicted"] == 1  # "a" was the least recently used
+
+    clock.now += 61
+    assert limiter.allow("e", per_minute=1)
+    assert limiter.stats()["expired"] == 2
+    assert limiter.stats()["buckets"] <= 3
+
+
+def test_forwarded_for_only_trusted_from_proxies() -> None:
+    ratelimit.configure(max_keys=100, trusted_proxies=["10.0.0.0/8"])
+    try:
+        spoofed = "6.6.6.6, 203.0.113.7"
+        assert ratelimit.client_address("198.51.100.1", spoofed) == "198.51.100.1"
+        assert ratelimit.client_address("10.0.0.2", spoofed) == "203.0.113.7"
+        assert ratelimit.client_address("10.0.0.2", "203.0.113.7, 10.1.1.1") == "203.0.113.7"
+        assert ratelimit.client_address("10.0.0.2", "garbage") == "10.0.0.2"
+    finally:
+        ratelimit.configure(max_keys=100, trusted_proxies=[])
+
+
+def test_sqlite_limiter_is_shared_between_workers(tmp_path: Path) -> None:
+    clock = _Clock()
+    path = str(tmp_path / "ratelimit.sqlite3")
+    # Two limiters on one file stand in for two worker processes.
+    first = SQLiteRateLimiter(path, max_keys=2, clock=clock)
+    second = SQLiteRateLimiter(path, max_keys=2, clock=clock)
+
+    assert first.allow("nearby:a", per_minute=2)
+    assert second.allow("nearby:a", per_minute=2)
+    assert not first.allow("nearby:a", per_minute=2)
+    clock.now += 30
+    assert second.allow("nearby:a", per_minute=2)
+
+    for key in ("nearby:b", "nearby:c"):
+        clock.now += 1
+        assert first.allow(key, per_minute=2)
+    clock.now += 1
+    first._prune(clock.now)
+    assert first.stats()["buckets"] == 2
+    assert first.stats()["evicted"] == 1  # "nearby:a" was the least recently used
+    clock.now += 61
+    first._prune(clock.now)
+    assert second.stats()["buckets"] == 0
+
+
+def test_sqlite_limiter_fails_open_while_the_file_is_locked(tmp_path: Path) -> None:
+    path = str(tmp_path / "ratelimit.sqlite3")
+    limiter = SQLiteRateLimiter(path, max_keys=10)
+    assert limiter.allow("nearby:a", per_minute=1)
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert limiter.allow("nearby:a", per_minute=1)
+        assert limiter.stats()["failed_open"] == 1
+    finally:
+        other.execute("ROLLBACK")
+    assert not limiter.allow("nearby:a", per_minute=1)
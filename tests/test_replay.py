@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+import requests
+
+from wiretapper.errors import ReplayMissError
+from wiretapper.services import http, opencellid, replay, shodan
+
+
+@pytest.fixture(autouse=True)
+def _restore_modes() -> Iterator[None]:
+    http.configure_quotas({}, max_wait_s=1.0)
+    yield
+    replay.configure(path=None, modes={})
+    http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
+
+
+def _fake_session(monkeypatch: pytest.MonkeyPatch, body: dict[str, object]) -> list[str]:
+    calls: list[str] = []
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        calls.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode()
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    return calls
+
+
+def test_record_then_replay_without_network(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    archive = str(tmp_path / "replay.sqlite")
+    matches = [{"ip_str": "10.0.0.9", "port": 80}]
+    _fake_session(monkeypatch, {"matches": matches})
+    replay.configure(path=archive, modes={"shodan": "record"})
+    assert shodan.host_search(api_key="real", query="geo:50.0,8.0,1", limit=5) == matches
+
+    calls = _fake_session(monkeypatch, {"matches": []})
+    replay.configure(path=archive, modes={"shodan": "replay"})
+    # Exact match regardless of the key; then a point inside the recorded circle.
+    assert shodan.host_search(api_key="other", query="geo:50.0,8.0,1", limit=5) == matches
+    assert shodan.host_search(api_key="other", query="geo:50.001,8.001,1", limit=5) == matches
+    with pytest.raises(ReplayMissError):
+        shodan.host_search(api_key="other", query="geo:20.0,8.0,1", limit=5)
+    with pytest.raises(ReplayMissError):
+        shodan.host_search(api_key="other", query="geo:50.0,8.0,1", limit=6)
+    assert calls == []
+    assert replay.stats()["counts"] == {"exact": 1, "contains": 1, "miss": 2}
+
+
+def test_replay_falls_back_to_nearest_point(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    archive = str(tmp_path / "replay.sqlite")
+    replay.configure(path=archive, modes={"unwiredlabs": "record"}, max_distance_m=500)
+    for lat, cells in ((51.500, [1]), (51.502, [2])):
+        _fake_session(monkeypatch, {"status": "ok", "cells": cells})
+        opencellid.unwiredlabs_process(token="t", lat=lat, lon=-0.1)
+
+    replay.configure(path=archive, modes={"unwiredlabs": "replay"}, max_distance_m=500)
+    assert opencellid.unwiredlabs_process(token="t", lat=51.5015, lon=-0.1)["cells"] == [2]
+    with pytest.raises(ReplayMissError):
+        opencellid.unwiredlabs_process(token="t", lat=51.52, lon=-0.1)
+
+
+def test_modes_need_an_archive() -> None:
+    with pytest.raises(ValueError):
+        replay.configure(path=None, modes={"wigle": "replay"})
+    with pytest.raises(ValueError):
+        replay.configure(path="x.sqlite", modes={"wigle": "offline"})
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import gzip
+import time
+
+import pytest
+
+from wiretapper import nearby
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.services import wigle
+
+
+def _client():
+    settings = Settings(
+        wigle_api_name=None,
+        wigle_api_token=None,
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        debug=False,
+        compress_min_bytes=64,
+    )
+    return create_app(settings).test_client()
+
+
+def test_etag_answers_304_for_unchanged_body() -> None:
+    client = _client()
+    first = client.get("/searchzz?type=location&query=51.505,-0.09")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get(
+        "/searchzz?type=location&query=51.505,-0.09", headers={"If-None-Match": etag}
+    )
+    assert again.status_code == 304
+    assert again.get_data() == b""
+
+
+def test_large_bodies_are_gzipped() -> None:
+    client = _client()
+    plain = client.get("/searchzz?type=location&query=51.505,-0.09")
+    r = client.get(
+        "/searchzz?type=location&query=51.505,-0.09", headers={"Accept-Encoding": "gzip"}
+    )
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["Vary"]
+    assert gzip.decompress(r.get_data()) == plain.get_data()
+    assert r.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+
+def test_nearby_etag_ignores_timings(monkeypatch: pytest.MonkeyPatch) -> None:
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        time.sleep(0.01)
+        return [{"trilat": 48.1, "trilong": 11.5, "ssid": "Lab", "netid": "aa:01"}]
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+    settings = Settings("name", "token", None, None, debug=False)
+    client = create_app(settings).test_client()
+    first = client.get("/nearby?lat=48.1&lon=11.5")
+    # The second answer comes from the cache, with other latencies and `cached`.
+    again = client.get(
+        "/nearby?lat=48.1&lon=11.5", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert again.status_code == 304
+
+
+def test_nearby_match_skips_rendering(monkeypatch: pytest.MonkeyPatch) -> None:
+    def network_search(**kwargs: object) -> list[dict[str, object]]:
+        return [{"trilat": 52.52, "trilong": 13.405, "ssid": "Lab", "netid": "aa:02"}]
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search)
+    settings = Settings("name", "token", None, None, debug=False)
+    client = create_app(settings).test_client()
+    first = client.get("/nearby?lat=52.52&lon=13.405")
+
+    def render(*args: object) -> None:
+        raise AssertionError("rendered a body for a matching tag")
+
+    monkeypatch.setattr(nearby, "_json", render)
+    again = client.get(
+        "/nearby?lat=52.52&lon=13.405", headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert again.status_code == 304
+    assert again.headers["ETag"] == first.headers["ETag"]
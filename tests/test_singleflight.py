@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from wiretapper import cache
+from wiretapper.errors import UpstreamError
+from wiretapper.singleflight import Group
+
+
+def test_concurrent_misses_share_one_upstream_call() -> None:
+    calls = 0
+    lock = threading.Lock()
+
+    def fetch() -> list[int]:
+        nonlocal calls
+        with lock:
+            calls += 1
+        time.sleep(0.1)
+        return [1, 2, 3]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(
+            pool.map(lambda _: cache.get_or_fetch("test:sf:shared", fetch, ttl_s=60), range(8))
+        )
+
+    assert calls == 1
+    assert all(value == [1, 2, 3] for value, _ in results)
+
+
+def test_waiters_receive_the_leaders_error() -> None:
+    group = Group()
+    started = threading.Event()
+
+    def failing() -> None:
+        started.set()
+        time.sleep(0.1)
+        raise UpstreamError("Upstream request failed")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(group.do, "k", failing)
+        started.wait()
+        waiter = pool.submit(group.do, "k", failing)
+        for future in (leader, waiter):
+            with pytest.raises(UpstreamError):
+                future.result()
+
+    assert group.stats() == {"leaders": 1, "coalesced": 1, "in_flight": 0}
+
+
+def test_refused_spawn_releases_the_key() -> None:
+    group = Group()
+    assert not group.spawn("k", lambda: 1, submit=lambda run: False)
+    assert group.do("k", lambda: 2) == (2, False)
+    assert group.stats()["in_flight"] == 0
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from wiretapper import cache, geocache, lookups, store
+from wiretapper.config import Settings
+from wiretapper.services import wigle
+
+
+def test_nearby_wifi_is_answered_from_the_store(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls: list[Any] = []
+
+    def network_search_bbox(**kwargs: Any) -> list[dict[str, Any]]:
+        calls.append(kwargs["bbox"])
+        return [
+            {"trilat": 48.8566, "trilong": 2.3522, "ssid": "Cafe", "netid": "AA:BB:CC:00:00:01"},
+            {"trilat": 48.8567, "trilong": 2.3523, "ssid": "Cafe", "netid": "AA:BB:CC:00:00:01"},
+        ]
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search_bbox)
+    store.configure(path=str(tmp_path / "store.sqlite3"))
+    settings = Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        store_path=str(tmp_path / "store.sqlite3"),
+    )
+    try:
+        devices, _ = lookups.nearby_wifi(settings, lat=48.8566, lon=2.3522)
+        assert len(calls) == 1
+        assert store.stats()["observations"] == {"wigle:wifi": 1}
+
+        cache.clear()
+        devices, _ = lookups.nearby_wifi(settings, lat=48.8566, lon=2.3522)
+        assert len(calls) == 1
+        assert [d["bssid"] for d in devices] == ["AA:BB:CC:00:00:01"]
+        assert devices[0]["lat"] == 48.8567
+    finally:
+        store.configure(path=None)
+
+
+def test_truncated_area_is_flagged_and_not_covered(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    calls: list[Any] = []
+
+    def network_search_bbox(**kwargs: Any) -> list[dict[str, Any]]:
+        calls.append(kwargs["bbox"])
+        return geocache.Partial(
+            [{"trilat": 47.2184, "trilong": -1.5536, "ssid": "Cafe", "netid": "AA:BB:CC:00:00:01"}]
+        )
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search_bbox)
+    store.configure(path=str(tmp_path / "store.sqlite3"))
+    settings = Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        store_path=str(tmp_path / "store.sqlite3"),
+    )
+    try:
+        devices, _ = lookups.nearby_wifi(settings, lat=47.2184, lon=-1.5536)
+        assert geocache.is_partial(devices) and len(devices) == 1
+        assert store.stats()["observations"] == {"wigle:wifi": 1}
+
+        # Neither the cache tiles nor the store coverage answer the next query.
+        devices, _ = lookups.nearby_wifi(settings, lat=47.2184, lon=-1.5536)
+        assert len(calls) == 2
+        assert geocache.is_partial(devices)
+    finally:
+        store.configure(path=None)
+
+
+def test_store_errors_do_not_fail_the_lookup(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def network_search_bbox(**kwargs: Any) -> list[dict[str, Any]]:
+        return [{"trilat": 45.764, "trilong": 4.8357, "ssid": "Gare", "netid": "AA:BB:CC:00:00:02"}]
+
+    def locked(*args: Any, **kwargs: Any) -> Any:
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(wigle, "network_search_bbox", network_search_bbox)
+    # Both the coverage read and the write fail; the lookup goes to upstream.
+    monkeypatch.setattr(store.ObservationStore, "is_covered", locked)
+    monkeypatch.setattr(store.ObservationStore, "ingest", locked)
+    store.configure(path=str(tmp_path / "store.sqlite3"))
+    settings = Settings(
+        wigle_api_name="name",
+        wigle_api_token="token",
+        opencellid_api_key=None,
+        shodan_api_key=None,
+        store_path=str(tmp_path / "store.sqlite3"),
+    )
+    try:
+        devices, _ = lookups.nearby_wifi(settings, lat=45.764, lon=4.8357)
+        assert [d["bssid"] for d in devices] == ["AA:BB:CC:00:00:02"]
+    finally:
+        store.configure(path=None)
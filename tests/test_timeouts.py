@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator
+
+import pytest
+import requests
+
+from wiretapper.errors import UpstreamError
+from wiretapper.services import breaker, http, timeouts
+
+URL = "https://api.wigle.net/api/v2/network/search"
+
+
+@pytest.fixture(autouse=True)
+def _restore_policies() -> Iterator[None]:
+    http.configure_quotas({}, max_wait_s=1.0)
+    yield
+    timeouts.configure(timeouts.Policy())
+    breaker.configure(breaker.Policy())
+    http.configure_quotas(http.DEFAULT_QUOTAS, max_wait_s=2.0)
+
+
+def _fake_session(monkeypatch: pytest.MonkeyPatch, outcomes: list[object]) -> list[object]:
+    """Each call takes the next outcome: an exception, a delay in seconds, or a status."""
+    timeouts_seen: list[object] = []
+    lock = threading.Lock()
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        with lock:
+            timeouts_seen.append(kwargs["timeout"])
+            outcome = outcomes[min(len(timeouts_seen), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        if isinstance(outcome, float):
+            time.sleep(outcome)
+            outcome = 200
+        response = requests.Response()
+        response.status_code = int(outcome)  # type: ignore[call-overload]
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    return timeouts_seen
+
+
+def test_read_timeout_follows_latency() -> None:
+    timeouts.configure(timeouts.Policy(read_min_s=0.01, min_samples=10))
+    endpoint = timeouts.endpoint(URL)
+    assert endpoint.read_timeout_s() == 10.0
+
+    for _ in range(10):
+        endpoint.observe(0.1)
+    assert 0.3 <= endpoint.read_timeout_s() <= 0.4
+    assert timeouts.stats()["api.wigle.net/api/v2/network/search"]["p99_ms"] >= 100
+
+
+def test_idempotent_get_is_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    seen = _fake_session(monkeypatch, [requests.ConnectionError(), 503, 200])
+    timeouts.configure(timeouts.Policy(backoff_s=0.01))
+
+    assert http.get(URL).status_code == 200
+    assert len(seen) == 3
+    assert seen[0] == (3.05, pytest.approx(10.0, abs=0.1))
+    assert timeouts.stats()["api.wigle.net/api/v2/network/search"]["retries"] == 2
+
+
+def test_posts_and_client_errors_are_not_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    seen = _fake_session(monkeypatch, [requests.ConnectionError(), 404])
+    timeouts.configure(timeouts.Policy(backoff_s=0.01))
+
+    with pytest.raises(UpstreamError, match="request failed"):
+        http.post_json(URL, payload={})
+    with pytest.raises(UpstreamError, match="HTTP 404"):
+        http.get(URL)
+    assert len(seen) == 2
+
+
+def test_slow_get_is_hedged(monkeypatch: pytest.MonkeyPatch) -> None:
+    seen = _fake_session(monkeypatch, [1.0, 200])
+    timeouts.configure(timeouts.Policy(hedge_quantile=0.9, min_samples=5))
+    endpoint = timeouts.endpoint(URL)
+    for _ in range(5):
+        endpoint.observe(0.02)
+
+    started = time.monotonic()
+    assert http.get(URL).status_code == 200
+    assert time.monotonic() - started < 0.5
+    assert len(seen) == 2
+    stats = endpoint.stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+from wiretapper import profiling
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+from wiretapper.services import http
+
+
+def _settings(**overrides: object) -> Settings:
+    values: dict[str, object] = {"debug": False, "shodan_api_key": "key"}
+    values.update(overrides)
+    return Settings(None, None, None, **values)  # type: ignore[arg-type]
+
+
+def test_nearby_reports_spans_and_forwards_request_id(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent: list[object] = []
+
+    def _request(method: str, url: str, **kwargs: object) -> requests.Response:
+        sent.append(kwargs["headers"])
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"matches": [{"ip_str": "10.0.0.1", "port": 80, "data": "nginx",'
+        response._content += b' "location": {"latitude": 41.0, "longitude": 42.0}}]}'
+        return response
+
+    monkeypatch.setattr(http._SESSION, "request", _request)
+    client = create_app(_settings()).test_client()
+
+    r = client.get("/nearby?lat=41.0001&lon=42.0001", headers={"X-Request-ID": "req-41"})
+    assert r.status_code == 200
+    assert r.get_json()["devices"][0]["ip"] == "10.0.0.1"
+    assert sent == [{"X-Request-ID": "req-41"}]
+    # Spans recorded on the fanout worker land in the request's breakdown.
+    names = [part.split(";")[0] for part in r.headers["Server-Timing"].split(", ")]
+    assert names[0] == "ratelimit"
+    assert {"upstream-shodan", "normalize", "render", "finalize"} <= set(names)
+    assert names[-1] == "total"
+
+
+def test_profiling_is_guarded_by_token(tmp_path: Path) -> None:
+    disabled = create_app(_settings()).test_client()
+    assert disabled.post("/api/profile").status_code == 404
+
+    settings = _settings(profile_dir=str(tmp_path), profile_token="s3cret")
+    client = create_app(settings).test_client()
+    assert client.post("/api/profile", headers={"X-Wiretapper-Profile": "nope"}).status_code == 403
+
+    r = client.get(
+        "/api/status", headers={"X-Request-ID": "../p1", "X-Wiretapper-Profile": "s3cret"}
+    )
+    r.close()
+    assert (tmp_path / "request-.._p1.prof").stat().st_size > 0
+
+    r = client.post("/api/profile?seconds=0.05", headers={"X-Wiretapper-Profile": "s3cret"})
+    assert r.status_code == 202
+    path = Path(r.get_json()["path"])
+    deadline = time.monotonic() + 2.0
+    while profiling.window_running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert path.parent == tmp_path
+    assert "MainThread;" in path.read_text()
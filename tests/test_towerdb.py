@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import gzip
+import random
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from wiretapper import cli, towerdb
+from wiretapper.app import create_app
+from wiretapper.config import Settings
+
+pytest.importorskip("numpy")
+
+_HEADER = (
+    "radio,mcc,net,area,cell,unit,lon,lat,range,samples,changeable,created,updated,averageSignal"
+)
+
+
+@pytest.fixture(autouse=True)
+def _restore() -> Iterator[None]:
+    yield
+    towerdb.configure(path=None)
+
+
+def _export(path: Path, rows: list[tuple[object, ...]]) -> Path:
+    lines = [_HEADER]
+    for radio, mcc, net, area, cell, lat, lon, samples in rows:
+        lines.append(f"{radio},{mcc},{net},{area},{cell},,{lon},{lat},1000,{samples},1,0,0,0")
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def _random_rows(n: int) -> list[tuple[object, ...]]:
+    rnd = random.Random(7)
+    return [
+        (
+            rnd.choice(["GSM", "UMTS", "LTE", "NR"]),
+            234,
+            rnd.randint(1, 30),
+            rnd.randint(1, 60000),
+            i,
+            round(rnd.uniform(51.0, 52.0), 5),
+            round(rnd.uniform(-1.0, 0.5), 5),
+            rnd.randint(1, 500),
+        )
+        for i in range(n)
+    ]
+
+
+def test_import_matches_a_full_scan(tmp_path: Path) -> None:
+    rows = _random_rows(3000)
+    export = _export(tmp_path / "cell_towers.csv.gz", rows)
+    with gzip.open(export, "at") as f:
+        f.write("LTE,234,10,1,bad,,x,y,0,1,1,0,0,0\n")
+    assert towerdb.import_csv(tmp_path / "index", [export]) == 3000
+
+    index = towerdb.TowerIndex(tmp_path / "index")
+    bbox = (51.2, -0.6, 51.45, -0.1)
+    found = index.query(bbox)
+    expected = {
+        str(cell)
+        for _, _, _, _, cell, lat, lon, _ in rows
+        if bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]
+    }
+    assert {t["id"] for t in found} == expected
+    tower = found[0]
+    assert set(tower) == {"id", "lat", "lon", "lac", "mcc", "mnc", "signal", "radio"}
+    assert tower["mcc"] == 234 and tower["radio"] in ("GSM", "UMTS", "LTE", "NR")
+
+
+def test_diff_replaces_changed_cells_and_adds_new_ones(tmp_path: Path) -> None:
+    base = [
+        ("LTE", 234, 10, 100, 1, 51.50, -0.10, 5),
+        ("LTE", 234, 10, 100, 2, 51.51, -0.11, 5),
+        ("GSM", 234, 10, 100, 1, 51.52, -0.12, 5),  # same cell id, other radio
+    ]
+    path = tmp_path / "index"
+    towerdb.import_csv(path, [_export(tmp_path / "full.csv.gz", base)])
+    diff = [
+        ("LTE", 234, 10, 100, 1, 51.60, -0.20, 9),
+        ("LTE", 234, 10, 100, 1, 51.61, -0.21, 12),  # the later row wins
+        ("NR", 234, 15, 7, 99, 51.55, -0.15, 3),
+    ]
+    assert (
+        cli.main(
+            ["towers", "diff", str(_export(tmp_path / "diff.csv.gz", diff)), "--path", str(path)]
+        )
+        == 0
+    )
+
+    index = towerdb.TowerIndex(path)
+    assert index.rows == 4
+    towers = {(t["radio"], t["id"]): t for t in index.query((51.0, -1.0, 52.0, 0.0))}
+    assert set(towers) == {("LTE", "1"), ("LTE", "2"), ("GSM", "1"), ("NR", "99")}
+    assert (towers["LTE", "1"]["lat"], towers["LTE", "1"]["signal"]) == (51.61, 12)
+    assert len(list(path.glob("gen-*"))) == 1
+
+
+def test_towers_route_served_locally_without_a_key(tmp_path: Path) -> None:
+    path = tmp_path / "index"
+    towerdb.import_csv(path, [_export(tmp_path / "full.csv.gz", _random_rows(500))])
+    settings = Settings(None, None, None, None, debug=False, towers_path=str(path))
+    client = create_app(settings).test_client()
+
+    r = client.get("/api/geo/towers?lat=51.5&lon=-0.3")
+    assert r.status_code == 200
+    assert r.get_json() and all(abs(t["lat"] - 51.5) <= 0.05 for t in r.get_json())
+    status = client.get("/api/status").get_json()["towerdb"]
+    assert status["enabled"] is True and status["rows"] == 500
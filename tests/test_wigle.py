@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+import pytest
+
+from wiretapper.services import wigle
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self._data = data
+
+    def json(self) -> dict[str, Any]:
+        return self._data
+
+
+def _fake_pages(monkeypatch: pytest.MonkeyPatch, pages: int, per_page: int) -> list[Any]:
+    cursors: list[Any] = []
+    lock = threading.Lock()
+
+    def _get(url: str, *, params: dict[str, Any], auth: Any) -> _Response:
+        cursor = params.get("searchAfter")
+        with lock:
+            cursors.append(cursor)
+        page = 0 if cursor is None else int(cursor)
+        results = [{"netid": f"{page}:{i}"} for i in range(per_page)]
+        after = str(page + 1) if page + 1 < pages else None
+        return _Response({"results": results, "searchAfter": after})
+
+    monkeypatch.setattr(wigle, "get", _get)
+    monkeypatch.setattr(wigle, "RESULTS_PER_PAGE", per_page)
+    return cursors
+
+
+def test_follows_search_after_lazily(monkeypatch: pytest.MonkeyPatch) -> None:
+    cursors = _fake_pages(monkeypatch, pages=3, per_page=2)
+
+    found = wigle.search_by_ssid(api_name="n", api_token="t", ssid="x", max_pages=10)
+    assert cursors == []
+    assert [r["netid"] for r in found] == ["0:0", "0:1", "1:0", "1:1", "2:0", "2:1"]
+    assert cursors == [None, "1", "2"]
+    assert found.truncated is False
+
+
+def test_stops_at_max_records_and_max_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    cursors = _fake_pages(monkeypatch, pages=10, per_page=2)
+
+    search = wigle.search_by_bssid(api_name="n", api_token="t", bssid="b", max_records=3)
+    assert [r["netid"] for r in search] == ["0:0", "0:1", "1:0"]
+    assert cursors == [None, "1"]
+    assert search.truncated is True
+
+    cursors.clear()
+    search = wigle.network_search_bbox(
+        api_name="n", api_token="t", bbox=(0, 0, 1, 1), max_records=100, max_pages=2
+    )
+    assert len(list(search)) == 4
+    assert cursors == [None, "1"]
+    assert search.truncated is True
@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from . import fanout, geocache, store, tiles
+from .config import Settings
+from .lookups import (
+    POINT_RADIUS,
+    WIGLE_DELTA,
+    _cell_coords,
+    _cell_uid,
+    _partial_if,
+    _shodan_coords,
+    _shodan_uid,
+    _unwired_cell_list,
+    _wigle_coords,
+    _wigle_uid,
+    normalize_shodan_banner,
+    normalize_shodan_banners,
+    normalize_unwired_cell,
+    normalize_unwired_cells,
+    normalize_wigle_bluetooth,
+    normalize_wigle_bluetooth_devices,
+    normalize_wigle_network,
+    normalize_wigle_networks,
+)
+from .services.aio import opencellid, shodan, wigle
+
+# Coroutine versions of the `/nearby` lookups in `wiretapper.lookups`. They read
+# and write the same cache tiles and observation store; store I/O runs on a
+# worker thread so SQLite never blocks the event loop.
+
+
+async def _gather(records: AsyncIterator[dict[str, Any]]) -> list[dict[str, Any]]:
+    found = [record async for record in records]
+    return geocache.Partial(found) if geocache.is_partial(records) else found
+
+
+def _through_store(
+    settings: Settings,
+    source: str,
+    fetch: Callable[[tiles.BBox], Awaitable[list[dict[str, Any]]]],
+    *,
+    uid: store.Uid,
+    coords: store.Coords,
+    normalize: store.Normalize,
+) -> Callable[[tiles.BBox], Awaitable[list[dict[str, Any]]]]:
+    async def _fetch(bbox: tiles.BBox) -> list[dict[str, Any]]:
+        db = store.get_store()
+        if db is None:
+            return await fetch(bbox)
+        zoom = settings.geo_tile_zoom
+        stored = await asyncio.to_thread(
+            db.try_covered, source, bbox, bbox, zoom=zoom, max_age_s=settings.store_freshness_s
+        )
+        if stored is not None:
+            return stored
+        records = await fetch(bbox)
+        await asyncio.to_thread(
+            db.try_ingest,
+            source,
+            records,
+            covered=None if geocache.is_partial(records) else bbox,
+            zoom=zoom,
+            uid=uid,
+            coords=coords,
+            normalize=normalize,
+        )
+        return records
+
+    return _fetch
+
+
+def _through_store_point(
+    settings: Settings,
+    source: str,
+    fetch: Callable[[float, float], Awaitable[Any]],
+    *,
+    records_of: Callable[[Any], list[dict[str, Any]]],
+    rebuild: Callable[[list[dict[str, Any]]], Any],
+    uid: store.Uid,
+    coords: store.Coords,
+    normalize: store.Normalize,
+) -> Callable[[float, float], Awaitable[Any]]:
+    async def _fetch(lat: float, lon: float) -> Any:
+        db = store.get_store()
+        if db is None:
+            return await fetch(lat, lon)
+        zoom = settings.geo_tile_zoom
+        tile_bbox = tiles.tile_bounds(zoom, *tiles.lonlat_to_tile(lon, lat, zoom))
+        nearby = tiles.bbox_around(lat, lon, POINT_RADIUS)
+        stored = await asyncio.to_thread(
+            db.try_covered,
+            source,
+            tile_bbox,
+            nearby,
+            zoom=zoom,
+            max_age_s=settings.store_freshness_s,
+        )
+        if stored is not None:
+            return rebuild(stored)
+        data = await fetch(lat, lon)
+        await asyncio.to_thread(
+            db.try_ingest,
+            source,
+            records_of(data),
+            covered=tile_bbox,
+            zoom=zoom,
+            uid=uid,
+            coords=coords,
+            normalize=normalize,
+        )
+        return data
+
+    return _fetch
+
+
+async def _wigle_area(
+    settings: Settings,
+    namespace: str,
+    search: Callable[..., AsyncIterator[dict[str, Any]]],
+    normalize: store.Normalize,
+    *,
+    lat: float,
+    lon: float,
+) -> tuple[list[dict[str, Any]], str]:
+    ttls = settings.cache_ttls("nearby")
+    return await geocache.get_bbox_async(
+        namespace,
+        tiles.bbox_around(lat, lon, WIGLE_DELTA),
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store(
+            settings,
+            namespace,
+            lambda bbox: _gather(
+                search(
+                    api_name=settings.wigle_api_name,
+                    api_token=settings.wigle_api_token,
+                    bbox=bbox,
+                    max_records=settings.wigle_max_records,
+                    max_pages=settings.wigle_max_pages,
+                )
+            ),
+            uid=_wigle_uid,
+            coords=_wigle_coords,
+            normalize=normalize,
+        ),
+        coords=_wigle_coords,
+    )
+
+
+async def nearby_wifi(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    networks, freshness = await _wigle_area(
+        settings,
+        "wigle:wifi",
+        wigle.network_search_bbox,
+        normalize_wigle_network,
+        lat=lat,
+        lon=lon,
+    )
+    return _partial_if(networks, normalize_wigle_networks(networks)), freshness
+
+
+async def nearby_bluetooth(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    found, freshness = await _wigle_area(
+        settings,
+        "wigle:bt",
+        wigle.bluetooth_search_bbox,
+        normalize_wigle_bluetooth,
+        lat=lat,
+        lon=lon,
+    )
+    return _partial_if(found, normalize_wigle_bluetooth_devices(found)), freshness
+
+
+async def nearby_cells(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    ttls = settings.cache_ttls("nearby")
+    data, freshness = await geocache.get_point_async(
+        "unwired",
+        lat,
+        lon,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store_point(
+            settings,
+            "unwired",
+            lambda tlat, tlon: opencellid.unwiredlabs_process(
+                token=settings.opencellid_api_key, lat=tlat, lon=tlon
+            ),
+            records_of=_unwired_cell_list,
+            rebuild=lambda cells: {"status": "ok", "cells": cells},
+            uid=_cell_uid,
+            coords=_cell_coords,
+            normalize=normalize_unwired_cell,
+        ),
+    )
+    return normalize_unwired_cells(data), freshness
+
+
+async def nearby_shodan(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    ttls = settings.cache_ttls("nearby")
+    banners, freshness = await geocache.get_point_async(
+        "shodan:geo",
+        lat,
+        lon,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store_point(
+            settings,
+            "shodan:geo",
+            lambda tlat, tlon: shodan.host_search(
+                api_key=settings.shodan_api_key, query=f"geo:{tlat:.5f},{tlon:.5f},1", limit=5
+            ),
+            records_of=list,
+            rebuild=lambda banners: banners[:5],
+            uid=_shodan_uid,
+            coords=_shodan_coords,
+            normalize=normalize_shodan_banner,
+        ),
+    )
+    return normalize_shodan_banners(banners), freshness
+
+
+def nearby_tasks(
+    settings: Settings, *, lat: float, lon: float, mode: str
+) -> dict[str, fanout.AsyncTask]:
+    """Coroutine provider lookups for `/nearby`, like `lookups.nearby_tasks`."""
+    tasks: dict[str, fanout.AsyncTask] = {}
+    has_wigle = bool(settings.wigle_api_name and settings.wigle_api_token)
+    if mode == "bluetooth":
+        if has_wigle:
+            tasks["wigle"] = lambda: nearby_bluetooth(settings, lat=lat, lon=lon)
+        return tasks
+    if has_wigle:
+        tasks["wigle"] = lambda: nearby_wifi(settings, lat=lat, lon=lon)
+    if settings.opencellid_api_key:
+        tasks["opencellid"] = lambda: nearby_cells(settings, lat=lat, lon=lon)
+    if settings.shodan_api_key:
+        tasks["shodan"] = lambda: nearby_shodan(settings, lat=lat, lon=lon)
+    return tasks
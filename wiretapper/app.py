@@ -1,11 +1,25 @@
 from __future__ import annotations
 
+import time
 from pathlib import Path
 
 from flask import Flask, Response, g, request
 
+from . import (
+    cache,
+    fanout,
+    metrics,
+    prefetch,
+    profiling,
+    ratelimit,
+    responses,
+    store,
+    timing,
+    towerdb,
+)
 from .config import Settings, load_settings
 from .routes import bp
+from .services import breaker, http, replay, timeouts
 
 
 def create_app(settings: Settings) -> Flask:
@@ -19,9 +33,93 @@ def create_app(settings: Settings) -> Flask:
         static_folder=str(static_dir) if static_dir.exists() else None,
         static_url_path="/static",
     )
+    app.json = responses.json_provider_class()(app)
     app.config["WIRETAPPER_SETTINGS"] = settings
+    cache.configure(
+        max_items=settings.cache_max_items,
+        max_bytes=settings.cache_max_bytes,
+        sweep_interval_s=settings.cache_sweep_interval_s,
+        backend=settings.cache_backend,
+        path=settings.cache_path,
+    )
+    fanout.configure(
+        max_workers=settings.fanout_workers,
+        batch_workers=settings.batch_workers,
+        revalidate_workers=settings.revalidate_workers,
+    )
+    store.configure(path=settings.store_path)
+    towerdb.configure(path=settings.towers_path)
+    prefetch.configure(
+        prefetch.Policy(
+            rings=settings.prefetch_rings,
+            reserve=settings.prefetch_reserve,
+            max_queue=settings.prefetch_max_queue,
+        )
+    )
+    ratelimit.configure(
+        max_keys=settings.rate_limit_max_clients,
+        trusted_proxies=settings.trusted_proxies,
+        backend=settings.rate_limit_backend,
+        path=settings.rate_limit_path,
+    )
+    http.configure_pool(pool_size=settings.http_pool_size)
+    http.configure_upstream(settings.upstream_override)
+    replay.configure(
+        path=settings.replay_path,
+        modes=dict(settings.provider_modes),
+        max_distance_m=settings.replay_max_distance_m,
+    )
+    breaker.configure(
+        breaker.Policy(
+            min_calls=settings.circuit_min_calls,
+            trip_rate=settings.circuit_trip_rate,
+            slow_call_s=settings.circuit_slow_call_s,
+            open_s=settings.circuit_open_s,
+        )
+    )
+    timeouts.configure(
+        timeouts.Policy(
+            connect_s=settings.http_connect_timeout_s,
+            read_min_s=settings.http_read_timeout_min_s,
+            read_max_s=settings.http_read_timeout_max_s,
+            multiplier=settings.http_timeout_multiplier,
+            retries=settings.http_retries,
+            budget_s=settings.http_retry_budget_s,
+            hedge_quantile=settings.http_hedge_quantile,
+        )
+    )
+    specs = dict(settings.quota_specs)
+    http.configure_quotas(
+        {
+            name: http.parse_quota(specs.get(name, ""), base=quota)
+            for name, quota in http.DEFAULT_QUOTAS.items()
+        },
+        max_wait_s=settings.quota_max_wait_s,
+    )
     app.register_blueprint(bp)
 
+    @app.before_request
+    def _start_timer() -> None:
+        g.started = time.perf_counter()
+
+    # Registered first so it runs last, after compression has set the final size.
+    @app.after_request
+    def _observe(response: Response) -> Response:
+        started = getattr(g, "started", None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe(
+            metrics.REQUEST_SECONDS,
+            time.perf_counter() - started,
+            route,
+            request.method,
+            str(response.status_code),
+        )
+        if not response.is_streamed and response.content_length is not None:
+            metrics.observe(metrics.RESPONSE_BYTES, response.content_length, route)
+        return response
+
     @app.before_request
     def _request_id() -> None:
         import uuid
@@ -35,6 +133,42 @@ def create_app(settings: Settings) -> Flask:
             response.headers["X-Request-ID"] = rid
         return response
 
+    @app.before_request
+    def _begin_spans() -> None:
+        timing.begin(g.request_id)
+        presented = request.headers.get("X-Wiretapper-Profile")
+        if settings.profile_dir and profiling.authorized(
+            settings.profile_dir, settings.profile_token, presented
+        ):
+            g.profile = profiling.start_request(settings.profile_dir, g.request_id)
+
+    # Registered before `_finalize` so it runs after it: compression is a span too.
+    @app.after_request
+    def _server_timing(response: Response) -> Response:
+        spans = timing.current()
+        if spans is None:
+            return response
+        response.headers["Server-Timing"] = spans.header()
+        profile = g.pop("profile", None)
+        fields = {"method": request.method, "path": request.path}
+
+        def _close() -> None:
+            # After the body went out, so a streamed response is timed in full.
+            if profile is not None:
+                profile.stop()
+            spans.log(**fields, status=response.status_code)
+            timing.end()
+
+        response.call_on_close(_close)
+        return response
+
+    @app.after_request
+    def _finalize(response: Response) -> Response:
+        with timing.span("finalize"):
+            return responses.finalize(
+                response, request, compress_min_bytes=settings.compress_min_bytes
+            )
+
     return app
 
 
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import sys
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from flask import Flask
+from werkzeug.wrappers import Request, Response
+
+from . import aio_lookups, fanout, metrics, nearby, responses, streaming, timing
+from .app import create_app
+from .config import Settings, load_settings
+from .data import dummy_nearby_devices
+from .errors import UpstreamError
+from .services.aio import http as aio_http
+
+# ASGI entry point (`uvicorn wiretapper.asgi:app`). `/nearby` runs as a coroutine
+# on the async service layer, so a lookup waiting on upstream holds no thread.
+# Every other route is served by the Flask app on a worker thread.
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+_LOG = logging.getLogger("wiretapper.asgi")
+
+
+def _environ(scope: Scope, body: bytes) -> dict[str, Any]:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ: dict[str, Any] = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        value = raw_value.decode("latin-1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+def _start(status: int, headers: list[tuple[str, str]]) -> dict[str, Any]:
+    return {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    }
+
+
+async def _wsgi(flask_app: Flask, environ: dict[str, Any], send: Send) -> None:
+    # The Flask app runs on a worker thread; each body chunk is handed back to the
+    # event loop as it is produced, so streamed responses stay streamed.
+    loop = asyncio.get_running_loop()
+
+    def _send(message: dict[str, Any]) -> None:
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def _run() -> None:
+        head: list[Any] = []
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info: Any = None):
+            head[:] = [int(status.split(" ", 1)[0]), headers]
+
+        body = flask_app(environ, start_response)
+        try:
+            started = False
+            for chunk in body:
+                if not chunk:
+                    continue
+                if not started:
+                    _send(_start(*head))
+                    started = True
+                _send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not started:
+                _send(_start(*head))
+            _send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+
+    await loop.run_in_executor(None, _run)
+
+
+def _observed(send: Send, route: str, method: str) -> Send:
+    """Wrap `send` to record the request metrics the Flask app's hooks record:
+    latency up to the response start, and the size of a body sent in one piece."""
+    started = time.perf_counter()
+    first_body = True
+
+    async def _send(message: dict[str, Any]) -> None:
+        nonlocal first_body
+        if message["type"] == "http.response.start":
+            elapsed = time.perf_counter() - started
+            metrics.observe(metrics.REQUEST_SECONDS, elapsed, route, method, str(message["status"]))
+        elif message["type"] == "http.response.body" and first_body:
+            first_body = False
+            if not message.get("more_body"):
+                metrics.observe(metrics.RESPONSE_BYTES, len(message.get("body", b"")), route)
+        await send(message)
+
+    return _send
+
+
+async def _send_response(response: Response, send: Send) -> None:
+    await send(_start(response.status_code, response.headers.to_wsgi_list()))
+    await send({"type": "http.response.body", "body": response.get_data(), "more_body": False})
+
+
+async def _nearby_records(
+    settings: Settings, *, lat: float, lon: float, mode: str, started: float
+) -> AsyncIterator[dict[str, Any]]:
+    tasks = aio_lookups.nearby_tasks(settings, lat=lat, lon=lon, mode=mode)
+    out = streaming.NearbyRecords()
+    async for name, result in fanout.iter_results_async(
+        tasks,
+        deadline_at=started + settings.request_deadline_s,
+        provider_timeout_s=settings.provider_deadline_s,
+    ):
+        for record in out.add(name, result):
+            yield record
+    for record in out.finish(tasks, lambda: dummy_nearby_devices(lat=lat, lon=lon, mode=mode)):
+        yield record
+
+
+async def _nearby(
+    settings: Settings, flask_app: Flask, request: Request, send: Send, request_id: str
+) -> None:
+    """`GET /nearby` through the same `wiretapper.nearby` steps as the Flask route."""
+    started = time.monotonic()
+    dumps = flask_app.json.dumps
+
+    def _headers(response: Response) -> Response:
+        response.headers["X-Request-ID"] = request_id
+        spans = timing.current()
+        if spans is not None:
+            response.headers["Server-Timing"] = spans.header()
+        return response
+
+    query = nearby.start(settings, request, dumps=dumps)
+    if isinstance(query, Response):
+        return await _send_response(_headers(query), send)
+
+    records = _nearby_records(
+        settings, lat=query.lat, lon=query.lon, mode=query.mode, started=started
+    )
+    fmt = query.fmt
+    if fmt is None:
+        collected = [record async for record in records]
+        response = nearby.finish(query, request, collected, dumps=dumps)
+        response = responses.finalize(
+            _headers(response), request, compress_min_bytes=settings.compress_min_bytes
+        )
+        return await _send_response(response, send)
+
+    headers = [
+        ("Content-Type", "text/event-stream" if fmt == "sse" else "application/x-ndjson"),
+        ("Cache-Control", "no-cache"),
+        ("X-Accel-Buffering", "no"),
+        ("X-Request-ID", request_id),
+    ]
+    await send(_start(200, headers))
+    try:
+        async for record in records:
+            chunk = streaming.encode(record, fmt, dumps).encode()
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    except UpstreamError as exc:
+        chunk = streaming.encode({"error": str(exc)}, fmt, dumps).encode()
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    except Exception:
+        _LOG.exception("streamed response failed")
+        chunk = streaming.encode({"error": "Internal error"}, fmt, dumps).encode()
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aio_http.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def create_asgi_app(settings: Settings) -> ASGIApp:
+    flask_app = create_app(settings)
+    aio_http.configure(
+        pool_size=settings.http_pool_size, max_connections=settings.http_max_connections
+    )
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            return await _lifespan(receive, send)
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope: {scope['type']}")
+        environ = _environ(scope, await _read_body(receive))
+        if scope["method"] == "GET" and scope["path"] == "/nearby":
+            request = Request(environ)
+            request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+            spans = timing.begin(request_id)
+            try:
+                observed = _observed(send, "/nearby", "GET")
+                return await _nearby(settings, flask_app, request, observed, request_id)
+            finally:
+                spans.log(method="GET", path="/nearby")
+                timing.end()
+        await _wsgi(flask_app, environ, send)
+
+    return app
+
+
+_APP: ASGIApp | None = None
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    """The ASGI application for settings from the environment, built on first use."""
+    global _APP
+    if _APP is None:
+        _APP = create_asgi_app(load_settings())
+    await _APP(scope, receive, send)
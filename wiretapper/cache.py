@@ -1,33 +1,595 @@
 from __future__ import annotations
 
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Protocol
+
+from . import fanout, singleflight, sqlitedb, timing
+from .services import http
+
+_LOG = logging.getLogger("wiretapper.cache")
+
+# Freshness of a value returned by `get_or_fetch`.
+FRESH = "fresh"  # within the soft TTL
+STALE = "stale"  # past the soft TTL; a background refresh was already running
+REVALIDATING = "revalidating"  # past the soft TTL; this lookup started the refresh
+MISS = "miss"  # fetched upstream (blocking) because nothing usable was cached
 
 
 @dataclass
 class _CacheItem:
+    stale_at: float
     expires_at: float
     value: Any
+    size: int
+    namespace: str
+
+
+def _namespace(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+def _estimate_size(value: Any) -> int:
+    # Rough deep size of JSON-like values; good enough to enforce a byte budget.
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    elif isinstance(value, list | tuple):
+        size += sum(_estimate_size(v) for v in value)
+    return size
+
+
+def _empty_counters() -> dict[str, int]:
+    return {
+        "items": 0,
+        "bytes": 0,
+        "hits": 0,
+        "stale_hits": 0,
+        "misses": 0,
+        "evictions": 0,
+        "expirations": 0,
+    }
+
+
+class CacheBackend(Protocol):
+    max_items: int
+    max_bytes: int
+
+    def lookup(self, key: str) -> tuple[Any | None, bool]: ...
+
+    def get(self, key: str) -> Any | None: ...
+
+    def peek_many(self, keys: list[str]) -> dict[str, Any]: ...
+
+    def versions(self, keys: list[str]) -> dict[str, float]: ...
+
+    def set(
+        self, key: str, value: Any, *, ttl_s: float, hard_ttl_s: float | None = None
+    ) -> None: ...
+
+    def purge_expired(self) -> int: ...
+
+    def clear(self) -> None: ...
+
+    def stats(self) -> dict[str, Any]: ...
+
+
+def _summarize(namespaces: dict[str, dict[str, int]], backend: CacheBackend) -> dict[str, Any]:
+    totals = _empty_counters()
+    for counters in namespaces.values():
+        for name, value in counters.items():
+            totals[name] += value
+    return {
+        **totals,
+        "backend": type(backend).__name__,
+        "max_items": backend.max_items,
+        "max_bytes": backend.max_bytes,
+        "namespaces": namespaces,
+    }
+
+
+class MemoryBackend:
+    """Per-process LRU with an entry-count and estimated byte budget (the default)."""
+
+    def __init__(self, *, max_items: int, max_bytes: int) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, _CacheItem] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._namespaces: dict[str, dict[str, int]] = {}
+
+    def _ns(self, namespace: str) -> dict[str, int]:
+        counters = self._namespaces.get(namespace)
+        if counters is None:
+            counters = self._namespaces[namespace] = _empty_counters()
+        return counters
+
+    def _drop(self, key: str, *, reason: str) -> None:
+        item = self._items.pop(key)
+        self._bytes -= item.size
+        counters = self._ns(item.namespace)
+        counters["items"] -= 1
+        counters["bytes"] -= item.size
+        if reason:
+            counters[reason] += 1
+
+    def lookup(self, key: str) -> tuple[Any | None, bool]:
+        """Return `(value, stale)`; `value` is None once the hard TTL has passed."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._ns(_namespace(key))["misses"] += 1
+                return None, False
+            now = time.monotonic()
+            if now >= item.expires_at:
+                self._drop(key, reason="expirations")
+                self._ns(item.namespace)["misses"] += 1
+                return None, False
+            self._items.move_to_end(key)
+            stale = now >= item.stale_at
+            self._ns(item.namespace)["stale_hits" if stale else "hits"] += 1
+            return item.value, stale
+
+    def get(self, key: str) -> Any | None:
+        return self.lookup(key)[0]
+
+    def peek_many(self, keys: list[str]) -> dict[str, Any]:
+        # Read-only: no hit/miss counting and no LRU promotion.
+        now = time.monotonic()
+        with self._lock:
+            items = ((key, self._items.get(key)) for key in keys)
+            return {key: item.value for key, item in items if item and now < item.expires_at}
+
+    def versions(self, keys: list[str]) -> dict[str, float]:
+        # An entry's stale time changes on every write, so it doubles as its version.
+        now = time.monotonic()
+        with self._lock:
+            items = ((key, self._items.get(key)) for key in keys)
+            return {key: item.stale_at for key, item in items if item and now < item.expires_at}
+
+    def set(self, key: str, value: Any, *, ttl_s: float, hard_ttl_s: float | None = None) -> None:
+        size = _estimate_size(key) + _estimate_size(value)
+        namespace = _namespace(key)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._items:
+                self._drop(key, reason="")
+            if size > self.max_bytes:
+                # Never worth evicting the whole cache for one oversized value.
+                self._ns(namespace)["evictions"] += 1
+                return
+            self._items[key] = _CacheItem(
+                stale_at=now + ttl_s,
+                expires_at=now + max(ttl_s, hard_ttl_s or 0.0),
+                value=value,
+                size=size,
+                namespace=namespace,
+            )
+            self._bytes += size
+            counters = self._ns(namespace)
+            counters["items"] += 1
+            counters["bytes"] += size
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._drop(oldest, reason="evictions")
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, item in self._items.items() if now >= item.expires_at]
+            for key in expired:
+                self._drop(key, reason="expirations")
+        return len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            self._namespaces.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            namespaces = {name: dict(c) for name, c in sorted(self._namespaces.items())}
+        return _summarize(namespaces, self)
+
+
+# Values are stored as a one-byte codec tag followed by the payload: compact JSON,
+# zlib-compressed JSON for larger values, or raw bytes.
+_COMPRESS_OVER_BYTES = 1024
+
+
+def _dumps(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return b"b" + value
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    if len(raw) > _COMPRESS_OVER_BYTES:
+        return b"z" + zlib.compress(raw, 6)
+    return b"j" + raw
+
+
+def _loads(blob: bytes) -> Any:
+    codec, body = blob[:1], blob[1:]
+    if codec == b"b":
+        return bytes(body)
+    if codec == b"z":
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    stale_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    value BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_expires_at ON cache_entries (expires_at);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at);
+"""
+
+
+class SQLiteBackend:
+    """Cache shared by every worker process on one host (SQLite in WAL mode).
+
+    Timestamps are wall-clock so all processes agree on expiry. Hit/miss counters
+    are per process; item and byte totals come from the shared table.
+    """
+
+    # Enforce the item/byte budget every N writes rather than on each one.
+    _ENFORCE_EVERY = 32
+    # A hit rewrites `accessed_at` only when it is older than this, so most reads
+    # take no write lock. LRU eviction order is exact to within this window.
+    _TOUCH_AFTER_S = 30.0
+
+    def __init__(self, path: str, *, max_items: int, max_bytes: int) -> None:
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._db = sqlitedb.Connections(path, schema=_SCHEMA, busy_timeout_s=1.0)
+        self._lock = threading.Lock()
+        self._namespaces: dict[str, dict[str, int]] = {}
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._db.get()
+
+    def _count(self, namespace: str, name: str, delta: int = 1) -> None:
+        with self._lock:
+            counters = self._namespaces.get(namespace)
+            if counters is None:
+                counters = self._namespaces[namespace] = _empty_counters()
+            counters[name] += delta
+
+    def lookup(self, key: str) -> tuple[Any | None, bool]:
+        try:
+            return self._lookup(key)
+        except sqlite3.Error:
+            # A locked or broken file costs an upstream call, not the request.
+            _LOG.warning("cache lookup of %s failed; treating it as a miss", key, exc_info=True)
+            self._count(_namespace(key), "misses")
+            return None, False
 
+    def _lookup(self, key: str) -> tuple[Any | None, bool]:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT namespace, stale_at, expires_at, accessed_at, value"
+            " FROM cache_entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            self._count(_namespace(key), "misses")
+            return None, False
+        namespace, stale_at, expires_at, accessed_at, blob = row
+        now = time.time()
+        if now >= expires_at:
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            self._count(namespace, "expirations")
+            self._count(namespace, "misses")
+            return None, False
+        if now - accessed_at >= self._TOUCH_AFTER_S:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        stale = now >= stale_at
+        self._count(namespace, "stale_hits" if stale else "hits")
+        return _loads(blob), stale
 
-_CACHE: dict[str, _CacheItem] = {}
+    def get(self, key: str) -> Any | None:
+        return self.lookup(key)[0]
+
+    def peek_many(self, keys: list[str]) -> dict[str, Any]:
+        conn = self._conn()
+        found: dict[str, Any] = {}
+        now = time.time()
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]
+            rows = conn.execute(
+                "SELECT key, value FROM cache_entries"
+                f" WHERE expires_at > ? AND key IN ({','.join('?' * len(batch))})",
+                (now, *batch),
+            ).fetchall()
+            found.update((key, _loads(blob)) for key, blob in rows)
+        return found
+
+    def versions(self, keys: list[str]) -> dict[str, float]:
+        conn = self._conn()
+        found: dict[str, float] = {}
+        now = time.time()
+        try:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                rows = conn.execute(
+                    "SELECT key, stale_at FROM cache_entries"
+                    f" WHERE expires_at > ? AND key IN ({','.join('?' * len(batch))})",
+                    (now, *batch),
+                ).fetchall()
+                found.update(rows)
+        except sqlite3.Error:
+            _LOG.warning("cache version lookup failed", exc_info=True)
+            return {}
+        return found
+
+    def set(self, key: str, value: Any, *, ttl_s: float, hard_ttl_s: float | None = None) -> None:
+        blob = _dumps(value)
+        namespace = _namespace(key)
+        size = len(key) + len(blob)
+        if size > self.max_bytes:
+            self._count(namespace, "evictions")
+            return
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache_entries"
+                " (key, namespace, stale_at, expires_at, accessed_at, size, value)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, namespace, now + ttl_s, now + max(ttl_s, hard_ttl_s or 0.0), now, size, blob),
+            )
+            with self._lock:
+                self._writes += 1
+                enforce = self._writes % self._ENFORCE_EVERY == 0
+            if enforce:
+                self._enforce_limits()
+        except sqlite3.Error:
+            # The fetched value is still answered; only caching it is skipped.
+            _LOG.warning("could not cache %s", key, exc_info=True)
+
+    def _enforce_limits(self) -> None:
+        conn = self._conn()
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        if count <= self.max_items and total <= self.max_bytes:
+            return
+        victims: list[tuple[str]] = []
+        for key, size, namespace in conn.execute(
+            "SELECT key, size, namespace FROM cache_entries ORDER BY accessed_at"
+        ):
+            if count <= self.max_items and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+            self._count(namespace, "evictions")
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+
+    def purge_expired(self) -> int:
+        conn = self._conn()
+        now = time.time()
+        purged = 0
+        for namespace, n in conn.execute(
+            "SELECT namespace, COUNT(*) FROM cache_entries"
+            " WHERE expires_at <= ? GROUP BY namespace",
+            (now,),
+        ).fetchall():
+            self._count(namespace, "expirations", n)
+            purged += n
+        conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+        self._enforce_limits()
+        return purged
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM cache_entries")
+        with self._lock:
+            self._namespaces.clear()
+
+    def stats(self) -> dict[str, Any]:
+        rows = (
+            self._conn()
+            .execute("SELECT namespace, COUNT(*), SUM(size) FROM cache_entries GROUP BY namespace")
+            .fetchall()
+        )
+        with self._lock:
+            namespaces = {name: dict(c) for name, c in self._namespaces.items()}
+        for namespace, count, total in rows:
+            counters = namespaces.setdefault(namespace, _empty_counters())
+            counters["items"] = count
+            counters["bytes"] = total or 0
+        return _summarize(dict(sorted(namespaces.items())), self)
+
+
+def default_sqlite_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "wiretapper-cache.sqlite3")
+
+
+_CACHE: CacheBackend = MemoryBackend(max_items=10_000, max_bytes=64 * 1024 * 1024)
+_SWEEPER: threading.Thread | None = None
+_SWEEPER_STOP = threading.Event()
+
+
+def _sweep_forever(interval_s: float, stop: threading.Event) -> None:
+    while not stop.wait(interval_s):
+        try:
+            _CACHE.purge_expired()
+        except sqlite3.Error:
+            continue
+
+
+def configure(
+    *,
+    max_items: int,
+    max_bytes: int,
+    sweep_interval_s: float,
+    backend: str = "memory",
+    path: str | None = None,
+) -> None:
+    """Select the backend, apply limits and (re)start the expiry sweeper.
+
+    `backend` is `memory` (per process, the default) or `sqlite` (a file at `path`
+    shared by every worker on the host).
+    """
+    global _CACHE, _SWEEPER, _SWEEPER_STOP
+    max_items = max(1, max_items)
+    max_bytes = max(1, max_bytes)
+    if backend == "memory":
+        if not isinstance(_CACHE, MemoryBackend):
+            _CACHE = MemoryBackend(max_items=max_items, max_bytes=max_bytes)
+    elif backend == "sqlite":
+        path = path or default_sqlite_path()
+        if not isinstance(_CACHE, SQLiteBackend) or _CACHE.path != path:
+            _CACHE = SQLiteBackend(path, max_items=max_items, max_bytes=max_bytes)
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    _CACHE.max_items = max_items
+    _CACHE.max_bytes = max_bytes
+
+    if _SWEEPER is not None:
+        _SWEEPER_STOP.set()
+        _SWEEPER = None
+    if sweep_interval_s > 0:
+        _SWEEPER_STOP = threading.Event()
+        _SWEEPER = threading.Thread(
+            target=_sweep_forever,
+            args=(sweep_interval_s, _SWEEPER_STOP),
+            name="wiretapper-cache-sweeper",
+            daemon=True,
+        )
+        _SWEEPER.start()
 
 
 def get(key: str) -> Any | None:
-    item = _CACHE.get(key)
-    if item is None:
-        return None
-    if time.monotonic() >= item.expires_at:
-        _CACHE.pop(key, None)
-        return None
-    return item.value
+    return _CACHE.get(key)
+
+
+def lookup(key: str) -> tuple[Any | None, bool]:
+    with timing.span("cache"):
+        return _CACHE.lookup(key)
+
+
+def peek_many(keys: list[str]) -> dict[str, Any]:
+    """Unexpired values (fresh or stale) for `keys`, without counting or promoting them."""
+    return _CACHE.peek_many(keys)
+
+
+def versions(keys: list[str]) -> dict[str, float]:
+    """A version of each unexpired entry of `keys`, changed by every write to it."""
+    return _CACHE.versions(keys)
+
+
+def set(key: str, value: Any, *, ttl_s: float, hard_ttl_s: float | None = None) -> None:
+    """Store `value`; it is fresh for `ttl_s` and may be served stale until `hard_ttl_s`."""
+    _CACHE.set(key, value, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s)
+
+
+def revalidate(key: str, refresh: Callable[[], Any]) -> str:
+    """Run `refresh` in the background unless one is already running for `key`,
+    or the revalidation queue is full.
+
+    Returns the freshness to report for the stale value being served.
+    """
+
+    def _background() -> Any:
+        with http.priority(http.PRIORITY_BACKGROUND):
+            return refresh()
+
+    started = singleflight.spawn(key, _background, submit=fanout.submit_revalidation)
+    return REVALIDATING if started else STALE
+
+
+def get_or_fetch(
+    key: str, fetch: Callable[[], Any], *, ttl_s: float, hard_ttl_s: float | None = None
+) -> tuple[Any, str]:
+    """Cache-aside lookup returning `(value, freshness)`.
+
+    Past the soft TTL the cached value is returned at once and refreshed in the
+    background; past the hard TTL the caller blocks on `fetch()`. Concurrent
+    fetches for the same key share a single call (and its `UpstreamError`).
+    """
+
+    def _refresh() -> Any:
+        fresh = fetch()
+        _CACHE.set(key, fresh, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s)
+        return fresh
+
+    value, stale = lookup(key)
+    if value is not None:
+        return value, revalidate(key, _refresh) if stale else FRESH
+
+    def _leader() -> Any:
+        fresh, stale = lookup(key)
+        return _refresh() if fresh is None or stale else fresh
+
+    value, _ = singleflight.do(key, _leader)
+    return value, MISS
+
+
+def revalidate_async(key: str, refresh: Callable[[], Awaitable[Any]]) -> str:
+    """`revalidate` for coroutines: the refresh runs as a background task."""
+
+    async def _background() -> Any:
+        with http.priority(http.PRIORITY_BACKGROUND):
+            return await refresh()
+
+    started = singleflight.spawn_async(key, _background)
+    return REVALIDATING if started else STALE
+
+
+async def get_or_fetch_async(
+    key: str,
+    fetch: Callable[[], Awaitable[Any]],
+    *,
+    ttl_s: float,
+    hard_ttl_s: float | None = None,
+) -> tuple[Any, str]:
+    """`get_or_fetch` for coroutines, over the same entries."""
+
+    async def _refresh() -> Any:
+        fresh = await fetch()
+        _CACHE.set(key, fresh, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s)
+        return fresh
+
+    value, stale = lookup(key)
+    if value is not None:
+        return value, revalidate_async(key, _refresh) if stale else FRESH
+
+    async def _leader() -> Any:
+        fresh, stale = lookup(key)
+        return await _refresh() if fresh is None or stale else fresh
+
+    value, _ = await singleflight.do_async(key, _leader)
+    return value, MISS
+
+
+def purge_expired() -> int:
+    return _CACHE.purge_expired()
 
 
-def set(key: str, value: Any, *, ttl_s: float) -> None:
-    _CACHE[key] = _CacheItem(expires_at=time.monotonic() + ttl_s, value=value)
+def clear() -> None:
+    _CACHE.clear()
 
 
-def stats() -> dict[str, int]:
-    # Best-effort (doesn't eagerly purge everything).
-    return {"items": len(_CACHE)}
+def stats() -> dict[str, Any]:
+    # Totals plus hits/misses/evictions/expirations and estimated bytes per key
+    # namespace (`wigle`, `shodan`, `opencellid`, `search`, ...).
+    return _CACHE.stats()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from functools import lru_cache
+
+# Keyword rules in priority order: the first category with a keyword anywhere in
+# the upper-cased name wins.
+RULES: tuple[tuple[str, tuple[str, ...]], ...] = (
+    (
+        "car",
+        (
+            "CAR",
+            "FORD",
+            "TOYOTA",
+            "BMW",
+            "TESLA",
+            "SYNC",
+            "MAZDA",
+            "HONDA",
+            "UCONNECT",
+            "HYUNDAI",
+            "LEXUS",
+            "NISSAN",
+        ),
+    ),
+    ("tv", ("TV", "BRAVIA", "VIZIO", "SAMSUNG", "LG", "ROKU", "FIRE", "SMARTVIEW", "KDL-")),
+    (
+        "headphone",
+        (
+            "HEADPHONE",
+            "EARBUD",
+            "BOSE",
+            "SONY",
+            "BEATS",
+            "AUDIO",
+            "AIRPOD",
+            "JBL",
+            "SENNHEISER",
+        ),
+    ),
+    ("dashcam", ("DASHCAM", "DASH CAM", "DVR", "70MAI", "VIOFO", "GARMIN DASH")),
+    (
+        "camera",
+        (
+            "CAM",
+            "SURVEILLANCE",
+            "SECURITY",
+            "NEST",
+            "RING",
+            "ARLO",
+            "HIKVISION",
+            "DAHUA",
+            "REOLINK",
+        ),
+    ),
+    ("iot", ("WATCH", "FITBIT", "GARMIN", "WHOOP")),
+)
+
+# Long names (Shodan banners run to kilobytes) are nearly always unique; memoizing
+# them would only push the short, repeating SSIDs and device names out of the LRU.
+_MEMO_MAX_LEN = 256
+
+
+def _category(name_upper: str) -> str | None:
+    # Plain `in` scans over the prebuilt tuples: CPython's substring search beats
+    # a combined regex here, most of all on long banners (benchmarks/bench_classify.py).
+    for category, keywords in RULES:
+        for keyword in keywords:
+            if keyword in name_upper:
+                return category
+    return None
+
+
+_memo_category = lru_cache(maxsize=16_384)(_category)
+
+
+def classify_device(name: str | None, original_type: str) -> str:
+    if not name:
+        return original_type
+    name_upper = name.upper()
+    if len(name_upper) <= _MEMO_MAX_LEN:
+        category = _memo_category(name_upper)
+    else:
+        category = _category(name_upper)
+    return category or original_type
+
+
+def classify_many(names: Iterable[str | None], original_type: str) -> list[str]:
+    """Classify a whole result set; repeated names are matched once."""
+    seen: dict[str | None, str] = {}
+    out: list[str] = []
+    for name in names:
+        kind = seen.get(name)
+        if kind is None:
+            kind = seen[name] = classify_device(name, original_type)
+        out.append(kind)
+    return out
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from collections.abc import Sequence
+
+from . import app, prefetch, towerdb
+from .config import load_settings
+
+# `wiretapper [serve]` runs the development server; `wiretapper warm` fills the
+# cache (and the observation store or replay archive, when enabled) for an area
+# before an operation, using the same settings as the server; `wiretapper towers`
+# imports the OpenCellID export (and its diffs) into the local tower index.
+
+
+def _bbox(raw: str) -> tuple[float, float, float, float]:
+    try:
+        min_lat, min_lon, max_lat, max_lon = map(float, raw.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected min_lat,min_lon,max_lat,max_lon") from None
+    if min_lat > max_lat or min_lon > max_lon:
+        raise argparse.ArgumentTypeError("expected min_lat,min_lon,max_lat,max_lon")
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def _modes(raw: str) -> list[str]:
+    modes = [mode.strip() for mode in raw.split(",") if mode.strip()]
+    unknown = sorted(set(modes) - set(prefetch.MODES))
+    if not modes or unknown:
+        raise argparse.ArgumentTypeError(f"modes are {', '.join(prefetch.MODES)}")
+    return modes
+
+
+def _warm(args: argparse.Namespace) -> int:
+    settings = load_settings()
+    cells = sum(len(prefetch.cells_in_bbox(mode, args.bbox)) for mode in args.modes)
+    if cells > args.max_cells:
+        print(f"{cells} areas to warm (over --max-cells {args.max_cells})", file=sys.stderr)
+        return 2
+    if settings.cache_backend == "memory" and not settings.store_path:
+        print(
+            "warning: the memory cache lives only in this process; set"
+            " WIRETAPPER_CACHE_BACKEND=sqlite or WIRETAPPER_STORE_PATH to keep what is warmed",
+            file=sys.stderr,
+        )
+    app.create_app(settings)  # configures the cache, store, quotas and clients
+
+    def _progress(done: int, total: int) -> None:
+        print(f"\r{done}/{total} areas", end="", file=sys.stderr, flush=True)
+
+    totals = prefetch.warm(
+        settings, args.bbox, args.modes, workers=args.workers, progress=_progress
+    )
+    print(file=sys.stderr)
+    print(
+        f"warmed {totals['warmed']} provider calls,"
+        f" {totals['skipped']} skipped for quota, {totals['error']} failed"
+    )
+    return 1 if totals["error"] and not totals["warmed"] else 0
+
+
+def _towers(args: argparse.Namespace) -> int:
+    path = args.path or load_settings().towers_path
+    if not path:
+        print("set WIRETAPPER_TOWERS_PATH or pass --path", file=sys.stderr)
+        return 2
+    started = time.monotonic()
+    try:
+        if args.action == "import":
+            rows = towerdb.import_csv(path, args.files)
+        else:
+            rows = towerdb.apply_diff(path, args.files)
+    except (OSError, RuntimeError, ValueError) as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    print(f"{rows} towers in {path} ({time.monotonic() - started:.1f}s)")
+    return 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="wiretapper")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("serve", help="run the development server (the default)")
+    warm = commands.add_parser("warm", help="pre-populate the cache for an area")
+    warm.add_argument("--bbox", type=_bbox, required=True, help="min_lat,min_lon,max_lat,max_lon")
+    warm.add_argument(
+        "--modes", type=_modes, default=["wifi"], help="comma-separated: wifi,bluetooth,towers"
+    )
+    warm.add_argument("--workers", type=int, default=4)
+    warm.add_argument("--max-cells", type=int, default=2000)
+    towers = commands.add_parser("towers", help="build the local OpenCellID tower index")
+    towers.add_argument(
+        "action", choices=("import", "diff"), help="import full exports, or merge diffs"
+    )
+    towers.add_argument("files", nargs="+", help="cell_towers.csv.gz (or diff) files")
+    towers.add_argument("--path", help="index directory (default: WIRETAPPER_TOWERS_PATH)")
+    args = parser.parse_args(argv)
+    if args.command == "warm":
+        return _warm(args)
+    if args.command == "towers":
+        return _towers(args)
+    return app.main()
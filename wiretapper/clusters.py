@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import math
+from collections import Counter
+from typing import Any
+
+from . import tiles
+
+try:
+    import numpy as np
+except ImportError:  # optional; the pure-Python path gives the same result
+    np = None  # type: ignore[assignment]
+
+# Viewport clustering: devices are binned into a screen-space grid of `CELL_PX`
+# pixel squares at the requested zoom (Web Mercator, 256 px tiles), so the number
+# of clusters is bounded by the viewport size, not by the number of devices.
+
+CELL_PX = 64
+MAX_ZOOM = 22
+
+
+def _grid(zoom: int) -> int:
+    """Grid cells per axis for the whole world at `zoom`."""
+    return (256 // CELL_PX) << min(max(zoom, 0), MAX_ZOOM)
+
+
+def _cell_xy(lat: float, lon: float, n: int) -> tuple[int, int]:
+    lat = max(-tiles.MAX_LAT, min(tiles.MAX_LAT, lat))
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return min(n - 1, max(0, int(x))), min(n - 1, max(0, int(y)))
+
+
+def _points(devices: list[dict[str, Any]]) -> tuple[list[float], list[float], list[str]]:
+    lats: list[float] = []
+    lons: list[float] = []
+    types: list[str] = []
+    for device in devices:
+        try:
+            lat = float(device["lat"])
+            lon = float(device["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if math.isfinite(lat) and math.isfinite(lon):
+            lats.append(lat)
+            lons.append(lon)
+            types.append(str(device.get("type") or "unknown"))
+    return lats, lons, types
+
+
+def _aggregate_numpy(lats: list[float], lons: list[float], types: list[str], n: int):
+    lat = np.asarray(lats, dtype=np.float64)
+    lon = np.asarray(lons, dtype=np.float64)
+    clamped = np.radians(np.clip(lat, -tiles.MAX_LAT, tiles.MAX_LAT))
+    x = np.clip(((lon + 180.0) / 360.0 * n).astype(np.int64), 0, n - 1)
+    y = (1.0 - np.arcsinh(np.tan(clamped)) / np.pi) / 2.0 * n
+    y = np.clip(y.astype(np.int64), 0, n - 1)
+
+    keys, cell = np.unique(y * n + x, return_inverse=True)
+    type_names, type_code = np.unique(np.asarray(types, dtype=object), return_inverse=True)
+    counts = np.bincount(cell)
+    lat_mean = np.bincount(cell, weights=lat) / counts
+    lon_mean = np.bincount(cell, weights=lon) / counts
+    histogram = np.bincount(
+        cell * len(type_names) + type_code, minlength=len(keys) * len(type_names)
+    ).reshape(len(keys), len(type_names))
+
+    clusters = []
+    for i, key in enumerate(keys.tolist()):
+        row = histogram[i]
+        clusters.append(
+            {
+                "cell": [key % n, key // n],
+                "count": int(counts[i]),
+                "lat": float(lat_mean[i]),
+                "lon": float(lon_mean[i]),
+                "types": {str(type_names[t]): int(row[t]) for t in np.flatnonzero(row)},
+            }
+        )
+    return clusters
+
+
+def _aggregate_python(lats: list[float], lons: list[float], types: list[str], n: int):
+    cells: dict[int, list[Any]] = {}
+    for lat, lon, kind in zip(lats, lons, types, strict=True):
+        x, y = _cell_xy(lat, lon, n)
+        acc = cells.get(y * n + x)
+        if acc is None:
+            acc = cells[y * n + x] = [0, 0.0, 0.0, Counter()]
+        acc[0] += 1
+        acc[1] += lat
+        acc[2] += lon
+        acc[3][kind] += 1
+    return [
+        {
+            "cell": [key % n, key // n],
+            "count": count,
+            "lat": lat_sum / count,
+            "lon": lon_sum / count,
+            "types": dict(sorted(histogram.items())),
+        }
+        for key, (count, lat_sum, lon_sum, histogram) in sorted(cells.items())
+    ]
+
+
+def aggregate(devices: list[dict[str, Any]], *, zoom: int) -> list[dict[str, Any]]:
+    """Grid clusters with count, centroid and type histogram, ordered by cell."""
+    lats, lons, types = _points(devices)
+    if not lats:
+        return []
+    n = _grid(zoom)
+    if np is not None:
+        return _aggregate_numpy(lats, lons, types, n)
+    return _aggregate_python(lats, lons, types, n)
@@ -22,9 +22,73 @@ class Settings:
     debug: bool = True
     strict_keys: bool = False
     rate_limit_rpm: int = 60
+    rate_limit_max_clients: int = 100_000
+    rate_limit_backend: str = "memory"
+    rate_limit_path: str | None = None
+    trusted_proxies: tuple[str, ...] = ()
     cache_ttl_nearby_s: float = 45.0
     cache_ttl_search_s: float = 60.0
     cache_ttl_towers_s: float = 120.0
+    cache_hard_ttl_nearby_s: float = 300.0
+    cache_hard_ttl_search_s: float = 600.0
+    cache_hard_ttl_towers_s: float = 3600.0
+    cache_max_items: int = 10_000
+    cache_max_bytes: int = 64 * 1024 * 1024
+    cache_sweep_interval_s: float = 30.0
+    cache_backend: str = "memory"
+    cache_path: str | None = None
+    fanout_workers: int = 16
+    request_deadline_s: float = 15.0
+    provider_deadline_s: float = 10.0
+    geo_tile_zoom: int = 16
+    store_path: str | None = None
+    store_freshness_s: float = 86400.0
+    # (provider, "per_s=...,per_day=...,concurrency=...") overrides of the default quotas
+    quota_specs: tuple[tuple[str, str], ...] = ()
+    quota_max_wait_s: float = 2.0
+    compress_min_bytes: int = 1024
+    cluster_points_zoom: int = 17
+    cluster_max_tiles: int = 1024
+    tile_min_zoom: int = 15
+    tile_epoch_s: float = 3600.0
+    wigle_max_records: int = 500
+    wigle_max_pages: int = 5
+    batch_max_points: int = 500
+    batch_deadline_s: float = 60.0
+    batch_workers: int = 4
+    revalidate_workers: int = 2
+    http_pool_size: int = 32
+    http_max_connections: int = 256
+    circuit_trip_rate: float = 0.5
+    circuit_min_calls: int = 5
+    circuit_slow_call_s: float = 5.0
+    circuit_open_s: float = 30.0
+    http_connect_timeout_s: float = 3.05
+    http_read_timeout_min_s: float = 1.0
+    http_read_timeout_max_s: float = 10.0
+    http_timeout_multiplier: float = 3.0
+    http_retries: int = 2
+    http_retry_budget_s: float = 10.0
+    http_hedge_quantile: float = 0.0
+    profile_dir: str | None = None
+    profile_token: str | None = None
+    upstream_override: str | None = None
+    replay_path: str | None = None
+    provider_modes: tuple[tuple[str, str], ...] = ()
+    replay_max_distance_m: float = 1000.0
+    prefetch_rings: int = 0
+    prefetch_reserve: float = 0.5
+    prefetch_max_queue: int = 64
+    towers_path: str | None = None
+
+    def cache_ttls(self, namespace: str) -> tuple[float, float]:
+        """Soft and hard TTL for the `nearby`, `search` or `towers` cache namespace."""
+        soft, hard = {
+            "nearby": (self.cache_ttl_nearby_s, self.cache_hard_ttl_nearby_s),
+            "search": (self.cache_ttl_search_s, self.cache_hard_ttl_search_s),
+            "towers": (self.cache_ttl_towers_s, self.cache_hard_ttl_towers_s),
+        }[namespace]
+        return soft, max(soft, hard)
 
     def validate(self) -> None:
         if not self.strict_keys:
@@ -95,9 +159,75 @@ def load_settings(*, project_root: Path | None = None) -> Settings:
         debug=_truthy(os.getenv("WIRETAPPER_DEBUG", "1")),
         strict_keys=_truthy(os.getenv("WIRETAPPER_STRICT_KEYS")),
         rate_limit_rpm=_int("WIRETAPPER_RATE_LIMIT_RPM", 60),
+        rate_limit_max_clients=_int("WIRETAPPER_RATE_LIMIT_MAX_CLIENTS", 100_000),
+        rate_limit_backend=(os.getenv("WIRETAPPER_RATE_LIMIT_BACKEND") or "memory").strip().lower(),
+        rate_limit_path=os.getenv("WIRETAPPER_RATE_LIMIT_PATH") or None,
+        trusted_proxies=tuple(
+            p.strip()
+            for p in (os.getenv("WIRETAPPER_TRUSTED_PROXIES") or "").split(",")
+            if p.strip()
+        ),
         cache_ttl_nearby_s=_float("WIRETAPPER_CACHE_NEARBY_S", 45.0),
         cache_ttl_search_s=_float("WIRETAPPER_CACHE_SEARCH_S", 60.0),
         cache_ttl_towers_s=_float("WIRETAPPER_CACHE_TOWERS_S", 120.0),
+        cache_hard_ttl_nearby_s=_float("WIRETAPPER_CACHE_NEARBY_HARD_S", 300.0),
+        cache_hard_ttl_search_s=_float("WIRETAPPER_CACHE_SEARCH_HARD_S", 600.0),
+        cache_hard_ttl_towers_s=_float("WIRETAPPER_CACHE_TOWERS_HARD_S", 3600.0),
+        cache_max_items=_int("WIRETAPPER_CACHE_MAX_ITEMS", 10_000),
+        cache_max_bytes=_int("WIRETAPPER_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+        cache_sweep_interval_s=_float("WIRETAPPER_CACHE_SWEEP_S", 30.0),
+        cache_backend=(os.getenv("WIRETAPPER_CACHE_BACKEND") or "memory").strip().lower(),
+        cache_path=os.getenv("WIRETAPPER_CACHE_PATH") or None,
+        fanout_workers=_int("WIRETAPPER_FANOUT_WORKERS", 16),
+        request_deadline_s=_float("WIRETAPPER_REQUEST_DEADLINE_S", 15.0),
+        provider_deadline_s=_float("WIRETAPPER_PROVIDER_DEADLINE_S", 10.0),
+        geo_tile_zoom=_int("WIRETAPPER_GEO_TILE_ZOOM", 16),
+        store_path=os.getenv("WIRETAPPER_STORE_PATH") or None,
+        store_freshness_s=_float("WIRETAPPER_STORE_FRESHNESS_S", 86400.0),
+        quota_specs=tuple(
+            (provider, os.environ[f"WIRETAPPER_QUOTA_{provider.upper()}"])
+            for provider in ("wigle", "shodan", "unwiredlabs", "opencellid")
+            if os.getenv(f"WIRETAPPER_QUOTA_{provider.upper()}")
+        ),
+        quota_max_wait_s=_float("WIRETAPPER_QUOTA_MAX_WAIT_S", 2.0),
+        compress_min_bytes=_int("WIRETAPPER_COMPRESS_MIN_BYTES", 1024),
+        cluster_points_zoom=_int("WIRETAPPER_CLUSTER_POINTS_ZOOM", 17),
+        cluster_max_tiles=_int("WIRETAPPER_CLUSTER_MAX_TILES", 1024),
+        tile_min_zoom=_int("WIRETAPPER_TILE_MIN_ZOOM", 15),
+        tile_epoch_s=max(1.0, _float("WIRETAPPER_TILE_EPOCH_S", 3600.0)),
+        wigle_max_records=_int("WIRETAPPER_WIGLE_MAX_RECORDS", 500),
+        wigle_max_pages=_int("WIRETAPPER_WIGLE_MAX_PAGES", 5),
+        batch_max_points=_int("WIRETAPPER_BATCH_MAX_POINTS", 500),
+        batch_deadline_s=_float("WIRETAPPER_BATCH_DEADLINE_S", 60.0),
+        batch_workers=_int("WIRETAPPER_BATCH_WORKERS", 4),
+        revalidate_workers=_int("WIRETAPPER_REVALIDATE_WORKERS", 2),
+        http_pool_size=_int("WIRETAPPER_HTTP_POOL_SIZE", 32),
+        http_max_connections=_int("WIRETAPPER_HTTP_MAX_CONNECTIONS", 256),
+        circuit_trip_rate=_float("WIRETAPPER_CIRCUIT_TRIP_RATE", 0.5),
+        circuit_min_calls=_int("WIRETAPPER_CIRCUIT_MIN_CALLS", 5),
+        circuit_slow_call_s=_float("WIRETAPPER_CIRCUIT_SLOW_CALL_S", 5.0),
+        circuit_open_s=_float("WIRETAPPER_CIRCUIT_OPEN_S", 30.0),
+        http_connect_timeout_s=_float("WIRETAPPER_HTTP_CONNECT_TIMEOUT_S", 3.05),
+        http_read_timeout_min_s=_float("WIRETAPPER_HTTP_READ_TIMEOUT_MIN_S", 1.0),
+        http_read_timeout_max_s=_float("WIRETAPPER_HTTP_READ_TIMEOUT_MAX_S", 10.0),
+        http_timeout_multiplier=_float("WIRETAPPER_HTTP_TIMEOUT_MULTIPLIER", 3.0),
+        http_retries=_int("WIRETAPPER_HTTP_RETRIES", 2),
+        http_retry_budget_s=_float("WIRETAPPER_HTTP_RETRY_BUDGET_S", 10.0),
+        http_hedge_quantile=_float("WIRETAPPER_HTTP_HEDGE_QUANTILE", 0.0),
+        profile_dir=os.getenv("WIRETAPPER_PROFILE_DIR") or None,
+        profile_token=os.getenv("WIRETAPPER_PROFILE_TOKEN") or None,
+        upstream_override=os.getenv("WIRETAPPER_UPSTREAM_OVERRIDE") or None,
+        replay_path=os.getenv("WIRETAPPER_REPLAY_PATH") or None,
+        provider_modes=tuple(
+            (provider, os.environ[f"WIRETAPPER_MODE_{provider.upper()}"].strip().lower())
+            for provider in ("wigle", "shodan", "unwiredlabs", "opencellid")
+            if os.getenv(f"WIRETAPPER_MODE_{provider.upper()}")
+        ),
+        replay_max_distance_m=_float("WIRETAPPER_REPLAY_MAX_DISTANCE_M", 1000.0),
+        prefetch_rings=_int("WIRETAPPER_PREFETCH_RINGS", 0),
+        prefetch_reserve=_float("WIRETAPPER_PREFETCH_RESERVE", 0.5),
+        prefetch_max_queue=_int("WIRETAPPER_PREFETCH_MAX_QUEUE", 64),
+        towers_path=os.getenv("WIRETAPPER_TOWERS_PATH") or None,
     )
     settings.validate()
     return settings
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import random
 from typing import Any
 
 DUMMY_DATA: list[dict[str, Any]] = [
@@ -32,3 +33,60 @@ DUMMY_DATA: list[dict[str, Any]] = [
         "type": "camera",
     },
 ]
+
+
+def dummy_nearby_devices(*, lat: float, lon: float, mode: str) -> list[dict[str, Any]]:
+    if mode == "bluetooth":
+        return [
+            {
+                "lat": lat + random.uniform(-0.002, 0.002),
+                "lon": lon + random.uniform(-0.002, 0.002),
+                "ssid": "Tesla Model 3",
+                "type": "car",
+                "vendor": "Tesla Motors",
+            },
+            {
+                "lat": lat + random.uniform(-0.002, 0.002),
+                "lon": lon + random.uniform(-0.002, 0.002),
+                "ssid": "Sony WH-1000XM4",
+                "type": "headphone",
+                "vendor": "Sony Corp.",
+            },
+            {
+                "lat": lat + random.uniform(-0.002, 0.002),
+                "lon": lon + random.uniform(-0.002, 0.002),
+                "ssid": "Samsung QLED 75",
+                "type": "tv",
+                "vendor": "Samsung Electronics",
+            },
+            {
+                "lat": lat + random.uniform(-0.002, 0.002),
+                "lon": lon + random.uniform(-0.002, 0.002),
+                "ssid": "Hidden_BT_Tracker",
+                "type": "bluetooth",
+                "vendor": "Unknown",
+            },
+        ]
+    return [
+        {
+            "lat": lat + random.uniform(-0.001, 0.001),
+            "lon": lon + random.uniform(-0.001, 0.001),
+            "ssid": "CYBER_SURVEILLANCE_ROUTER",
+            "type": "router",
+            "vendor": "Cisco Systems",
+        },
+        {
+            "lat": lat + random.uniform(-0.001, 0.001),
+            "lon": lon + random.uniform(-0.001, 0.001),
+            "ssid": "DASHCAM_V3",
+            "type": "camera",
+            "vendor": "Nextbase",
+        },
+        {
+            "lat": lat + random.uniform(-0.001, 0.001),
+            "lon": lon + random.uniform(-0.001, 0.001),
+            "ssid": "5G_TOWER_B4",
+            "type": "cell_tower",
+            "vendor": "Ericsson",
+        },
+    ]
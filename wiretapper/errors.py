@@ -5,3 +5,23 @@ class UpstreamError(RuntimeError):
     def __init__(self, message: str, *, status_code: int | None = None) -> None:
         super().__init__(message)
         self.status_code = status_code
+
+
+class QuotaExceededError(UpstreamError):
+    """An outbound call was refused because the provider's quota is spent or busy."""
+
+    def __init__(self, message: str, *, retry_after_s: float | None = None) -> None:
+        super().__init__(message, status_code=429)
+        self.retry_after_s = retry_after_s
+
+
+class CircuitOpenError(UpstreamError):
+    """An outbound call was skipped because the provider's circuit breaker is open."""
+
+    def __init__(self, message: str, *, retry_after_s: float | None = None) -> None:
+        super().__init__(message, status_code=503)
+        self.retry_after_s = retry_after_s
+
+
+class ReplayMissError(UpstreamError):
+    """A provider in replay mode has no recorded response for the call."""
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any
+
+from .errors import CircuitOpenError, QuotaExceededError, ReplayMissError, UpstreamError
+
+# A task returns `(value, freshness)`, freshness as reported by `cache.get_or_fetch`.
+Task = Callable[[], tuple[Any, str]]
+AsyncTask = Callable[[], Awaitable[tuple[Any, str]]]
+
+_LOG = logging.getLogger("wiretapper.fanout")
+
+
+class _Pool:
+    """A thread pool created on first use and replaced when resized.
+
+    With `pending_per_worker`, `try_submit` refuses tasks once that many per
+    worker are queued or running.
+    """
+
+    def __init__(self, name: str, max_workers: int, *, pending_per_worker: int = 0) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self._pending_per_worker = pending_per_worker
+        self._slots = threading.BoundedSemaphore(max(1, max_workers * pending_per_worker))
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def resize(self, max_workers: int) -> None:
+        with self._lock:
+            if max_workers == self.max_workers and self._executor is not None:
+                return
+            old = self._executor
+            self.max_workers = max(1, max_workers)
+            self._slots = threading.BoundedSemaphore(
+                max(1, self.max_workers * self._pending_per_worker)
+            )
+            self._executor = None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def get(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+            return self._executor
+
+    def try_submit(self, fn: Callable[[], Any]) -> bool:
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            return False
+
+        def _run() -> None:
+            try:
+                fn()
+            finally:
+                slots.release()
+
+        self.get().submit(_run)
+        return True
+
+
+# Request-path provider tasks, and batch lookups on a pool of their own: a batch
+# waiting out a busy quota must not hold the workers interactive requests need.
+_FANOUT = _Pool("wiretapper-fanout", 16)
+_BATCH = _Pool("wiretapper-batch", 4)
+# Stale-cache refreshes: nobody waits on them, so when their queue is full the
+# stale value is served without starting another one.
+_REVALIDATE = _Pool("wiretapper-revalidate", 2, pending_per_worker=8)
+# Coroutine tasks past their deadline, referenced until they finish.
+_BACKGROUND: set[asyncio.Task[Any]] = set()
+
+
+def configure(*, max_workers: int, batch_workers: int = 4, revalidate_workers: int = 2) -> None:
+    _FANOUT.resize(max_workers)
+    _BATCH.resize(batch_workers)
+    _REVALIDATE.resize(revalidate_workers)
+
+
+def executor() -> ThreadPoolExecutor:
+    return _FANOUT.get()
+
+
+def batch_executor() -> ThreadPoolExecutor:
+    return _BATCH.get()
+
+
+def submit_revalidation(fn: Callable[[], Any]) -> bool:
+    """Run `fn` on the revalidation pool; False, without running it, when its queue is full."""
+    return _REVALIDATE.try_submit(fn)
+
+
+@dataclass
+class ProviderResult:
+    status: str  # "ok" | "error" | "timeout" | "skipped" (circuit open)
+    latency_ms: float
+    cached: bool = False
+    freshness: str = "fresh"  # "fresh" | "stale" | "revalidating"
+    value: Any = None
+    error: str | None = None
+    sent: bool = False  # the task called upstream (not answered by cache, quota or replay)
+
+    def meta(self) -> dict[str, Any]:
+        meta: dict[str, Any] = {
+            "status": self.status,
+            "latency_ms": round(self.latency_ms, 1),
+            "cached": self.cached,
+        }
+        if self.status == "ok":
+            meta["freshness"] = self.freshness
+        if self.error:
+            meta["error"] = self.error
+        if getattr(self.value, "truncated", False):  # a cap cut the records short
+            meta["truncated"] = True
+        return meta
+
+
+def _timed(task: Task) -> tuple[Any, str, float]:
+    started = time.monotonic()
+    value, freshness = task()
+    return value, freshness, (time.monotonic() - started) * 1000.0
+
+
+def _collect(future: Future[tuple[Any, str, float]]) -> ProviderResult:
+    try:
+        value, freshness, latency_ms = future.result()
+    except CircuitOpenError as exc:
+        return ProviderResult(status="skipped", latency_ms=0.0, error=str(exc))
+    except (QuotaExceededError, ReplayMissError) as exc:
+        return ProviderResult(status="error", latency_ms=0.0, error=str(exc))
+    except UpstreamError as exc:
+        return ProviderResult(status="error", latency_ms=0.0, error=str(exc), sent=True)
+    except Exception as exc:
+        # A bug or an unreadable answer (bad JSON, an unexpected record, a store
+        # error) fails this provider only, like an upstream error would.
+        _LOG.exception("provider task failed")
+        error = f"Internal error ({type(exc).__name__})"
+        return ProviderResult(status="error", latency_ms=0.0, error=error, sent=True)
+    cached = freshness != "miss"
+    return ProviderResult(
+        status="ok",
+        latency_ms=latency_ms,
+        cached=cached,
+        freshness=freshness if cached else "fresh",
+        value=value,
+        sent=not cached,
+    )
+
+
+def iter_results(
+    tasks: dict[str, Task],
+    *,
+    deadline_at: float,
+    provider_timeout_s: float,
+    pool: ThreadPoolExecutor | None = None,
+) -> Iterator[tuple[str, ProviderResult]]:
+    """Run `tasks` concurrently on `pool` (the shared executor by default) and
+    yield `(name, result)` as each one settles.
+
+    A task that misses its own timeout or the overall `deadline_at` (a
+    `time.monotonic()` value) is reported as `timeout`; it keeps running in the
+    background so whatever it fetches still lands in the cache.
+    """
+    started = time.monotonic()
+    pool = pool or executor()
+    # Each task runs in its own copy of the caller's context (request ID, spans,
+    # upstream priority); one context cannot be entered by two threads at once.
+    pending: dict[Future[tuple[Any, str, float]], str] = {
+        pool.submit(contextvars.copy_context().run, _timed, task): name
+        for name, task in tasks.items()
+    }
+    task_deadline = min(deadline_at, started + provider_timeout_s)
+
+    while pending:
+        remaining = task_deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            result = _collect(future)
+            if result.status in ("error", "skipped"):
+                result.latency_ms = (time.monotonic() - started) * 1000.0
+            yield name, result
+
+    elapsed_ms = (time.monotonic() - started) * 1000.0
+    for name in pending.values():
+        yield (
+            name,
+            ProviderResult(status="timeout", latency_ms=elapsed_ms, error="Deadline exceeded"),
+        )
+
+
+async def _timed_async(task: AsyncTask) -> tuple[Any, str, float]:
+    started = time.monotonic()
+    value, freshness = await task()
+    return value, freshness, (time.monotonic() - started) * 1000.0
+
+
+async def iter_results_async(
+    tasks: dict[str, AsyncTask], *, deadline_at: float, provider_timeout_s: float
+) -> AsyncIterator[tuple[str, ProviderResult]]:
+    """`iter_results` for coroutine tasks, run concurrently on the event loop."""
+    started = time.monotonic()
+    pending: dict[asyncio.Task[tuple[Any, str, float]], str] = {
+        asyncio.ensure_future(_timed_async(task)): name for name, task in tasks.items()
+    }
+    task_deadline = min(deadline_at, started + provider_timeout_s)
+
+    try:
+        while pending:
+            remaining = task_deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                name = pending.pop(future)
+                result = _collect(future)  # type: ignore[arg-type]
+                if result.status in ("error", "skipped"):
+                    result.latency_ms = (time.monotonic() - started) * 1000.0
+                yield name, result
+    finally:
+        # Late tasks keep running so what they fetch still lands in the cache.
+        for future in pending:
+            _BACKGROUND.add(future)
+            future.add_done_callback(_forget)
+
+    elapsed_ms = (time.monotonic() - started) * 1000.0
+    for name in pending.values():
+        yield (
+            name,
+            ProviderResult(status="timeout", latency_ms=elapsed_ms, error="Deadline exceeded"),
+        )
+
+
+def _forget(future: asyncio.Task[Any]) -> None:
+    _BACKGROUND.discard(future)
+    if not future.cancelled():
+        future.exception()
+
+
+def run(
+    tasks: dict[str, Task], *, deadline_at: float, provider_timeout_s: float
+) -> dict[str, ProviderResult]:
+    return dict(iter_results(tasks, deadline_at=deadline_at, provider_timeout_s=provider_timeout_s))
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import threading
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+from . import cache, singleflight, tiles
+from .tiles import BBox
+
+# Spatial layer over `wiretapper.cache`: records from area queries are stored per
+# slippy tile, so any query box is answered from the tiles that cover it and only
+# the missing tiles are fetched upstream.
+
+Coords = Callable[[dict[str, Any]], "tuple[float, float] | None"]
+Tile = tuple[int, int]
+Rect = tuple[int, int, int, int]
+# The records fetched for a rectangle, bucketed per tile, and whether they are partial.
+Stored = tuple[dict[Tile, list[dict[str, Any]]], bool]
+
+
+class Partial(list):  # type: ignore[type-arg]
+    """Records a provider cap cut short of everything in the queried area. Their
+    tiles are not cached, so the next query asks upstream again."""
+
+    truncated = True
+
+
+def is_partial(records: Iterable[Any]) -> bool:
+    return bool(getattr(records, "truncated", False))
+
+
+_STATS = {"tile_hits": 0, "tile_misses": 0, "upstream_fetches": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def _count(**deltas: int) -> None:
+    with _STATS_LOCK:
+        for name, delta in deltas.items():
+            _STATS[name] += delta
+
+
+def tile_key(namespace: str, zoom: int, x: int, y: int) -> str:
+    return f"{namespace}:{zoom}:{x}:{y}"
+
+
+def bbox_keys(namespace: str, bbox: BBox, zoom: int) -> list[str]:
+    """Keys of the tiles `get_bbox` answers `bbox` from."""
+    return [tile_key(namespace, zoom, x, y) for x, y in tiles.tiles_for_bbox(bbox, zoom)]
+
+
+def point_key(namespace: str, lat: float, lon: float, zoom: int) -> str:
+    """Key of the tile `get_point` answers a point from."""
+    return tile_key(namespace, zoom, *tiles.lonlat_to_tile(lon, lat, zoom))
+
+
+def _lookup_tiles(
+    namespace: str, bbox: BBox, zoom: int
+) -> tuple[list[Tile], dict[Tile, list[dict[str, Any]]], list[Tile], list[Tile]]:
+    """`(covering, found, missing, stale)` tiles of `bbox` in the cache."""
+    covering = tiles.tiles_for_bbox(bbox, zoom)
+    found: dict[Tile, list[dict[str, Any]]] = {}
+    missing: list[Tile] = []
+    stale: list[Tile] = []
+    for x, y in covering:
+        records, is_stale = cache.lookup(tile_key(namespace, zoom, x, y))
+        if records is None:
+            missing.append((x, y))
+            continue
+        found[(x, y)] = records
+        if is_stale:
+            stale.append((x, y))
+    _count(tile_hits=len(found), tile_misses=len(missing))
+    return covering, found, missing, stale
+
+
+def _cached_tiles(namespace: str, zoom: int, wanted: list[Tile]) -> dict[Tile, Any] | None:
+    # A coalesced leader re-checks: another caller may have filled the tiles.
+    again = {tile: cache.get(tile_key(namespace, zoom, *tile)) for tile in wanted}
+    return again if all(records is not None for records in again.values()) else None
+
+
+def _inside(
+    covering: list[Tile],
+    found: dict[Tile, list[dict[str, Any]]],
+    bbox: BBox,
+    coords: Coords,
+) -> list[dict[str, Any]]:
+    out: list[dict[str, Any]] = []
+    for tile in covering:
+        for record in found.get(tile, []):
+            point = coords(record)
+            if point is not None and tiles.contains(bbox, *point):
+                out.append(record)
+    return out
+
+
+def get_bbox(
+    namespace: str,
+    bbox: BBox,
+    *,
+    zoom: int,
+    ttl_s: float,
+    hard_ttl_s: float | None = None,
+    fetch: Callable[[BBox], Iterable[dict[str, Any]]],
+    coords: Coords,
+) -> tuple[list[dict[str, Any]], str]:
+    """Return the records inside `bbox` and their freshness (see `cache.get_or_fetch`).
+
+    Missing tiles are fetched before returning; stale tiles are served as they are
+    and refreshed in the background. When `fetch` returns partial records, so does
+    this, and nothing is cached.
+    """
+    covering, found, missing, stale = _lookup_tiles(namespace, bbox, zoom)
+
+    def _refresh(rect: Rect) -> Stored:
+        records = fetch(_rect_bbox(rect, zoom))
+        return _store_rect(
+            namespace, rect, records, zoom=zoom, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s, coords=coords
+        )
+
+    freshness = cache.FRESH
+    partial = False
+    if missing:
+        rect = _rect(missing)
+
+        def _leader() -> Stored:
+            cached = _cached_tiles(namespace, zoom, missing)
+            return (cached, False) if cached is not None else _refresh(rect)
+
+        (fetched, partial), _ = singleflight.do(_rect_key(namespace, zoom, rect), _leader)
+        found.update(fetched)
+        freshness = cache.MISS
+    elif stale:
+        rect = _rect(stale)
+        freshness = cache.revalidate(_rect_key(namespace, zoom, rect), lambda: _refresh(rect))
+    return _result(_inside(covering, found, bbox, coords), partial), freshness
+
+
+async def get_bbox_async(
+    namespace: str,
+    bbox: BBox,
+    *,
+    zoom: int,
+    ttl_s: float,
+    hard_ttl_s: float | None = None,
+    fetch: Callable[[BBox], Awaitable[Iterable[dict[str, Any]]]],
+    coords: Coords,
+) -> tuple[list[dict[str, Any]], str]:
+    """`get_bbox` for coroutines, over the same tiles."""
+    covering, found, missing, stale = _lookup_tiles(namespace, bbox, zoom)
+
+    async def _refresh(rect: Rect) -> Stored:
+        records = await fetch(_rect_bbox(rect, zoom))
+        return _store_rect(
+            namespace, rect, records, zoom=zoom, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s, coords=coords
+        )
+
+    freshness = cache.FRESH
+    partial = False
+    if missing:
+        rect = _rect(missing)
+
+        async def _leader() -> Stored:
+            cached = _cached_tiles(namespace, zoom, missing)
+            return (cached, False) if cached is not None else await _refresh(rect)
+
+        (fetched, partial), _ = await singleflight.do_async(
+            _rect_key(namespace, zoom, rect), _leader
+        )
+        found.update(fetched)
+        freshness = cache.MISS
+    elif stale:
+        rect = _rect(stale)
+        freshness = cache.revalidate_async(_rect_key(namespace, zoom, rect), lambda: _refresh(rect))
+    return _result(_inside(covering, found, bbox, coords), partial), freshness
+
+
+def _result(records: list[dict[str, Any]], partial: bool) -> list[dict[str, Any]]:
+    return Partial(records) if partial else records
+
+
+def _rect(tile_list: list[Tile]) -> Rect:
+    xs = [x for x, _ in tile_list]
+    ys = [y for _, y in tile_list]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _rect_key(namespace: str, zoom: int, rect: Rect) -> str:
+    return f"{namespace}:{zoom}:" + ":".join(map(str, rect))
+
+
+def _rect_bbox(rect: Rect, zoom: int) -> BBox:
+    # One upstream call covers the rectangle spanning the tiles that need data.
+    x0, y0, x1, y1 = rect
+    min_lat, min_lon, _, _ = tiles.tile_bounds(zoom, x0, y1)
+    _, _, max_lat, max_lon = tiles.tile_bounds(zoom, x1, y0)
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def _store_rect(
+    namespace: str,
+    rect: Rect,
+    records: Iterable[dict[str, Any]],
+    *,
+    zoom: int,
+    ttl_s: float,
+    hard_ttl_s: float | None,
+    coords: Coords,
+) -> Stored:
+    # Every tile in the rectangle is (re)written, including the empty ones, unless
+    # the records are partial: then none of them is known to be complete.
+    x0, y0, x1, y1 = rect
+    buckets: dict[Tile, list[dict[str, Any]]] = {
+        (x, y): [] for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)
+    }
+    for record in records:
+        point = coords(record)
+        if point is None:
+            continue
+        tile = tiles.lonlat_to_tile(point[1], point[0], zoom)
+        if tile in buckets:
+            buckets[tile].append(record)
+    _count(upstream_fetches=1)
+    if is_partial(records):
+        return buckets, True
+    for (x, y), bucket in buckets.items():
+        cache.set(tile_key(namespace, zoom, x, y), bucket, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s)
+    return buckets, False
+
+
+def get_point(
+    namespace: str,
+    lat: float,
+    lon: float,
+    *,
+    zoom: int,
+    ttl_s: float,
+    hard_ttl_s: float | None = None,
+    fetch: Callable[[float, float], Any],
+) -> tuple[Any, str]:
+    """Cache a point query per tile, asking upstream about the tile center.
+
+    For providers that only take a point (UnwiredLabs, Shodan `geo:`), nearby
+    queries that fall in the same tile share one upstream call.
+    """
+    x, y = tiles.lonlat_to_tile(lon, lat, zoom)
+
+    def _fetch() -> Any:
+        _count(upstream_fetches=1)
+        return fetch(*tiles.tile_center(zoom, x, y))
+
+    value, freshness = cache.get_or_fetch(
+        tile_key(namespace, zoom, x, y), _fetch, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s
+    )
+    if freshness == cache.MISS:
+        _count(tile_misses=1)
+    else:
+        _count(tile_hits=1)
+    return value, freshness
+
+
+async def get_point_async(
+    namespace: str,
+    lat: float,
+    lon: float,
+    *,
+    zoom: int,
+    ttl_s: float,
+    hard_ttl_s: float | None = None,
+    fetch: Callable[[float, float], Awaitable[Any]],
+) -> tuple[Any, str]:
+    """`get_point` for coroutines, over the same tiles."""
+    x, y = tiles.lonlat_to_tile(lon, lat, zoom)
+
+    async def _fetch() -> Any:
+        _count(upstream_fetches=1)
+        return await fetch(*tiles.tile_center(zoom, x, y))
+
+    value, freshness = await cache.get_or_fetch_async(
+        tile_key(namespace, zoom, x, y), _fetch, ttl_s=ttl_s, hard_ttl_s=hard_ttl_s
+    )
+    _count(**{"tile_misses" if freshness == cache.MISS else "tile_hits": 1})
+    return value, freshness
+
+
+def peek_bbox(namespace: str, bbox: BBox, *, zoom: int, max_tiles: int) -> list[Any] | None:
+    """Cached values of the tiles covering `bbox`, without fetching anything.
+
+    Returns None when `bbox` spans more than `max_tiles` tiles.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    x0, y0 = tiles.lonlat_to_tile(min_lon, max_lat, zoom)
+    x1, y1 = tiles.lonlat_to_tile(max_lon, min_lat, zoom)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > max_tiles:
+        return None
+    keys = [tile_key(namespace, zoom, x, y) for x, y in tiles.tiles_for_bbox(bbox, zoom)]
+    return list(cache.peek_many(keys).values())
+
+
+def stats() -> dict[str, int]:
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def float_coords(lat_field: str, lon_field: str) -> Coords:
+    def _coords(record: dict[str, Any]) -> tuple[float, float] | None:
+        try:
+            return float(record[lat_field]), float(record[lon_field])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    return _coords
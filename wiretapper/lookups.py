@@ -0,0 +1,572 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from . import cache, fanout, geocache, metrics, store, tiles, timing, towerdb
+from .classify import classify_device, classify_many
+from .config import Settings
+from .errors import UpstreamError
+from .services import opencellid, shodan, wigle
+
+# Provider lookups used by the routes. They take `Settings` explicitly (no Flask
+# context) so they can run on the fan-out executor.
+
+
+# Half-widths (degrees) of the boxes each route has always queried around a point.
+WIGLE_DELTA = 0.01
+TOWERS_DELTA = 0.05
+CELLTOWER_DELTA = 0.01
+# Point providers answered from the observation store return what lies this close
+# to the tile center they were queried at (Shodan `geo:` uses a 1 km radius).
+POINT_RADIUS = 0.01
+
+
+def _network_name(network: dict[str, Any]) -> str | None:
+    name = network.get("ssid")
+    return str(name) if name else None
+
+
+def normalize_wigle_network(
+    network: dict[str, Any], device_type: str | None = None
+) -> dict[str, Any]:
+    name = network.get("ssid")
+    return {
+        "lat": network.get("trilat"),
+        "lon": network.get("trilong"),
+        "ssid": name,
+        "bssid": network.get("netid"),
+        "vendor": network.get("vendor"),
+        "signal": network.get("level"),
+        "timestamp": network.get("lastupdt"),
+        "type": device_type or classify_device(_network_name(network), "router"),
+    }
+
+
+@timing.timed("normalize")
+@metrics.timed(metrics.NORMALIZE_SECONDS, "wigle:wifi")
+def normalize_wigle_networks(networks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    types = classify_many(map(_network_name, networks), "router")
+    return [normalize_wigle_network(n, t) for n, t in zip(networks, types, strict=True)]
+
+
+def _bluetooth_name(device: dict[str, Any]) -> str | None:
+    name = device.get("name") or device.get("netid")
+    return str(name) if name else None
+
+
+def normalize_wigle_bluetooth(
+    device: dict[str, Any], device_type: str | None = None
+) -> dict[str, Any]:
+    name = device.get("name") or device.get("netid")
+    classified_type = device_type or classify_device(_bluetooth_name(device), "bluetooth")
+    return {
+        "lat": device.get("trilat"),
+        "lon": device.get("trilong"),
+        "ssid": name,
+        "bssid": device.get("netid"),
+        "vendor": device.get("type")
+        or (
+            "Bluetooth Node"
+            if classified_type == "bluetooth"
+            else classified_type.replace("_", " ").title()
+        ),
+        "signal": device.get("level"),
+        "timestamp": device.get("lastupdt"),
+        "type": classified_type,
+    }
+
+
+@timing.timed("normalize")
+@metrics.timed(metrics.NORMALIZE_SECONDS, "wigle:bt")
+def normalize_wigle_bluetooth_devices(devices: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    types = classify_many(map(_bluetooth_name, devices), "bluetooth")
+    return [normalize_wigle_bluetooth(d, t) for d, t in zip(devices, types, strict=True)]
+
+
+def normalize_unwired_cell(cell: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "lat": cell.get("lat"),
+        "lon": cell.get("lon"),
+        "cell_id": str(cell.get("cellid")),
+        "signal": cell.get("signal"),
+        "accuracy": cell.get("accuracy"),
+        "timestamp": cell.get("updated"),
+        "type": "cell_tower",
+    }
+
+
+def _unwired_cell_list(data: dict[str, Any] | None) -> list[dict[str, Any]]:
+    if not data or data.get("status") != "ok":
+        return []
+    return data.get("cells", []) or []
+
+
+@timing.timed("normalize")
+@metrics.timed(metrics.NORMALIZE_SECONDS, "unwired")
+def normalize_unwired_cells(data: dict[str, Any] | None) -> list[dict[str, Any]]:
+    return [normalize_unwired_cell(cell) for cell in _unwired_cell_list(data)]
+
+
+def normalize_opencellid_cell(cell: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": str(cell.get("cellid", "Unknown")),
+        "lat": float(cell.get("lat")),
+        "lon": float(cell.get("lon")),
+        "lac": cell.get("lac", 0),
+        "mcc": cell.get("mcc", 0),
+        "mnc": cell.get("mnc", 0),
+        "signal": cell.get("signal", 0),
+        "radio": cell.get("radio", "gsm"),
+    }
+
+
+def normalize_opencellid_feature(feature: dict[str, Any]) -> dict[str, Any]:
+    props = feature.get("properties", {}) or {}
+    geom = feature.get("geometry", {}) or {}
+    coords = geom.get("coordinates", [0, 0])
+    return {
+        "id": str(props.get("cellid", props.get("unit", "Unknown"))),
+        "lat": float(coords[1]),
+        "lon": float(coords[0]),
+        "lac": props.get("area", 0),
+        "mcc": props.get("mcc", 0),
+        "mnc": props.get("net", 0),
+        "signal": props.get("samples", 0),
+        "radio": props.get("radio", "gsm"),
+    }
+
+
+def _banner_text(banner: dict[str, Any]) -> str | None:
+    info = banner.get("data", "")
+    return str(info) if info else None
+
+
+def normalize_shodan_banner(
+    banner: dict[str, Any], device_type: str | None = None
+) -> dict[str, Any]:
+    info = banner.get("data", "")
+    location = banner.get("location", {}) or {}
+    return {
+        "lat": location.get("latitude"),
+        "lon": location.get("longitude"),
+        "ip": banner.get("ip_str"),
+        "info": str(info)[:50],
+        "type": device_type or classify_device(_banner_text(banner), "iot_device"),
+    }
+
+
+@timing.timed("normalize")
+@metrics.timed(metrics.NORMALIZE_SECONDS, "shodan:geo")
+def normalize_shodan_banners(banners: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    types = classify_many(map(_banner_text, banners), "iot_device")
+    return [normalize_shodan_banner(b, t) for b, t in zip(banners, types, strict=True)]
+
+
+def _feature_coords(feature: dict[str, Any]) -> tuple[float, float] | None:
+    coords = (feature.get("geometry", {}) or {}).get("coordinates") or []
+    try:
+        return float(coords[1]), float(coords[0])
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+_wigle_coords = geocache.float_coords("trilat", "trilong")
+_cell_coords = geocache.float_coords("lat", "lon")
+
+
+def _shodan_coords(banner: dict[str, Any]) -> tuple[float, float] | None:
+    location = banner.get("location", {}) or {}
+    try:
+        return float(location["latitude"]), float(location["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _wigle_uid(record: dict[str, Any]) -> str | None:
+    netid = record.get("netid")
+    return str(netid).lower() if netid else None
+
+
+def _cell_uid(cell: dict[str, Any]) -> str | None:
+    if cell.get("cellid") is None:
+        return None
+    parts = (cell.get(k, "") for k in ("radio", "mcc", "mnc", "lac", "cellid"))
+    return ":".join(str(p) for p in parts)
+
+
+def _shodan_uid(banner: dict[str, Any]) -> str | None:
+    ip = banner.get("ip_str")
+    return f"{ip}:{banner.get('port', '')}" if ip else None
+
+
+def _through_store(
+    settings: Settings,
+    source: str,
+    fetch: Callable[[tiles.BBox], Iterable[dict[str, Any]]],
+    *,
+    uid: store.Uid,
+    coords: store.Coords,
+    normalize: store.Normalize,
+) -> Callable[[tiles.BBox], Iterable[dict[str, Any]]]:
+    """Wrap an area fetch so results are kept in the observation store, and served
+    from it while every tile of the box was fetched within the freshness window."""
+
+    def _fetch(bbox: tiles.BBox) -> Iterable[dict[str, Any]]:
+        db = store.get_store()
+        if db is None:
+            return fetch(bbox)
+        zoom = settings.geo_tile_zoom
+        stored = db.try_covered(source, bbox, bbox, zoom=zoom, max_age_s=settings.store_freshness_s)
+        if stored is not None:
+            return stored
+        # Read every page before opening the write transaction.
+        found = fetch(bbox)
+        records = list(found)
+        # A box cut short by a cap is not covered: the next query fetches it again.
+        partial = geocache.is_partial(found)
+        db.try_ingest(
+            source,
+            records,
+            covered=None if partial else bbox,
+            zoom=zoom,
+            uid=uid,
+            coords=coords,
+            normalize=normalize,
+        )
+        return geocache.Partial(records) if partial else records
+
+    return _fetch
+
+
+def _through_store_point(
+    settings: Settings,
+    source: str,
+    fetch: Callable[[float, float], Any],
+    *,
+    records_of: Callable[[Any], list[dict[str, Any]]],
+    rebuild: Callable[[list[dict[str, Any]]], Any],
+    uid: store.Uid,
+    coords: store.Coords,
+    normalize: store.Normalize,
+) -> Callable[[float, float], Any]:
+    """Like `_through_store` for point providers queried at a tile center: coverage
+    is the tile, and stored records within `POINT_RADIUS` of the center answer it."""
+
+    def _fetch(lat: float, lon: float) -> Any:
+        db = store.get_store()
+        if db is None:
+            return fetch(lat, lon)
+        zoom = settings.geo_tile_zoom
+        tile_bbox = tiles.tile_bounds(zoom, *tiles.lonlat_to_tile(lon, lat, zoom))
+        nearby = tiles.bbox_around(lat, lon, POINT_RADIUS)
+        stored = db.try_covered(
+            source, tile_bbox, nearby, zoom=zoom, max_age_s=settings.store_freshness_s
+        )
+        if stored is not None:
+            return rebuild(stored)
+        data = fetch(lat, lon)
+        db.try_ingest(
+            source,
+            records_of(data),
+            covered=tile_bbox,
+            zoom=zoom,
+            uid=uid,
+            coords=coords,
+            normalize=normalize,
+        )
+        return data
+
+    return _fetch
+
+
+def wigle_networks(
+    settings: Settings, *, lat: float, lon: float, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], str]:
+    return wigle_networks_bbox(settings, tiles.bbox_around(lat, lon, WIGLE_DELTA), ttls=ttls)
+
+
+def wigle_networks_bbox(
+    settings: Settings, bbox: tiles.BBox, *, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], str]:
+    return geocache.get_bbox(
+        "wigle:wifi",
+        bbox,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store(
+            settings,
+            "wigle:wifi",
+            lambda bbox: wigle.network_search_bbox(
+                api_name=settings.wigle_api_name,
+                api_token=settings.wigle_api_token,
+                bbox=bbox,
+                max_records=settings.wigle_max_records,
+                max_pages=settings.wigle_max_pages,
+            ),
+            uid=_wigle_uid,
+            coords=_wigle_coords,
+            normalize=normalize_wigle_network,
+        ),
+        coords=_wigle_coords,
+    )
+
+
+def wigle_bluetooth(
+    settings: Settings, *, lat: float, lon: float, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], str]:
+    return wigle_bluetooth_bbox(settings, tiles.bbox_around(lat, lon, WIGLE_DELTA), ttls=ttls)
+
+
+def wigle_bluetooth_bbox(
+    settings: Settings, bbox: tiles.BBox, *, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], str]:
+    return geocache.get_bbox(
+        "wigle:bt",
+        bbox,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store(
+            settings,
+            "wigle:bt",
+            lambda bbox: wigle.bluetooth_search_bbox(
+                api_name=settings.wigle_api_name,
+                api_token=settings.wigle_api_token,
+                bbox=bbox,
+                max_records=settings.wigle_max_records,
+                max_pages=settings.wigle_max_pages,
+            ),
+            uid=_wigle_uid,
+            coords=_wigle_coords,
+            normalize=normalize_wigle_bluetooth,
+        ),
+        coords=_wigle_coords,
+    )
+
+
+def unwired_cells(
+    settings: Settings, *, lat: float, lon: float, ttls: tuple[float, float]
+) -> tuple[dict[str, Any] | None, str]:
+    return geocache.get_point(
+        "unwired",
+        lat,
+        lon,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store_point(
+            settings,
+            "unwired",
+            lambda tlat, tlon: opencellid.unwiredlabs_process(
+                token=settings.opencellid_api_key, lat=tlat, lon=tlon
+            ),
+            records_of=_unwired_cell_list,
+            rebuild=lambda cells: {"status": "ok", "cells": cells},
+            uid=_cell_uid,
+            coords=_cell_coords,
+            normalize=normalize_unwired_cell,
+        ),
+    )
+
+
+def shodan_geo(
+    settings: Settings, *, lat: float, lon: float, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], str]:
+    return geocache.get_point(
+        "shodan:geo",
+        lat,
+        lon,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_through_store_point(
+            settings,
+            "shodan:geo",
+            lambda tlat, tlon: shodan.host_search(
+                api_key=settings.shodan_api_key, query=f"geo:{tlat:.5f},{tlon:.5f},1", limit=5
+            ),
+            records_of=list,
+            rebuild=lambda banners: banners[:5],
+            uid=_shodan_uid,
+            coords=_shodan_coords,
+            normalize=normalize_shodan_banner,
+        ),
+    )
+
+
+def _area_cells(key: str, bbox: tiles.BBox) -> list[dict[str, Any]]:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    data = opencellid.get_in_area(key=key, bbox=f"{min_lat},{min_lon},{max_lat},{max_lon}")
+    if data is None:
+        raise UpstreamError("Upstream API error")
+    cells = data.get("cells", []) if isinstance(data, dict) else data
+    return cells if isinstance(cells, list) else []
+
+
+def _ajax_features(bbox: tiles.BBox) -> list[dict[str, Any]]:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    data = opencellid.ajax_get_cells(bbox=f"{min_lon},{min_lat},{max_lon},{max_lat}")
+    if not data:
+        raise UpstreamError("Upstream API error")
+    return data.get("features", []) if isinstance(data, dict) else []
+
+
+def area_towers(settings: Settings, *, lat: float, lon: float) -> tuple[list[dict[str, Any]], str]:
+    return area_towers_bbox(settings, tiles.bbox_around(lat, lon, TOWERS_DELTA))
+
+
+def _local_towers(bbox: tiles.BBox) -> tuple[list[dict[str, Any]], str] | None:
+    index = towerdb.get()
+    if index is None:
+        return None
+    with timing.span("towerdb"):
+        return index.query(bbox), cache.FRESH
+
+
+def area_towers_bbox(settings: Settings, bbox: tiles.BBox) -> tuple[list[dict[str, Any]], str]:
+    local = _local_towers(bbox)
+    if local is not None:
+        return local
+    ttls = settings.cache_ttls("towers")
+    cells, freshness = geocache.get_bbox(
+        "opencellid:area",
+        bbox,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=lambda bbox: _area_cells(settings.opencellid_api_key, bbox),
+        coords=_cell_coords,
+    )
+    return [normalize_opencellid_cell(c) for c in cells], freshness
+
+
+def ajax_towers(settings: Settings, *, lat: float, lon: float) -> tuple[list[dict[str, Any]], str]:
+    return ajax_towers_bbox(settings, tiles.bbox_around(lat, lon, CELLTOWER_DELTA))
+
+
+def ajax_towers_bbox(settings: Settings, bbox: tiles.BBox) -> tuple[list[dict[str, Any]], str]:
+    local = _local_towers(bbox)
+    if local is not None:
+        return local
+    ttls = settings.cache_ttls("towers")
+    features, freshness = geocache.get_bbox(
+        "opencellid:ajax",
+        bbox,
+        zoom=settings.geo_tile_zoom,
+        ttl_s=ttls[0],
+        hard_ttl_s=ttls[1],
+        fetch=_ajax_features,
+        coords=_feature_coords,
+    )
+    return [normalize_opencellid_feature(f) for f in features], freshness
+
+
+def nearby_wifi(settings: Settings, *, lat: float, lon: float) -> tuple[list[dict[str, Any]], str]:
+    networks, freshness = wigle_networks(
+        settings, lat=lat, lon=lon, ttls=settings.cache_ttls("nearby")
+    )
+    return _partial_if(networks, normalize_wigle_networks(networks)), freshness
+
+
+def nearby_bluetooth(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    found, freshness = wigle_bluetooth(
+        settings, lat=lat, lon=lon, ttls=settings.cache_ttls("nearby")
+    )
+    return _partial_if(found, normalize_wigle_bluetooth_devices(found)), freshness
+
+
+def _partial_if(found: list[dict[str, Any]], devices: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # Devices normalized from partial records are partial too.
+    return geocache.Partial(devices) if geocache.is_partial(found) else devices
+
+
+def nearby_cells(settings: Settings, *, lat: float, lon: float) -> tuple[list[dict[str, Any]], str]:
+    data, freshness = unwired_cells(settings, lat=lat, lon=lon, ttls=settings.cache_ttls("nearby"))
+    return normalize_unwired_cells(data), freshness
+
+
+def nearby_shodan(
+    settings: Settings, *, lat: float, lon: float
+) -> tuple[list[dict[str, Any]], str]:
+    banners, freshness = shodan_geo(settings, lat=lat, lon=lon, ttls=settings.cache_ttls("nearby"))
+    return normalize_shodan_banners(banners), freshness
+
+
+# Normalizers for the cached value of one tile, per source namespace.
+_TILE_DEVICES: dict[str, Callable[[Any], list[dict[str, Any]]]] = {
+    "wigle:wifi": normalize_wigle_networks,
+    "wigle:bt": normalize_wigle_bluetooth_devices,
+    "unwired": normalize_unwired_cells,
+    "shodan:geo": normalize_shodan_banners,
+}
+
+
+def local_devices(
+    settings: Settings, bbox: tiles.BBox, *, mode: str, max_tiles: int
+) -> tuple[list[dict[str, Any]], bool]:
+    """Normalized devices already held locally for `bbox`, without calling upstream.
+
+    Reads the observation store when enabled, else the cached tiles. Returns
+    `(devices, complete)`; `complete` is False when `bbox` spans more than
+    `max_tiles` tiles and the cache was skipped.
+    """
+    sources = ["wigle:bt" if mode == "bluetooth" else "wigle:wifi", "unwired", "shodan:geo"]
+    db = store.get_store()
+    if db is not None:
+        return db.devices_in_bbox(sources, bbox), True
+
+    devices: list[dict[str, Any]] = []
+    complete = True
+    for source in sources:
+        values = geocache.peek_bbox(source, bbox, zoom=settings.geo_tile_zoom, max_tiles=max_tiles)
+        if values is None:
+            complete = False
+            continue
+        for value in values:
+            devices.extend(_TILE_DEVICES[source](value))
+    inside = []
+    for device in devices:
+        try:
+            if tiles.contains(bbox, float(device["lat"]), float(device["lon"])):
+                inside.append(device)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return inside, complete
+
+
+def nearby_tile_keys(settings: Settings, *, lat: float, lon: float, mode: str) -> list[str]:
+    """The cache tiles the `nearby_tasks` lookups answer from."""
+    zoom = settings.geo_tile_zoom
+    area = tiles.bbox_around(lat, lon, WIGLE_DELTA)
+    has_wigle = bool(settings.wigle_api_name and settings.wigle_api_token)
+    if mode == "bluetooth":
+        return geocache.bbox_keys("wigle:bt", area, zoom) if has_wigle else []
+    keys = geocache.bbox_keys("wigle:wifi", area, zoom) if has_wigle else []
+    if settings.opencellid_api_key:
+        keys.append(geocache.point_key("unwired", lat, lon, zoom))
+    if settings.shodan_api_key:
+        keys.append(geocache.point_key("shodan:geo", lat, lon, zoom))
+    return keys
+
+
+def nearby_tasks(
+    settings: Settings, *, lat: float, lon: float, mode: str
+) -> dict[str, fanout.Task]:
+    """Provider lookups for `/nearby`, keyed by provider name, for the fan-out."""
+    tasks: dict[str, fanout.Task] = {}
+    has_wigle = bool(settings.wigle_api_name and settings.wigle_api_token)
+    if mode == "bluetooth":
+        if has_wigle:
+            tasks["wigle"] = lambda: nearby_bluetooth(settings, lat=lat, lon=lon)
+        return tasks
+    if has_wigle:
+        tasks["wigle"] = lambda: nearby_wifi(settings, lat=lat, lon=lon)
+    if settings.opencellid_api_key:
+        tasks["opencellid"] = lambda: nearby_cells(settings, lat=lat, lon=lon)
+    if settings.shodan_api_key:
+        tasks["shodan"] = lambda: nearby_shodan(settings, lat=lat, lon=lon)
+    return tasks
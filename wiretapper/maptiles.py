@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from . import cache, lookups, tiles, towerdb
+from .config import Settings
+
+# Slippy-map tile API: devices and towers per z/x/y tile as compact GeoJSON.
+# Tile URLs carry an epoch (`v`) that moves on every `tile_epoch_s`. Within an
+# epoch a tile is rendered once and its bytes are cached, so each URL is immutable
+# and browsers/CDNs can keep it for the whole epoch.
+
+MAX_ZOOM = 20
+
+Fetch = Callable[[Settings, tiles.BBox], list[dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class Layer:
+    fetch: Fetch
+    enabled: Callable[[Settings], bool]
+
+
+def _has_wigle(settings: Settings) -> bool:
+    return bool(settings.wigle_api_name and settings.wigle_api_token)
+
+
+def _has_towers(settings: Settings) -> bool:
+    return bool(settings.opencellid_api_key) or towerdb.get() is not None
+
+
+def _wifi(settings: Settings, bbox: tiles.BBox) -> list[dict[str, Any]]:
+    networks, _ = lookups.wigle_networks_bbox(settings, bbox, ttls=settings.cache_ttls("nearby"))
+    return lookups.normalize_wigle_networks(networks)
+
+
+def _bluetooth(settings: Settings, bbox: tiles.BBox) -> list[dict[str, Any]]:
+    found, _ = lookups.wigle_bluetooth_bbox(settings, bbox, ttls=settings.cache_ttls("nearby"))
+    return lookups.normalize_wigle_bluetooth_devices(found)
+
+
+LAYERS: dict[str, Layer] = {
+    "wifi": Layer(_wifi, _has_wigle),
+    "bluetooth": Layer(_bluetooth, _has_wigle),
+    "towers": Layer(lambda s, bbox: lookups.area_towers_bbox(s, bbox)[0], _has_towers),
+    "celltower": Layer(lambda s, bbox: lookups.ajax_towers_bbox(s, bbox)[0], _has_towers),
+}
+
+
+def epoch(settings: Settings) -> int:
+    return int(time.time() // settings.tile_epoch_s)
+
+
+def epoch_expires_in(settings: Settings) -> float:
+    return (epoch(settings) + 1) * settings.tile_epoch_s - time.time()
+
+
+def feature_collection(items: list[dict[str, Any]]) -> dict[str, Any]:
+    features = []
+    for item in items:
+        try:
+            lat = float(item["lat"])
+            lon = float(item["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        properties = {k: v for k, v in item.items() if k not in ("lat", "lon") and v is not None}
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [round(lon, 6), round(lat, 6)]},
+                "properties": properties,
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def tile_bytes(
+    settings: Settings, layer: str, z: int, x: int, y: int, *, dumps: Callable[[Any], str]
+) -> bytes:
+    """GeoJSON for one tile of `layer`, rendered once per epoch. Raises `UpstreamError`."""
+    spec = LAYERS[layer]
+    version = epoch(settings)
+
+    def _render() -> bytes:
+        items = spec.fetch(settings, tiles.tile_bounds(z, x, y)) if spec.enabled(settings) else []
+        return dumps(feature_collection(items)).encode()
+
+    body, _ = cache.get_or_fetch(
+        f"tilebytes:{layer}:{version}:{z}:{x}:{y}",
+        _render,
+        ttl_s=max(1.0, epoch_expires_in(settings)),
+    )
+    return body
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import bisect
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+# Prometheus text exposition for `/metrics`. Hot paths record into a shard owned
+# by the current thread (plain dicts, no lock taken); a scrape sums the shards.
+# Shards of finished threads are folded into one at scrape time, so a
+# thread-per-request server does not grow the list. Counters other modules
+# already keep (cache, quotas, rate limiter) are read at scrape time instead.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass(frozen=True, eq=False)
+class Metric:
+    name: str
+    kind: str  # "counter", "gauge" or "histogram"
+    help: str
+    labels: tuple[str, ...] = ()
+    buckets: tuple[float, ...] = ()
+
+
+REQUEST_SECONDS = Metric(
+    "wiretapper_request_duration_seconds",
+    "histogram",
+    "Time to build a response (to the first byte when streamed), by route.",
+    ("route", "method", "status"),
+    LATENCY_BUCKETS,
+)
+RESPONSE_BYTES = Metric(
+    "wiretapper_response_size_bytes",
+    "histogram",
+    "Body size of non-streamed responses, after compression, by route.",
+    ("route",),
+    SIZE_BUCKETS,
+)
+UPSTREAM_SECONDS = Metric(
+    "wiretapper_upstream_request_duration_seconds",
+    "histogram",
+    "Upstream call latency by provider and outcome (2xx, 4xx, 5xx, error, timeout).",
+    ("provider", "outcome"),
+    LATENCY_BUCKETS,
+)
+NORMALIZE_SECONDS = Metric(
+    "wiretapper_normalize_duration_seconds",
+    "histogram",
+    "Time to normalize one batch of provider records, by source.",
+    ("source",),
+    FAST_BUCKETS,
+)
+RATELIMIT_REJECTED = Metric(
+    "wiretapper_ratelimit_rejected_total",
+    "counter",
+    "Requests refused by the rate limiter, by bucket.",
+    ("bucket",),
+)
+
+# Read from other modules' stats at scrape time.
+CACHE_LOOKUPS = Metric(
+    "wiretapper_cache_lookups_total",
+    "counter",
+    "Cache lookups by namespace and result (hit, stale, miss).",
+    ("namespace", "result"),
+)
+CACHE_EVICTIONS = Metric(
+    "wiretapper_cache_evictions_total",
+    "counter",
+    "Cache entries evicted to stay within budget, by namespace.",
+    ("namespace",),
+)
+CACHE_BYTES = Metric(
+    "wiretapper_cache_bytes",
+    "gauge",
+    "Estimated size of cached values, by namespace.",
+    ("namespace",),
+)
+UPSTREAM_IN_FLIGHT = Metric(
+    "wiretapper_upstream_in_flight",
+    "gauge",
+    "Upstream calls in progress, by provider.",
+    ("provider",),
+)
+UPSTREAM_QUEUED = Metric(
+    "wiretapper_upstream_queued",
+    "gauge",
+    "Upstream calls waiting for a quota slot, by provider.",
+    ("provider",),
+)
+RATELIMIT_BUCKETS = Metric(
+    "wiretapper_ratelimit_buckets", "gauge", "Live rate-limit buckets (one per client and route)."
+)
+PREFETCH_CELLS = Metric(
+    "wiretapper_prefetch_cells_total",
+    "counter",
+    "Prefetched query areas by outcome (warmed, hit by a later request, dropped from the queue).",
+    ("outcome",),
+)
+
+Sample = tuple[Metric, tuple[str, ...], float]
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: dict[tuple[Metric, tuple[str, ...]], float] = {}
+        # Per-bucket counts (the last one is +Inf), then the sum.
+        self.histograms: dict[tuple[Metric, tuple[str, ...]], list[float]] = {}
+
+
+_LOCAL = threading.local()
+_SHARDS: list[tuple[threading.Thread, _Shard]] = []
+_RETIRED = _Shard()
+_LOCK = threading.Lock()
+
+
+def _shard() -> _Shard:
+    try:
+        return _LOCAL.shard
+    except AttributeError:
+        shard = _LOCAL.shard = _Shard()
+        with _LOCK:
+            _SHARDS.append((threading.current_thread(), shard))
+        return shard
+
+
+def inc(metric: Metric, *labels: str, value: float = 1.0) -> None:
+    counters = _shard().counters
+    key = (metric, labels)
+    counters[key] = counters.get(key, 0.0) + value
+
+
+def observe(metric: Metric, value: float, *labels: str) -> None:
+    histograms = _shard().histograms
+    key = (metric, labels)
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0.0] * (len(metric.buckets) + 2)
+    counts[bisect.bisect_left(metric.buckets, value)] += 1
+    counts[-1] += value
+
+
+def timed(metric: Metric, *labels: str) -> Callable[[F], F]:
+    """Decorator: observe each call's duration in `metric`."""
+
+    def decorate(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(metric, time.perf_counter() - started, *labels)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+def _merge(into: _Shard, shard: _Shard) -> None:
+    # `list(d.items())` copies without running Python code, so an owner thread
+    # writing meanwhile cannot break the iteration.
+    for key, value in list(shard.counters.items()):
+        into.counters[key] = into.counters.get(key, 0.0) + value
+    for key, counts in list(shard.histograms.items()):
+        total = into.histograms.setdefault(key, [0.0] * len(counts))
+        for index, count in enumerate(list(counts)):
+            total[index] += count
+
+
+def _snapshot() -> _Shard:
+    with _LOCK:
+        live = []
+        for thread, shard in _SHARDS:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(_RETIRED, shard)
+        _SHARDS[:] = live
+        total = _Shard()
+        _merge(total, _RETIRED)
+        for _, shard in live:
+            _merge(total, shard)
+    return total
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _order(item: tuple[tuple[Metric, tuple[str, ...]], Any]) -> tuple[str, ...]:
+    (metric, labels), _ = item
+    return (metric.name, *labels)
+
+
+def render(collected: Iterable[Sample] = ()) -> str:
+    """The text exposition of every recorded metric plus the `collected` samples."""
+    snapshot = _snapshot()
+    by_metric: dict[Metric, list[str]] = {}
+    for (metric, labels), value in sorted(snapshot.counters.items(), key=_order):
+        by_metric.setdefault(metric, []).append(
+            f"{metric.name}{_labels(metric.labels, labels)} {_number(value)}"
+        )
+    for metric, labels, value in collected:
+        by_metric.setdefault(metric, []).append(
+            f"{metric.name}{_labels(metric.labels, labels)} {_number(value)}"
+        )
+    for (metric, labels), counts in sorted(snapshot.histograms.items(), key=_order):
+        lines = by_metric.setdefault(metric, [])
+        cumulative = 0.0
+        for bound, count in zip((*metric.buckets, float("inf")), counts, strict=False):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            bucket_labels = _labels(metric.labels, labels, f'le="{le}"')
+            lines.append(f"{metric.name}_bucket{bucket_labels} {_number(cumulative)}")
+        series = _labels(metric.labels, labels)
+        lines.append(f"{metric.name}_sum{series} {_number(counts[-1])}")
+        lines.append(f"{metric.name}_count{series} {_number(cumulative)}")
+    out: list[str] = []
+    for metric in sorted(by_metric, key=lambda m: m.name):
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(by_metric[metric])
+    return "\n".join(out) + "\n"
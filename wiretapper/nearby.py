@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from flask import Request, Response
+
+from . import cache, lookups, prefetch, ratelimit, responses, streaming, timing
+from .config import Settings
+
+# `GET /nearby` from request to response, shared by the Flask route and the
+# native ASGI route. Each entry point runs the lookups on its own I/O model
+# (threads or coroutines) and writes streamed records itself; parsing,
+# admission, errors, the ETag and the JSON body are decided here.
+
+
+@dataclass
+class Query:
+    lat: float
+    lon: float
+    mode: str
+    fmt: str | None  # "ndjson" or "sse" when streamed, else None
+    keys: list[str]  # cache tiles the lookups answer from
+    versions: dict[str, float]  # their `cache.versions` before the lookups ran
+
+
+def _json(body: Any, status: int, dumps: Callable[..., str]) -> Response:
+    return Response(dumps(body) + "\n", status=status, mimetype="application/json")
+
+
+def start(settings: Settings, request: Request, *, dumps: Callable[..., str]) -> Query | Response:
+    """Parse and admit a request: its `Query`, or the response refusing it."""
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    mode = request.args.get("mode", "wifi")
+    if not lat or not lon:
+        return _json({"error": "Missing coordinates"}, 400, dumps)
+
+    client = ratelimit.client_address(request.remote_addr, request.headers.get("X-Forwarded-For"))
+    with timing.span("ratelimit"):
+        allowed = ratelimit.allow(f"nearby:{client}", per_minute=settings.rate_limit_rpm)
+    if not allowed:
+        return _json({"error": "Rate limit exceeded. Please slow down."}, 429, dumps)
+
+    prefetch.observe(settings, mode, lat, lon)
+    fmt = streaming.negotiate(request.args.get("stream"), request.headers.get("Accept", ""))
+    keys = lookups.nearby_tile_keys(settings, lat=lat, lon=lon, mode=mode)
+    return Query(lat, lon, mode, fmt, keys, cache.versions(keys))
+
+
+def finish(
+    query: Query, request: Request, records: list[dict[str, Any]], *, dumps: Callable[..., str]
+) -> Response:
+    """The JSON response for the collected `records` of a non-streamed query.
+
+    The ETag is computed before rendering, so a matching `If-None-Match` is
+    answered with a 304 without serializing the devices.
+    """
+    devices, final = streaming.collect(records)
+    if "error" in final:
+        return _json(final, 502, dumps)
+    stable = streaming.stable_view(
+        devices,
+        final,
+        query=(query.lat, query.lon, query.mode),
+        keys=query.keys,
+        tiles_before=query.versions,
+        tiles_after=cache.versions(query.keys),
+    )
+    tag = responses.etag(stable, dumps)
+    if responses.matches(request, tag):
+        return responses.not_modified(tag)
+    with timing.span("render"):
+        response = _json({"devices": devices, "meta": final["meta"]}, 200, dumps)
+    response.set_etag(tag)
+    return response
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+from . import lookups, tiles, towerdb
+from .config import Settings
+from .errors import QuotaExceededError, UpstreamError
+from .services import http
+from .tiles import BBox
+
+# Predictive prefetch and cache warming. Query areas are cells of a grid whose step
+# is the width of the box a route asks upstream for. After a `/nearby` or towers
+# request, the cells around it are queued for a background worker, which makes the
+# lookups a request panned by one box width would make. It runs at low priority and
+# only while the provider keeps `reserve` of its daily quota. A later request in a
+# warmed cell is a prefetch hit. `warm()` fills every cell of an area instead.
+
+MODES = ("wifi", "bluetooth", "towers")
+
+Cell = tuple[str, int, int]  # mode, row, column
+Fetch = Callable[[Settings, float, float], Any]
+
+
+@dataclass(frozen=True)
+class Policy:
+    rings: int = 0  # 0 = off, 1 = the 8 neighbouring cells, 2 = the 24 around them...
+    reserve: float = 0.5  # share of a provider's daily quota left for interactive calls
+    max_queue: int = 64
+    max_cells: int = 10_000  # cells remembered for hit accounting
+
+
+# Per mode: the quota provider and lookup of each source, whether it is cached per
+# point (one tile per call) rather than per box, and the box half-width.
+_SOURCES: dict[str, tuple[tuple[str, Fetch, bool], ...]] = {
+    "wifi": (
+        ("wigle", lambda s, lat, lon: lookups.nearby_wifi(s, lat=lat, lon=lon), False),
+        ("unwiredlabs", lambda s, lat, lon: lookups.nearby_cells(s, lat=lat, lon=lon), True),
+        ("shodan", lambda s, lat, lon: lookups.nearby_shodan(s, lat=lat, lon=lon), True),
+    ),
+    "bluetooth": (
+        ("wigle", lambda s, lat, lon: lookups.nearby_bluetooth(s, lat=lat, lon=lon), False),
+    ),
+    "towers": (
+        ("opencellid", lambda s, lat, lon: lookups.area_towers(s, lat=lat, lon=lon), False),
+    ),
+}
+_HALF_WIDTH = {
+    "wifi": lookups.WIGLE_DELTA,
+    "bluetooth": lookups.WIGLE_DELTA,
+    "towers": lookups.TOWERS_DELTA,
+}
+# A quota refusal further out than this (a spent daily quota) ends warming.
+_MAX_QUOTA_WAIT_S = 60.0
+
+
+def cell_of(mode: str, lat: float, lon: float) -> Cell:
+    step = 2 * _HALF_WIDTH[mode]
+    return mode, math.floor(lat / step), math.floor(lon / step)
+
+
+def cell_center(cell: Cell) -> tuple[float, float]:
+    mode, row, col = cell
+    step = 2 * _HALF_WIDTH[mode]
+    return (row + 0.5) * step, (col + 0.5) * step
+
+
+def neighbours(cell: Cell, rings: int) -> list[Cell]:
+    """The cells within `rings` of `cell`, nearest ring first."""
+    mode, row, col = cell
+    around = [
+        (max(abs(dr), abs(dc)), (mode, row + dr, col + dc))
+        for dr in range(-rings, rings + 1)
+        for dc in range(-rings, rings + 1)
+        if dr or dc
+    ]
+    return [c for _, c in sorted(around)]
+
+
+def cells_in_bbox(mode: str, bbox: BBox) -> list[Cell]:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    _, row0, col0 = cell_of(mode, min_lat, min_lon)
+    _, row1, col1 = cell_of(mode, max_lat, max_lon)
+    return [(mode, r, c) for r in range(row0, row1 + 1) for c in range(col0, col1 + 1)]
+
+
+def _has_key(settings: Settings, provider: str) -> bool:
+    if provider == "wigle":
+        return bool(settings.wigle_api_name and settings.wigle_api_token)
+    if provider == "shodan":
+        return bool(settings.shodan_api_key)
+    if provider == "opencellid" and towerdb.get() is not None:
+        return False  # answered from the local index; nothing to warm
+    return bool(settings.opencellid_api_key)
+
+
+def _tile_centers(settings: Settings, cell: Cell) -> list[tuple[float, float]]:
+    mode, row, col = cell
+    step = 2 * _HALF_WIDTH[mode]
+    bbox = (row * step, col * step, (row + 1) * step, (col + 1) * step)
+    zoom = settings.geo_tile_zoom
+    return [tiles.tile_center(zoom, x, y) for x, y in tiles.tiles_for_bbox(bbox, zoom)]
+
+
+def _fetch(settings: Settings, fetch: Fetch, lat: float, lon: float, wait_for_quota: bool) -> None:
+    while True:
+        try:
+            fetch(settings, lat, lon)
+            return
+        except QuotaExceededError as exc:
+            wait_s = exc.retry_after_s if exc.retry_after_s is not None else 0.5
+            if not wait_for_quota or wait_s > _MAX_QUOTA_WAIT_S:
+                raise
+            time.sleep(wait_s)
+
+
+def warm_cell(
+    settings: Settings,
+    cell: Cell,
+    *,
+    at: tuple[float, float] | None = None,
+    reserve: float,
+    wait_for_quota: bool = False,
+) -> dict[str, str]:
+    """Fetch `cell` through the cache; `{provider: warmed | skipped | error}`.
+
+    With `at`, only what a request at that point would fetch; otherwise the whole
+    cell, which for point sources is one call per tile. A provider is skipped
+    while it has `reserve` or less of its daily quota left, or when the quota
+    refuses a call (after waiting, with `wait_for_quota`).
+    """
+    outcomes: dict[str, str] = {}
+    for provider, fetch, per_point in _SOURCES[cell[0]]:
+        if not _has_key(settings, provider):
+            continue
+        if at is not None:
+            points = [at]
+        elif per_point:
+            points = _tile_centers(settings, cell)
+        else:
+            points = [cell_center(cell)]
+        outcomes[provider] = "warmed"
+        for lat, lon in points:
+            if reserve > 0 and http.headroom(provider) <= reserve:
+                outcomes[provider] = "skipped"
+                break
+            try:
+                _fetch(settings, fetch, lat, lon, wait_for_quota)
+            except QuotaExceededError:
+                outcomes[provider] = "skipped"
+                break
+            except UpstreamError:
+                outcomes[provider] = "error"
+                break
+    return outcomes
+
+
+_POLICY = Policy()
+_LOCK = threading.Condition()
+_QUEUE: deque[tuple[Settings, Cell, tuple[float, float]]] = deque()
+# Cell -> (state, expires at): "queued", "warmed", or "seen" (requested).
+_CELLS: OrderedDict[Cell, tuple[str, float]] = OrderedDict()
+_COUNTS: Counter[str] = Counter()
+_WORKER: threading.Thread | None = None
+
+
+def configure(policy: Policy) -> None:
+    """Apply `policy`; queued cells are dropped and the counters start over."""
+    global _POLICY
+    with _LOCK:
+        _POLICY = policy
+        _QUEUE.clear()
+        _CELLS.clear()
+        _COUNTS.clear()
+
+
+def _state(cell: Cell, now: float) -> str | None:
+    # Caller holds the lock.
+    entry = _CELLS.get(cell)
+    if entry is None:
+        return None
+    if entry[1] <= now:
+        del _CELLS[cell]
+        return None
+    return entry[0]
+
+
+def _remember(cell: Cell, state: str, expires_at: float) -> None:
+    # Caller holds the lock.
+    _CELLS[cell] = (state, expires_at)
+    _CELLS.move_to_end(cell)
+    while len(_CELLS) > _POLICY.max_cells:
+        _CELLS.popitem(last=False)
+
+
+def _ttl_s(settings: Settings, mode: str) -> float:
+    # Warmed tiles are served (stale, then revalidated) until the hard TTL.
+    return settings.cache_ttls("towers" if mode == "towers" else "nearby")[1]
+
+
+def observe(settings: Settings, mode: str, lat: float, lon: float) -> None:
+    """Note a request and queue the cells around it; never blocks on upstream."""
+    global _WORKER
+    if _POLICY.rings <= 0 or mode not in _SOURCES:
+        return
+    origin = cell_of(mode, lat, lon)
+    now = time.monotonic()
+    expires_at = now + _ttl_s(settings, mode)
+    with _LOCK:
+        _COUNTS["requests"] += 1
+        if _state(origin, now) == "warmed":
+            _COUNTS["hits"] += 1
+        _remember(origin, "seen", expires_at)
+        step = 2 * _HALF_WIDTH[mode]
+        for cell in neighbours(origin, _POLICY.rings):
+            if _state(cell, now) is not None:
+                continue
+            if len(_QUEUE) >= _POLICY.max_queue:
+                _COUNTS["dropped"] += 1
+                continue
+            _remember(cell, "queued", expires_at)
+            # Where a pan to that cell would put the next request.
+            at = lat + (cell[1] - origin[1]) * step, lon + (cell[2] - origin[2]) * step
+            _QUEUE.append((settings, cell, at))
+        if _WORKER is None or not _WORKER.is_alive():
+            _WORKER = threading.Thread(target=_work, name="wiretapper-prefetch", daemon=True)
+            _WORKER.start()
+        _LOCK.notify()
+
+
+def _work() -> None:
+    while True:
+        with _LOCK:
+            while not _QUEUE:
+                _LOCK.wait()
+            settings, cell, at = _QUEUE.popleft()
+            reserve = _POLICY.reserve
+        with http.priority(http.PRIORITY_BACKGROUND):
+            outcomes = warm_cell(settings, cell, at=at, reserve=reserve)
+        with _LOCK:
+            _COUNTS.update(outcomes.values())
+            entry = _CELLS.get(cell)
+            if entry is not None and entry[0] == "queued":
+                if "warmed" in outcomes.values():
+                    _CELLS[cell] = ("warmed", entry[1])
+                    _COUNTS["cells"] += 1
+                else:
+                    del _CELLS[cell]
+
+
+def warm(
+    settings: Settings,
+    bbox: BBox,
+    modes: Iterable[str],
+    *,
+    workers: int = 4,
+    progress: Callable[[int, int], None] | None = None,
+) -> Counter[str]:
+    """Warm every cell of `bbox` for `modes` now, waiting for quota as needed."""
+    cells = [cell for mode in modes for cell in cells_in_bbox(mode, bbox)]
+    totals: Counter[str] = Counter()
+
+    def _one(cell: Cell) -> dict[str, str]:
+        return warm_cell(settings, cell, reserve=0.0, wait_for_quota=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for done, outcomes in enumerate(pool.map(_one, cells), 1):
+            totals.update(outcomes.values())
+            if progress is not None:
+                progress(done, len(cells))
+    return totals
+
+
+def stats() -> dict[str, Any]:
+    with _LOCK:
+        counts = dict(_COUNTS)
+        queued = len(_QUEUE)
+        rings = _POLICY.rings
+    cells = counts.get("cells", 0)
+    return {
+        "enabled": rings > 0,
+        "rings": rings,
+        "queued": queued,
+        "requests": counts.get("requests", 0),
+        "cells_warmed": cells,
+        "hits": counts.get("hits", 0),
+        # Share of warmed cells that a later request used.
+        "hit_rate": round(counts.get("hits", 0) / cells, 3) if cells else None,
+        "calls": {k: counts.get(k, 0) for k in ("warmed", "skipped", "error")},
+        "dropped": counts.get("dropped", 0),
+    }
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import cProfile
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+
+# Opt-in profiling for offline flame graphs. Nothing here runs unless both
+# `WIRETAPPER_PROFILE_DIR` and `WIRETAPPER_PROFILE_TOKEN` are set and the caller
+# presents the token. Two modes:
+# - one request: cProfile of the request thread, written as `request-<id>.prof`
+#   (pstats; snakeviz, flameprof or `python -m pstats` read it);
+# - a window: every thread's stack sampled for N seconds, written as
+#   `window-<time>.folded` (collapsed stacks for flamegraph.pl or speedscope).
+
+MAX_WINDOW_S = 300.0
+SAMPLE_INTERVAL_S = 0.005
+
+# cProfile hooks are process-wide on newer Pythons: one request profile at a time.
+_REQUEST_LOCK = threading.Lock()
+_WINDOW: threading.Thread | None = None
+_WINDOW_LOCK = threading.Lock()
+
+
+def authorized(directory: str | None, token: str | None, presented: str | None) -> bool:
+    if not directory or not token or not presented:
+        return False
+    return hmac.compare_digest(presented.encode(), token.encode())
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)[:64]
+
+
+def _write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+class RequestProfile:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._profile = cProfile.Profile()
+
+    def stop(self) -> None:
+        try:
+            self._profile.disable()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._profile.dump_stats(str(self.path))
+        finally:
+            _REQUEST_LOCK.release()
+
+
+def start_request(directory: str, request_id: str) -> RequestProfile | None:
+    """Profile the calling thread until `stop()`; None while another one runs."""
+    if not _REQUEST_LOCK.acquire(blocking=False):
+        return None
+    profile = RequestProfile(Path(directory) / f"request-{_safe(request_id)}.prof")
+    try:
+        profile._profile.enable()
+    except ValueError:  # another profiler owns the hooks
+        _REQUEST_LOCK.release()
+        return None
+    return profile
+
+
+def _collapse(frame: FrameType | None) -> list[str]:
+    names: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _sample(path: Path, seconds: float) -> None:
+    me = threading.get_ident()
+    counts: Counter[str] = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = [threads.get(ident, str(ident)), *_collapse(frame)]
+            counts[";".join(stack)] += 1
+        time.sleep(SAMPLE_INTERVAL_S)
+    _write(path, "".join(f"{stack} {n}\n" for stack, n in counts.most_common()))
+
+
+def start_window(directory: str, seconds: float) -> Path:
+    """Sample every thread for `seconds` in the background; returns the output path.
+
+    Raises `RuntimeError` while another window is being sampled.
+    """
+    global _WINDOW
+    seconds = min(max(seconds, SAMPLE_INTERVAL_S), MAX_WINDOW_S)
+    path = Path(directory) / f"window-{time.strftime('%Y%m%dT%H%M%S')}.folded"
+    with _WINDOW_LOCK:
+        if _WINDOW is not None and _WINDOW.is_alive():
+            raise RuntimeError("A profiling window is already running")
+        _WINDOW = threading.Thread(
+            target=_sample, args=(path, seconds), name="wiretapper-profiler", daemon=True
+        )
+        _WINDOW.start()
+    return path
+
+
+def window_running() -> bool:
+    with _WINDOW_LOCK:
+        return _WINDOW is not None and _WINDOW.is_alive()
@@ -1,39 +1,346 @@
 from __future__ import annotations
 
+import ipaddress
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
-from dataclasses import dataclass
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from . import metrics, sqlitedb
+
+_LOG = logging.getLogger("wiretapper.ratelimit")
+
+Network = ipaddress.IPv4Network | ipaddress.IPv6Network
 
 
-@dataclass
 class _Bucket:
-    capacity: int
-    refill_per_s: float
-    tokens: float
-    updated_at: float
-
-    def allow(self, cost: float = 1.0) -> bool:
-        now = time.monotonic()
-        elapsed = max(0.0, now - self.updated_at)
-        self.updated_at = now
-        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_s)
-        if self.tokens >= cost:
-            self.tokens -= cost
+    __slots__ = ("capacity", "tokens", "updated_at")
+
+    def __init__(self, capacity: int, updated_at: float) -> None:
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = updated_at
+
+
+class RateLimiter:
+    """Token buckets (capacity=per_minute, refilled continuously) keyed by client.
+
+    Buckets are kept in least-recently-used order. A bucket left alone for a full
+    refill period is indistinguishable from a new one, so it is dropped; when more
+    than `max_keys` buckets are live, the least recently used one is evicted.
+    """
+
+    def __init__(self, *, max_keys: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_keys = max(1, max_keys)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+        self._key_bytes = 0
+        self._allowed = 0
+        self._limited = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def _bucket(self, key: str, per_minute: int, now: float) -> _Bucket:
+        # Caller holds the lock. Returns the refilled bucket, created if needed.
+        self._expire_idle(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._evict_oldest()
+            bucket = self._buckets[key] = _Bucket(per_minute, now)
+            self._key_bytes += sys.getsizeof(key)
+        elif bucket.capacity != per_minute:
+            bucket = self._buckets[key] = _Bucket(per_minute, now)
+            self._buckets.move_to_end(key)
+        else:
+            self._buckets.move_to_end(key)
+            elapsed = max(0.0, now - bucket.updated_at)
+            bucket.tokens = min(bucket.capacity, bucket.tokens + elapsed * per_minute / 60.0)
+            bucket.updated_at = now
+        return bucket
+
+    def allow(self, key: str, *, per_minute: int, cost: float = 1.0) -> bool:
+        now = self._clock()
+        with self._lock:
+            bucket = self._bucket(key, per_minute, now)
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                self._allowed += 1
+                return True
+            self._limited += 1
+            return False
+
+    def charge(self, key: str, *, per_minute: int, cost: float) -> None:
+        """Take `cost` tokens after the fact, going into debt of at most one bucket."""
+        now = self._clock()
+        with self._lock:
+            bucket = self._bucket(key, per_minute, now)
+            bucket.tokens = max(-float(per_minute), bucket.tokens - cost)
+
+    def _expire_idle(self, now: float) -> None:
+        # The oldest buckets sit at the front; a couple of them are checked per call
+        # so expiry stays O(1) and keeps up with the insertion rate.
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket.updated_at < 60.0:
+                return
+            del self._buckets[key]
+            self._key_bytes -= sys.getsizeof(key)
+            self._expired += 1
+
+    def _evict_oldest(self) -> None:
+        key, _ = self._buckets.popitem(last=False)
+        self._key_bytes -= sys.getsizeof(key)
+        self._evicted += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._key_bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            buckets = len(self._buckets)
+            approx_bytes = (
+                sys.getsizeof(self._buckets)
+                + self._key_bytes
+                # one slotted object plus its `tokens` and `updated_at` floats
+                + buckets * (_BUCKET_BYTES + 2 * sys.getsizeof(0.0))
+            )
+            return {
+                "buckets": buckets,
+                "max_buckets": self.max_keys,
+                "approx_bytes": approx_bytes,
+                "allowed": self._allowed,
+                "limited": self._limited,
+                "expired": self._expired,
+                "evicted": self._evicted,
+            }
+
+
+_BUCKET_BYTES = sys.getsizeof(_Bucket(1, 0.0))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratelimit_buckets (
+    key TEXT PRIMARY KEY,
+    capacity INTEGER NOT NULL,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ratelimit_buckets_updated_at ON ratelimit_buckets (updated_at);
+"""
+
+
+class SQLiteRateLimiter:
+    """`RateLimiter` over a SQLite file shared by every worker process on one host.
+
+    Each `allow` is one short write transaction. Times are wall-clock so all
+    processes refill alike. Idle and surplus buckets are dropped every
+    `_PRUNE_EVERY` calls rather than on each one; counters are per process.
+    When the file stays locked past the busy timeout or fails, requests are
+    let through (counted as `failed_open`) rather than answered with an error.
+    """
+
+    _PRUNE_EVERY = 256
+
+    def __init__(self, path: str, *, max_keys: int, clock: Callable[[], float] = time.time) -> None:
+        self.path = path
+        self.max_keys = max(1, max_keys)
+        self._clock = clock
+        self._db = sqlitedb.Connections(path, schema=_SCHEMA, busy_timeout_s=0.25)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._failed_open = 0
+        self._allowed = 0
+        self._limited = 0
+        self._expired = 0
+        self._evicted = 0
+
+    def _take(self, key: str, per_minute: int, cost: float, *, force: bool) -> bool:
+        now = self._clock()
+        with self._db.transaction() as conn:
+            row = conn.execute(
+                "SELECT capacity, tokens, updated_at FROM ratelimit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] != per_minute:
+                tokens = float(per_minute)
+            else:
+                elapsed = max(0.0, now - row[2])
+                tokens = min(per_minute, row[1] + elapsed * per_minute / 60.0)
+            allowed = tokens >= cost
+            if allowed or force:
+                tokens = max(-float(per_minute), tokens - cost)
+            conn.execute(
+                "INSERT OR REPLACE INTO ratelimit_buckets (key, capacity, tokens, updated_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, per_minute, tokens, now),
+            )
+        return allowed
+
+    def allow(self, key: str, *, per_minute: int, cost: float = 1.0) -> bool:
+        try:
+            allowed = self._take(key, per_minute, cost, force=False)
+        except sqlite3.Error:
+            _LOG.warning("rate limit check failed; allowing the request", exc_info=True)
+            with self._lock:
+                self._failed_open += 1
             return True
+        now = self._clock()
+        with self._lock:
+            self._calls += 1
+            prune = self._calls % self._PRUNE_EVERY == 0
+            if allowed:
+                self._allowed += 1
+            else:
+                self._limited += 1
+        if prune:
+            try:
+                self._prune(now)
+            except sqlite3.Error:
+                # Pruning is retried on the next round; the request was already decided.
+                _LOG.warning("rate limit pruning failed", exc_info=True)
+        return allowed
+
+    def charge(self, key: str, *, per_minute: int, cost: float) -> None:
+        """Take `cost` tokens after the fact, going into debt of at most one bucket."""
+        try:
+            self._take(key, per_minute, cost, force=True)
+        except sqlite3.Error:
+            _LOG.warning("rate limit charge failed; skipping it", exc_info=True)
+            with self._lock:
+                self._failed_open += 1
+
+    def _prune(self, now: float) -> None:
+        with self._db.transaction() as conn:
+            expired = conn.execute(
+                "DELETE FROM ratelimit_buckets WHERE updated_at <= ?", (now - 60.0,)
+            ).rowcount
+            (count,) = conn.execute("SELECT COUNT(*) FROM ratelimit_buckets").fetchone()
+            evicted = 0
+            if count > self.max_keys:
+                evicted = conn.execute(
+                    "DELETE FROM ratelimit_buckets WHERE key IN (SELECT key FROM"
+                    " ratelimit_buckets ORDER BY updated_at LIMIT ?)",
+                    (count - self.max_keys,),
+                ).rowcount
+        with self._lock:
+            self._expired += expired
+            self._evicted += evicted
+
+    def clear(self) -> None:
+        with self._db.transaction() as conn:
+            conn.execute("DELETE FROM ratelimit_buckets")
+
+    def stats(self) -> dict[str, Any]:
+        conn = self._db.get()
+        (buckets,) = conn.execute("SELECT COUNT(*) FROM ratelimit_buckets").fetchone()
+        (pages,) = conn.execute("PRAGMA page_count").fetchone()
+        (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+        with self._lock:
+            return {
+                "buckets": buckets,
+                "max_buckets": self.max_keys,
+                "approx_bytes": pages * page_size,
+                "allowed": self._allowed,
+                "limited": self._limited,
+                "expired": self._expired,
+                "evicted": self._evicted,
+                "failed_open": self._failed_open,
+            }
+
+
+def default_sqlite_path() -> str:
+    return os.path.join(tempfile.gettempdir(), "wiretapper-ratelimit.sqlite3")
+
+
+_LIMITER: RateLimiter | SQLiteRateLimiter = RateLimiter(max_keys=100_000)
+_TRUSTED: tuple[Network, ...] = ()
+
+
+def configure(
+    *,
+    max_keys: int,
+    trusted_proxies: Iterable[str] = (),
+    backend: str = "memory",
+    path: str | None = None,
+) -> None:
+    """Select and size the limiter and set the proxies whose `X-Forwarded-For` is
+    believed.
+
+    `backend` is `memory` (per process, the default) or `sqlite` (a file at `path`
+    shared by every worker on the host, so a client gets one budget across them).
+    Raises `ValueError` for an unknown backend, or a malformed address or network
+    in `trusted_proxies`.
+    """
+    global _LIMITER, _TRUSTED
+    _TRUSTED = tuple(ipaddress.ip_network(p.strip(), strict=False) for p in trusted_proxies)
+    if backend == "memory":
+        if not isinstance(_LIMITER, RateLimiter) or _LIMITER.max_keys != max_keys:
+            _LIMITER = RateLimiter(max_keys=max_keys)
+    elif backend == "sqlite":
+        path = path or default_sqlite_path()
+        if not isinstance(_LIMITER, SQLiteRateLimiter) or _LIMITER.path != path:
+            _LIMITER = SQLiteRateLimiter(path, max_keys=max_keys)
+        _LIMITER.max_keys = max(1, max_keys)
+    else:
+        raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
         return False
+    return any(ip in network for network in _TRUSTED)
+
+
+def client_address(remote_addr: str | None, forwarded_for: str | None) -> str:
+    """Resolve the client address behind the configured trusted proxies.
+
+    `X-Forwarded-For` is only read when the peer is a trusted proxy; it is walked
+    right to left, skipping trusted hops, and the first other address wins.
+    """
+    client = remote_addr or "unknown"
+    if not forwarded_for or not _is_trusted(client):
+        return client
+    for hop in reversed(forwarded_for.split(",")):
+        hop = hop.strip()
+        try:
+            ipaddress.ip_address(hop)
+        except ValueError:
+            break
+        client = hop
+        if not _is_trusted(hop):
+            break
+    return client
+
+
+def allow(key: str, *, per_minute: int, cost: float = 1.0) -> bool:
+    if _LIMITER.allow(key, per_minute=per_minute, cost=cost):
+        return True
+    # Keys are `<bucket>:<client>`; only the bucket is a metric label.
+    metrics.inc(metrics.RATELIMIT_REJECTED, key.partition(":")[0])
+    return False
+
+
+def charge(key: str, *, per_minute: int, cost: float) -> None:
+    """Charge work found to be costly only once done; later requests pay it off."""
+    if cost > 0:
+        _LIMITER.charge(key, per_minute=per_minute, cost=cost)
 
 
-_BUCKETS: dict[str, _Bucket] = {}
+def clear() -> None:
+    _LIMITER.clear()
 
 
-def allow(key: str, *, per_minute: int) -> bool:
-    # Token bucket: capacity=per_minute, refill continuously.
-    bucket = _BUCKETS.get(key)
-    if bucket is None or bucket.capacity != per_minute:
-        bucket = _Bucket(
-            capacity=per_minute,
-            refill_per_s=per_minute / 60.0,
-            tokens=float(per_minute),
-            updated_at=time.monotonic(),
-        )
-        _BUCKETS[key] = bucket
-    return bucket.allow(1.0)
+def stats() -> dict[str, Any]:
+    return {"backend": type(_LIMITER).__name__, **_LIMITER.stats()}
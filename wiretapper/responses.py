@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+from collections.abc import Callable
+from typing import Any
+
+from flask import Request, Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None  # type: ignore[assignment]
+
+# Response layer for the API: faster JSON when orjson is installed, a strong ETag
+# over the serialized body (so an unchanged cached area answers 304), and gzip or
+# brotli for large bodies. `/nearby` bodies carry per-request timings, so that
+# route tags only what identifies its answer (see `streaming.stable_view`).
+
+_COMPRESSIBLE = ("application/json", "application/geo+json", "text/")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; falls back to Flask's hook for other types."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+
+def json_provider_class() -> type[DefaultJSONProvider]:
+    return OrjsonProvider if orjson is not None else DefaultJSONProvider
+
+
+def _pick_encoding(request: Request) -> str | None:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def etag(stable: Any, dumps: Callable[..., str]) -> str:
+    """A strong tag over `stable`, the part of a body that identifies it, for
+    bodies that also carry per-request values. Computed before rendering, so a
+    match is answered without serializing the body at all."""
+    return _digest(dumps(stable, sort_keys=True).encode())
+
+
+def matches(request: Request, tag: str) -> bool:
+    # Every encoding of the same body shares the tag's prefix.
+    wanted = request.if_none_match
+    return wanted.star_tag or any(etag.split("-")[0] == tag for etag in wanted.as_set())
+
+
+def _revalidate(response: Response) -> None:
+    response.vary.add("Accept-Encoding")
+    if "Cache-Control" not in response.headers:
+        # Let browsers keep the body but revalidate it with If-None-Match every time.
+        response.headers["Cache-Control"] = "no-cache"
+
+
+def not_modified(tag: str) -> Response:
+    response = Response(status=304)
+    _revalidate(response)
+    response.set_etag(tag)
+    return response
+
+
+def finalize(response: Response, request: Request, *, compress_min_bytes: int) -> Response:
+    """Add a strong ETag (answering 304 on a match) and compress large bodies.
+
+    The tag hashes the body unless the route already set one from `etag`.
+    """
+    if (
+        request.method not in {"GET", "HEAD"}
+        or response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype or "").startswith(_COMPRESSIBLE)
+    ):
+        return response
+
+    body = response.get_data()
+    tag = response.get_etag()[0] or _digest(body)
+    _revalidate(response)
+    if matches(request, tag):
+        response.status_code = 304
+        response.set_data(b"")
+        response.headers.pop("Content-Length", None)
+        response.set_etag(tag)
+        return response
+
+    encoding = _pick_encoding(request) if len(body) >= compress_min_bytes else None
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=5))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(body, compresslevel=6))
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{tag}-{encoding}")
+    else:
+        response.set_etag(tag)
+    return response
@@ -1,17 +1,51 @@
 from __future__ import annotations
 
-import random
+import logging
+import math
+import time
+from collections.abc import Callable, Iterable, Iterator
 from typing import Any
 
-from flask import Blueprint, current_app, jsonify, render_template, request
-
-from . import cache, ratelimit
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
+
+from . import (
+    cache,
+    clusters,
+    fanout,
+    geocache,
+    lookups,
+    maptiles,
+    metrics,
+    prefetch,
+    profiling,
+    ratelimit,
+    singleflight,
+    store,
+    streaming,
+    tiles,
+    timing,
+    towerdb,
+)
+from . import nearby as nearby_request  # the route below is named `nearby`
+from .classify import classify_device  # noqa: F401  (re-exported)
 from .config import Settings
-from .data import DUMMY_DATA
-from .errors import UpstreamError
-from .services import opencellid, shodan, wigle
+from .data import DUMMY_DATA, dummy_nearby_devices
+from .errors import CircuitOpenError, QuotaExceededError, UpstreamError
+from .services import breaker, http, replay, shodan, timeouts, wigle
 
 bp = Blueprint("wiretapper", __name__)
+_LOG = logging.getLogger("wiretapper.routes")
+
+# Tile requests are charged against `rate_limit_rpm` times this many tiles.
+_TILES_PER_VIEW = 20
 
 
 def _settings() -> Settings:
@@ -22,137 +56,26 @@ def _settings() -> Settings:
 
 
 def _client_key() -> str:
-    forwarded = (request.headers.get("X-Forwarded-For") or "").split(",")[0].strip()
-    return forwarded or request.remote_addr or "unknown"
+    return ratelimit.client_address(request.remote_addr, request.headers.get("X-Forwarded-For"))
 
 
 def _enforce_rate_limit(bucket: str, *, per_minute: int) -> None:
     key = f"{bucket}:{_client_key()}"
-    if not ratelimit.allow(key, per_minute=per_minute):
+    with timing.span("ratelimit"):
+        allowed = ratelimit.allow(key, per_minute=per_minute)
+    if not allowed:
         raise PermissionError("Rate limit exceeded. Please slow down.")
 
 
-def classify_device(name: str | None, original_type: str) -> str:
-    if not name:
-        return original_type
-    name_upper = name.upper()
-    if any(
-        k in name_upper
-        for k in [
-            "CAR",
-            "FORD",
-            "TOYOTA",
-            "BMW",
-            "TESLA",
-            "SYNC",
-            "MAZDA",
-            "HONDA",
-            "UCONNECT",
-            "HYUNDAI",
-            "LEXUS",
-            "NISSAN",
-        ]
-    ):
-        return "car"
-    if any(
-        k in name_upper
-        for k in ["TV", "BRAVIA", "VIZIO", "SAMSUNG", "LG", "ROKU", "FIRE", "SMARTVIEW", "KDL-"]
-    ):
-        return "tv"
-    if any(
-        k in name_upper
-        for k in [
-            "HEADPHONE",
-            "EARBUD",
-            "BOSE",
-            "SONY",
-            "BEATS",
-            "AUDIO",
-            "AIRPOD",
-            "JBL",
-            "SENNHEISER",
-        ]
-    ):
-        return "headphone"
-    if any(
-        k in name_upper for k in ["DASHCAM", "DASH CAM", "DVR", "70MAI", "VIOFO", "GARMIN DASH"]
-    ):
-        return "dashcam"
-    if any(
-        k in name_upper
-        for k in [
-            "CAM",
-            "SURVEILLANCE",
-            "SECURITY",
-            "NEST",
-            "RING",
-            "ARLO",
-            "HIKVISION",
-            "DAHUA",
-            "REOLINK",
-        ]
-    ):
-        return "camera"
-    if any(k in name_upper for k in ["WATCH", "FITBIT", "GARMIN", "WHOOP"]):
-        return "iot"
-    return original_type
-
-
-def _dummy_devices_for_nearby(*, lat: float, lon: float, mode: str) -> list[dict[str, Any]]:
-    if mode == "bluetooth":
-        return [
-            {
-                "lat": lat + random.uniform(-0.002, 0.002),
-                "lon": lon + random.uniform(-0.002, 0.002),
-                "ssid": "Tesla Model 3",
-                "type": "car",
-                "vendor": "Tesla Motors",
-            },
-            {
-                "lat": lat + random.uniform(-0.002, 0.002),
-                "lon": lon + random.uniform(-0.002, 0.002),
-                "ssid": "Sony WH-1000XM4",
-                "type": "headphone",
-                "vendor": "Sony Corp.",
-            },
-            {
-                "lat": lat + random.uniform(-0.002, 0.002),
-                "lon": lon + random.uniform(-0.002, 0.002),
-                "ssid": "Samsung QLED 75",
-                "type": "tv",
-                "vendor": "Samsung Electronics",
-            },
-            {
-                "lat": lat + random.uniform(-0.002, 0.002),
-                "lon": lon + random.uniform(-0.002, 0.002),
-                "ssid": "Hidden_BT_Tracker",
-                "type": "bluetooth",
-                "vendor": "Unknown",
-            },
-        ]
-    return [
-        {
-            "lat": lat + random.uniform(-0.001, 0.001),
-            "lon": lon + random.uniform(-0.001, 0.001),
-            "ssid": "CYBER_SURVEILLANCE_ROUTER",
-            "type": "router",
-            "vendor": "Cisco Systems",
-        },
-        {
-            "lat": lat + random.uniform(-0.001, 0.001),
-            "lon": lon + random.uniform(-0.001, 0.001),
-            "ssid": "DASHCAM_V3",
-            "type": "camera",
-            "vendor": "Nextbase",
-        },
-        {
-            "lat": lat + random.uniform(-0.001, 0.001),
-            "lon": lon + random.uniform(-0.001, 0.001),
-            "ssid": "5G_TOWER_B4",
-            "type": "cell_tower",
-            "vendor": "Ericsson",
-        },
-    ]
+def _upstream_error(exc: UpstreamError):
+    # A spent or busy provider quota, or an open circuit, is the client's cue to
+    # retry later, not a 502.
+    if isinstance(exc, (QuotaExceededError, CircuitOpenError)):
+        response = jsonify({"error": str(exc)})
+        if exc.retry_after_s is not None:
+            response.headers["Retry-After"] = str(math.ceil(exc.retry_after_s))
+        return response, exc.status_code
+    return jsonify({"error": str(exc)}), 502
 
 
 @bp.get("/map-w")
@@ -160,6 +83,47 @@ def wifi_map():
     return render_template("wifi-search.html")
 
 
+def _collected() -> Iterator[metrics.Sample]:
+    for namespace, counters in cache.stats()["namespaces"].items():
+        yield metrics.CACHE_LOOKUPS, (namespace, "hit"), counters["hits"]
+        yield metrics.CACHE_LOOKUPS, (namespace, "stale"), counters["stale_hits"]
+        yield metrics.CACHE_LOOKUPS, (namespace, "miss"), counters["misses"]
+        yield metrics.CACHE_EVICTIONS, (namespace,), counters["evictions"]
+        yield metrics.CACHE_BYTES, (namespace,), counters["bytes"]
+    for provider, quota in http.quota_stats().items():
+        yield metrics.UPSTREAM_IN_FLIGHT, (provider,), quota["in_flight"]
+        yield metrics.UPSTREAM_QUEUED, (provider,), quota["queued"]
+    yield metrics.RATELIMIT_BUCKETS, (), ratelimit.stats()["buckets"]
+    warmed = prefetch.stats()
+    yield metrics.PREFETCH_CELLS, ("warmed",), warmed["cells_warmed"]
+    yield metrics.PREFETCH_CELLS, ("hit",), warmed["hits"]
+    yield metrics.PREFETCH_CELLS, ("dropped",), warmed["dropped"]
+
+
+@bp.get("/metrics")
+def metrics_text():
+    return Response(
+        metrics.render(_collected()), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@bp.post("/api/profile")
+def api_profile():
+    """Sample every thread's stack for `?seconds=` (default 10) into the profile dir."""
+    settings = _settings()
+    if not settings.profile_dir or not settings.profile_token:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    presented = request.headers.get("X-Wiretapper-Profile")
+    if not profiling.authorized(settings.profile_dir, settings.profile_token, presented):
+        return jsonify({"error": "Invalid profiling token"}), 403
+    seconds = request.args.get("seconds", default=10.0, type=float)
+    try:
+        path = profiling.start_window(settings.profile_dir, seconds)
+    except RuntimeError as exc:
+        return jsonify({"error": str(exc)}), 409
+    return jsonify({"path": str(path)}), 202
+
+
 @bp.get("/api/status")
 def api_status():
     settings = _settings()
@@ -171,167 +135,337 @@ def api_status():
                 "shodan": bool(settings.shodan_api_key),
             },
             "limits": {"rate_limit_rpm": settings.rate_limit_rpm},
+            "ratelimit": ratelimit.stats(),
+            "quotas": http.quota_stats(),
+            "circuits": breaker.stats(),
+            "endpoints": timeouts.stats(),
+            "replay": replay.stats(),
+            "prefetch": prefetch.stats(),
+            "towerdb": towerdb.stats(),
             "cache_ttl_s": {
                 "nearby": settings.cache_ttl_nearby_s,
                 "search": settings.cache_ttl_search_s,
                 "towers": settings.cache_ttl_towers_s,
             },
+            "cache_hard_ttl_s": {
+                "nearby": settings.cache_hard_ttl_nearby_s,
+                "search": settings.cache_hard_ttl_search_s,
+                "towers": settings.cache_hard_ttl_towers_s,
+            },
             "cache": cache.stats(),
+            "geocache": geocache.stats(),
+            "singleflight": singleflight.stats(),
+            "store": store.stats(),
         }
     )
 
 
+def _stream_format() -> str | None:
+    """`"ndjson"` or `"sse"` when the client opted into streaming, else None."""
+    return streaming.negotiate(request.args.get("stream"), request.headers.get("Accept", ""))
+
+
+def _stream(records: Iterator[dict[str, Any]], fmt: str) -> Response:
+    # One JSON record per line (NDJSON) or per event (SSE): `{"provider", "devices"}`
+    # records as providers answer, then a final `{"meta"}` or `{"error"}` record.
+    def _encode() -> Iterator[str]:
+        try:
+            for record in records:
+                yield streaming.encode(record, fmt, current_app.json.dumps)
+        except UpstreamError as exc:
+            yield streaming.encode({"error": str(exc)}, fmt, current_app.json.dumps)
+        except Exception:
+            # The status line is gone: end the stream with an error record.
+            _LOG.exception("streamed response failed")
+            yield streaming.encode({"error": "Internal error"}, fmt, current_app.json.dumps)
+
+    response = Response(
+        stream_with_context(_encode()),
+        mimetype="text/event-stream" if fmt == "sse" else "application/x-ndjson",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _nearby_records(
+    settings: Settings, *, lat: float, lon: float, mode: str, started: float
+) -> Iterator[dict[str, Any]]:
+    tasks = lookups.nearby_tasks(settings, lat=lat, lon=lon, mode=mode)
+    out = streaming.NearbyRecords()
+    for name, result in fanout.iter_results(
+        tasks,
+        deadline_at=started + settings.request_deadline_s,
+        provider_timeout_s=settings.provider_deadline_s,
+    ):
+        yield from out.add(name, result)
+    yield from out.finish(tasks, lambda: dummy_nearby_devices(lat=lat, lon=lon, mode=mode))
+
+
 @bp.get("/nearby")
 def nearby():
     settings = _settings()
+    started = time.monotonic()
+    query = nearby_request.start(settings, request, dumps=current_app.json.dumps)
+    if isinstance(query, Response):
+        return query
+    records = _nearby_records(
+        settings, lat=query.lat, lon=query.lon, mode=query.mode, started=started
+    )
+    if query.fmt:
+        return _stream(records, query.fmt)
+    return nearby_request.finish(query, request, list(records), dumps=current_app.json.dumps)
 
-    lat = request.args.get("lat", type=float)
-    lon = request.args.get("lon", type=float)
-    mode = request.args.get("mode", "wifi")
 
-    if not lat or not lon:
-        return jsonify({"error": "Missing coordinates"}), 400
+_BATCH_MODES = ("wifi", "bluetooth")
 
-    devices: list[dict[str, Any]] = []
-    meta: dict[str, Any] = {"cached": False}
 
+def _batch_points(body: Any, *, max_points: int) -> list[tuple[float, float, str]]:
+    """Validate a batch body into `(lat, lon, mode)` queries. Raises `ValueError`."""
+    if not isinstance(body, dict) or not isinstance(body.get("points"), list):
+        raise ValueError("Body must be a JSON object with a points list")
+    modes = body.get("modes", ["wifi"])
+    if not isinstance(modes, list) or not modes or any(m not in _BATCH_MODES for m in modes):
+        raise ValueError(f"modes must be a list of {', '.join(_BATCH_MODES)}")
+    points = body["points"]
+    if len(points) * len(modes) > max_points:
+        raise ValueError(f"At most {max_points} point/mode queries per batch")
+
+    queries: list[tuple[float, float, str]] = []
+    for point in points:
+        try:
+            if isinstance(point, dict):
+                lat, lon = float(point["lat"]), float(point["lon"])
+            else:
+                lat, lon = map(float, point)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each point must be [lat, lon] or {lat, lon}") from None
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            raise ValueError("Point out of range")
+        queries.extend((lat, lon, mode) for mode in modes)
+    return queries
+
+
+def _background(task: fanout.Task, *, deadline_at: float) -> fanout.Task:
+    # Batches queue behind interactive requests for provider quota, and keep
+    # queueing until the batch deadline rather than the usual short wait. They
+    # wait on the batch executor, never on a worker of the shared fan-out pool.
+    def _run() -> tuple[Any, str]:
+        with http.priority(http.PRIORITY_BACKGROUND):
+            while True:
+                try:
+                    return task()
+                except QuotaExceededError as exc:
+                    wait_s = exc.retry_after_s or 0.0
+                    if time.monotonic() + wait_s >= deadline_at:
+                        raise
+                    time.sleep(wait_s)
+
+    return _run
+
+
+def _batch_lookups(
+    settings: Settings, queries: list[tuple[float, float, str]], *, deadline_at: float
+) -> tuple[list[list[int]], list[list[str]], dict[str, fanout.Task]]:
+    """Group `queries` into lookups: `(query indexes, provider names, tasks)`.
+
+    Queries in the same cache tile are answered by one lookup at the tile center.
+    """
+    zoom = settings.geo_tile_zoom
+    groups: dict[tuple[str, int, int], list[int]] = {}
+    for index, (lat, lon, mode) in enumerate(queries):
+        groups.setdefault((mode, *tiles.lonlat_to_tile(lon, lat, zoom)), []).append(index)
+
+    tasks: dict[str, fanout.Task] = {}
+    providers: list[list[str]] = []
+    for group, (mode, x, y) in enumerate(groups):
+        lat, lon = tiles.tile_center(zoom, x, y)
+        names = list(lookups.nearby_tasks(settings, lat=lat, lon=lon, mode=mode).items())
+        providers.append([name for name, _ in names])
+        for name, task in names:
+            tasks[f"{group}:{name}"] = _background(task, deadline_at=deadline_at)
+    return list(groups.values()), providers, tasks
+
+
+def _batch_records(
+    queries: list[tuple[float, float, str]],
+    members: list[list[int]],
+    providers: list[list[str]],
+    tasks: dict[str, fanout.Task],
+    *,
+    deadline_at: float,
+    charge: Callable[[int], None],
+) -> Iterator[dict[str, Any]]:
+    # Every unique lookup runs in one fan-out; `charge` gets the upstream calls made.
+    results: list[dict[str, fanout.ProviderResult]] = [{} for _ in members]
+    upstream_calls = 0
+    for group, names in enumerate(providers):
+        if not names:
+            yield from _batch_group(queries, members[group], names, results[group])
+    for key, result in fanout.iter_results(
+        tasks,
+        deadline_at=deadline_at,
+        provider_timeout_s=deadline_at - time.monotonic(),
+        pool=fanout.batch_executor(),
+    ):
+        group_str, name = key.split(":", 1)
+        group = int(group_str)
+        results[group][name] = result
+        if result.sent:
+            upstream_calls += 1
+        if len(results[group]) == len(providers[group]):
+            yield from _batch_group(queries, members[group], providers[group], results[group])
+    charge(upstream_calls)
+    yield {
+        "meta": {
+            "queries": len(queries),
+            "lookups": len(members),
+            "upstream_calls": upstream_calls,
+        }
+    }
+
+
+def _batch_group(
+    queries: list[tuple[float, float, str]],
+    indexes: list[int],
+    names: list[str],
+    results: dict[str, fanout.ProviderResult],
+) -> Iterator[dict[str, Any]]:
+    devices = [d for name in names if results[name].status == "ok" for d in results[name].value]
+    meta: dict[str, Any] = {"cached": False, "freshness": cache.FRESH, "providers": {}}
+    for name in names:
+        result = results[name]
+        meta["providers"][name] = result.meta()
+        if result.status == "ok":
+            meta["cached"] = meta["cached"] or result.cached
+            meta["freshness"] = streaming.worst_freshness(meta["freshness"], result.freshness)
+        if "truncated" in meta["providers"][name]:
+            meta["truncated"] = True
+    for index in indexes:
+        lat, lon, mode = queries[index]
+        yield {
+            "index": index,
+            "lat": lat,
+            "lon": lon,
+            "mode": mode,
+            "devices": devices,
+            "meta": meta,
+        }
+
+
+@bp.post("/api/batch/nearby")
+def batch_nearby():
+    settings = _settings()
+    started = time.monotonic()
+
+    try:
+        queries = _batch_points(request.get_json(silent=True), max_points=settings.batch_max_points)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    deadline_at = started + settings.batch_deadline_s
+    members, providers, tasks = _batch_lookups(settings, queries, deadline_at=deadline_at)
+    # Admitted for one token; once the lookups ran, every upstream call past the
+    # first is charged too, so cached tiles are free and a costly batch leaves the
+    # client in debt (at most one bucket) that its next requests wait out.
+    key = f"batch:{_client_key()}"
+    per_minute = settings.rate_limit_rpm
+    if not ratelimit.allow(key, per_minute=per_minute):
+        return jsonify({"error": "Rate limit exceeded. Please slow down."}), 429
+
+    def _charge(upstream_calls: int) -> None:
+        ratelimit.charge(key, per_minute=per_minute, cost=upstream_calls - 1)
+
+    records = _batch_records(
+        queries, members, providers, tasks, deadline_at=deadline_at, charge=_charge
+    )
+    return _stream(records, _stream_format() or "ndjson")
+
+
+@bp.get("/api/clusters")
+def api_clusters():
+    settings = _settings()
+
+    zoom = request.args.get("zoom", type=int)
+    mode = request.args.get("mode", "wifi")
     try:
-        _enforce_rate_limit("nearby", per_minute=settings.rate_limit_rpm)
+        min_lat, min_lon, max_lat, max_lon = map(float, request.args.get("bbox", "").split(","))
+    except ValueError:
+        return jsonify({"error": "bbox must be min_lat,min_lon,max_lat,max_lon"}), 400
+    if zoom is None or not (0 <= zoom <= clusters.MAX_ZOOM):
+        return jsonify({"error": "Missing or invalid zoom"}), 400
+    if min_lat > max_lat or min_lon > max_lon:
+        return jsonify({"error": "bbox must be min_lat,min_lon,max_lat,max_lon"}), 400
+
+    try:
+        _enforce_rate_limit("clusters", per_minute=settings.rate_limit_rpm)
     except PermissionError as e:
         return jsonify({"error": str(e)}), 429
 
-    if mode == "bluetooth":
-        if settings.wigle_api_name and settings.wigle_api_token:
-            cache_key = f"wigle:bt:{lat:.4f}:{lon:.4f}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = wigle.bluetooth_search(
-                        api_name=settings.wigle_api_name,
-                        api_token=settings.wigle_api_token,
-                        lat=lat,
-                        lon=lon,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_nearby_s)
-            else:
-                meta["cached"] = True
-
-            for device in cached:
-                name = device.get("name") or device.get("netid")
-                classified_type = classify_device(str(name) if name else None, "bluetooth")
-                devices.append(
-                    {
-                        "lat": device.get("trilat"),
-                        "lon": device.get("trilong"),
-                        "ssid": name,
-                        "bssid": device.get("netid"),
-                        "vendor": device.get("type")
-                        or (
-                            "Bluetooth Node"
-                            if classified_type == "bluetooth"
-                            else classified_type.replace("_", " ").title()
-                        ),
-                        "signal": device.get("level"),
-                        "timestamp": device.get("lastupdt"),
-                        "type": classified_type,
-                    }
-                )
-    else:
-        if settings.wigle_api_name and settings.wigle_api_token:
-            cache_key = f"wigle:wifi:{lat:.4f}:{lon:.4f}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = wigle.network_search(
-                        api_name=settings.wigle_api_name,
-                        api_token=settings.wigle_api_token,
-                        lat=lat,
-                        lon=lon,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_nearby_s)
-            else:
-                meta["cached"] = True
-
-            for network in cached:
-                name = network.get("ssid")
-                classified_type = classify_device(str(name) if name else None, "router")
-                devices.append(
-                    {
-                        "lat": network.get("trilat"),
-                        "lon": network.get("trilong"),
-                        "ssid": name,
-                        "bssid": network.get("netid"),
-                        "vendor": network.get("vendor"),
-                        "signal": network.get("level"),
-                        "timestamp": network.get("lastupdt"),
-                        "type": classified_type,
-                    }
-                )
+    devices, complete = lookups.local_devices(
+        settings,
+        (min_lat, min_lon, max_lat, max_lon),
+        mode=mode,
+        max_tiles=settings.cluster_max_tiles,
+    )
+    body: dict[str, Any] = {
+        "zoom": zoom,
+        "clusters": clusters.aggregate(devices, zoom=zoom),
+        "meta": {"devices": len(devices), "complete": complete},
+    }
+    if zoom >= settings.cluster_points_zoom:
+        body["points"] = devices
+    return jsonify(body)
+
+
+@bp.get("/tiles/<layer>.json")
+def tilejson(layer: str):
+    settings = _settings()
+    if layer not in maptiles.LAYERS:
+        return jsonify({"error": f"Unknown tile layer: {layer}"}), 404
+    response = jsonify(
+        {
+            "tilejson": "3.0.0",
+            "name": layer,
+            "tiles": [f"/tiles/{layer}/{{z}}/{{x}}/{{y}}.geojson?v={maptiles.epoch(settings)}"],
+            "minzoom": settings.tile_min_zoom,
+            "maxzoom": maptiles.MAX_ZOOM,
+            "expires_in": round(maptiles.epoch_expires_in(settings), 1),
+        }
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
-        if settings.opencellid_api_key:
-            cache_key = f"unwired:{lat:.4f}:{lon:.4f}"
-            data = cache.get(cache_key)
-            if data is None:
-                try:
-                    data = opencellid.unwiredlabs_process(
-                        token=settings.opencellid_api_key, lat=lat, lon=lon
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, data, ttl_s=settings.cache_ttl_nearby_s)
-            else:
-                meta["cached"] = True
-            if data and data.get("status") == "ok":
-                for cell in data.get("cells", []) or []:
-                    devices.append(
-                        {
-                            "lat": cell.get("lat"),
-                            "lon": cell.get("lon"),
-                            "cell_id": str(cell.get("cellid")),
-                            "signal": cell.get("signal"),
-                            "accuracy": cell.get("accuracy"),
-                            "timestamp": cell.get("updated"),
-                            "type": "cell_tower",
-                        }
-                    )
 
-        if settings.shodan_api_key:
-            cache_key = f"shodan:geo:{lat:.4f}:{lon:.4f}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = shodan.host_search(
-                        api_key=settings.shodan_api_key,
-                        query=f"geo:{lat},{lon},1",
-                        limit=5,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_nearby_s)
-            else:
-                meta["cached"] = True
-
-            for banner in cached:
-                info = banner.get("data", "")
-                location = banner.get("location", {}) or {}
-                devices.append(
-                    {
-                        "lat": location.get("latitude"),
-                        "lon": location.get("longitude"),
-                        "ip": banner.get("ip_str"),
-                        "info": str(info)[:50],
-                        "type": classify_device(str(info) if info else None, "iot_device"),
-                    }
-                )
+@bp.get("/tiles/<layer>/<int:z>/<int:x>/<int:y>.geojson")
+def tile(layer: str, z: int, x: int, y: int):
+    settings = _settings()
+    if layer not in maptiles.LAYERS:
+        return jsonify({"error": f"Unknown tile layer: {layer}"}), 404
+    if not (settings.tile_min_zoom <= z <= maptiles.MAX_ZOOM) or not (
+        0 <= x < (1 << z) and 0 <= y < (1 << z)
+    ):
+        return jsonify({"error": "Tile out of range"}), 400
 
-    if not devices:
-        devices = _dummy_devices_for_nearby(lat=lat, lon=lon, mode=mode)
+    try:
+        # A viewport loads a screenful of tiles at once.
+        _enforce_rate_limit("tiles", per_minute=settings.rate_limit_rpm * _TILES_PER_VIEW)
+    except PermissionError as e:
+        # The map retries the tile after this; a token comes back well within it.
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "1"}
 
-    return jsonify({"devices": devices, "meta": meta})
+    try:
+        body = maptiles.tile_bytes(settings, layer, z, x, y, dumps=current_app.json.dumps)
+    except UpstreamError as e:
+        return _upstream_error(e)
+
+    response = Response(body, mimetype="application/geo+json")
+    if request.args.get("v", type=int) == maptiles.epoch(settings):
+        max_age = int(maptiles.epoch_expires_in(settings))
+        response.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    else:
+        response.headers["Cache-Control"] = "public, max-age=60"
+    return response
 
 
 @bp.get("/api/geo/towers")
@@ -344,7 +478,7 @@ def get_towers():
         lat = 51.505
         lon = -0.09
 
-    if not settings.opencellid_api_key:
+    if not settings.opencellid_api_key and towerdb.get() is None:
         return jsonify({"error": "Missing OPENCELLID_API_KEY"}), 400
 
     try:
@@ -352,39 +486,11 @@ def get_towers():
     except PermissionError as e:
         return jsonify({"error": str(e)}), 429
 
-    min_lat = lat - 0.05
-    max_lat = lat + 0.05
-    min_lon = lon - 0.05
-    max_lon = lon + 0.05
-    bbox = f"{min_lat},{min_lon},{max_lat},{max_lon}"
-
-    cache_key = f"opencellid:area:{bbox}"
-    data = cache.get(cache_key)
-    if data is None:
-        try:
-            data = opencellid.get_in_area(key=settings.opencellid_api_key, bbox=bbox)
-        except UpstreamError as e:
-            return jsonify({"error": str(e)}), 502
-        if data is None:
-            return jsonify({"error": "Upstream API error"}), 502
-        cache.set(cache_key, data, ttl_s=settings.cache_ttl_towers_s)
-
-    cells = data.get("cells", []) if isinstance(data, dict) else data
-    towers: list[dict[str, Any]] = []
-    if isinstance(cells, list):
-        for cell in cells:
-            towers.append(
-                {
-                    "id": str(cell.get("cellid", "Unknown")),
-                    "lat": float(cell.get("lat")),
-                    "lon": float(cell.get("lon")),
-                    "lac": cell.get("lac", 0),
-                    "mcc": cell.get("mcc", 0),
-                    "mnc": cell.get("mnc", 0),
-                    "signal": cell.get("signal", 0),
-                    "radio": cell.get("radio", "gsm"),
-                }
-            )
+    prefetch.observe(settings, "towers", lat, lon)
+    try:
+        towers, _ = lookups.area_towers(settings, lat=lat, lon=lon)
+    except UpstreamError as e:
+        return _upstream_error(e)
     return jsonify(towers)
 
 
@@ -402,203 +508,160 @@ def get_celltower_click():
     except PermissionError as e:
         return jsonify({"error": str(e)}), 429
 
-    min_lat = lat - 0.01
-    max_lat = lat + 0.01
-    min_lon = lon - 0.01
-    max_lon = lon + 0.01
-    bbox = f"{min_lon},{min_lat},{max_lon},{max_lat}"
-
-    cache_key = f"opencellid:ajax:{bbox}"
-    data = cache.get(cache_key)
-    if data is None:
-        try:
-            data = opencellid.ajax_get_cells(bbox=bbox)
-        except UpstreamError as e:
-            return jsonify({"error": str(e)}), 502
-        if not data:
-            return jsonify({"error": "Upstream API error"}), 502
-        cache.set(cache_key, data, ttl_s=settings.cache_ttl_towers_s)
-
-    towers: list[dict[str, Any]] = []
-    features = data.get("features", []) if isinstance(data, dict) else []
-    for feature in features:
-        props = feature.get("properties", {}) or {}
-        geom = feature.get("geometry", {}) or {}
-        coords = geom.get("coordinates", [0, 0])
-        towers.append(
-            {
-                "id": str(props.get("cellid", props.get("unit", "Unknown"))),
-                "lat": float(coords[1]),
-                "lon": float(coords[0]),
-                "lac": props.get("area", 0),
-                "mcc": props.get("mcc", 0),
-                "mnc": props.get("net", 0),
-                "signal": props.get("samples", 0),
-                "radio": props.get("radio", "gsm"),
-            }
-        )
+    try:
+        towers, _ = lookups.ajax_towers(settings, lat=lat, lon=lon)
+    except UpstreamError as e:
+        return _upstream_error(e)
     return jsonify(towers)
 
 
-@bp.get("/searchzz")
-def search():
-    settings = _settings()
+def _search_network(network: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "lat": network.get("trilat"),
+        "lon": network.get("trilong"),
+        "ssid": network.get("ssid"),
+        "bssid": network.get("netid"),
+        "vendor": network.get("vendor"),
+        "signal": network.get("level"),
+        "timestamp": network.get("lastupdt"),
+        "type": "router",
+    }
 
-    search_type = request.args.get("type")
-    query = request.args.get("query")
-    if not search_type or not query:
-        return jsonify({"error": "Missing search parameters"}), 400
 
-    devices: list[dict[str, Any]] = []
+def _wigle_search(
+    key: str, search: Callable[[], Iterable[dict[str, Any]]], *, ttls: tuple[float, float]
+) -> tuple[list[dict[str, Any]], bool]:
+    """Cached `(records, truncated)` of a paged Wigle search."""
 
-    try:
-        _enforce_rate_limit("search", per_minute=settings.rate_limit_rpm)
-    except PermissionError as e:
-        return jsonify({"error": str(e)}), 429
+    def _fetch() -> dict[str, Any]:
+        found = search()
+        records = list(found)
+        return {"records": records, "truncated": geocache.is_partial(found)}
+
+    cached, _ = cache.get_or_fetch(key, _fetch, ttl_s=ttls[0], hard_ttl_s=ttls[1])
+    return cached["records"], cached["truncated"]
+
+
+def _parse_point(query: str) -> tuple[float, float]:
+    """`"lat,lon"` as floats. Raises `ValueError`."""
+    lat, lon = map(float, query.split(","))
+    return lat, lon
+
+
+def _search_records(
+    settings: Settings, *, search_type: str, query: str
+) -> Iterator[dict[str, Any]]:
+    """Yield each provider's devices for a search; raises `UpstreamError`.
+
+    A provider whose circuit is open is skipped and listed in the final
+    `meta.skipped`, whatever the search type.
+    """
+    soft_ttl, hard_ttl = settings.cache_ttls("search")
+    sent = 0
+    truncated = False
+    skipped: list[str] = []
+    has_wigle = bool(settings.wigle_api_name and settings.wigle_api_token)
 
     if search_type == "location":
-        try:
-            lat, lon = map(float, query.split(","))
-        except Exception:
-            return jsonify({"error": "Invalid location format"}), 400
+        lat, lon = _parse_point(query)
 
-        if settings.wigle_api_name and settings.wigle_api_token:
-            cache_key = f"search:wigle:loc:{lat:.4f}:{lon:.4f}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = wigle.network_search(
-                        api_name=settings.wigle_api_name,
-                        api_token=settings.wigle_api_token,
-                        lat=lat,
-                        lon=lon,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_search_s)
-
-            for network in cached:
-                devices.append(
-                    {
-                        "lat": network.get("trilat"),
-                        "lon": network.get("trilong"),
-                        "ssid": network.get("ssid"),
-                        "bssid": network.get("netid"),
-                        "vendor": network.get("vendor"),
-                        "signal": network.get("level"),
-                        "timestamp": network.get("lastupdt"),
-                        "type": "router",
-                    }
+        if has_wigle:
+            try:
+                cached, _ = lookups.wigle_networks(
+                    settings, lat=lat, lon=lon, ttls=(soft_ttl, hard_ttl)
                 )
+            except CircuitOpenError:
+                skipped.append("wigle")
+                cached = []
+            truncated = geocache.is_partial(cached)
+            for chunk in streaming.chunks([_search_network(network) for network in cached]):
+                sent += len(chunk)
+                yield {"provider": "wigle", "devices": chunk}
 
         if settings.opencellid_api_key:
-            cache_key = f"search:unwired:loc:{lat:.4f}:{lon:.4f}"
-            data = cache.get(cache_key)
-            if data is None:
-                try:
-                    data = opencellid.unwiredlabs_process(
-                        token=settings.opencellid_api_key, lat=lat, lon=lon
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, data, ttl_s=settings.cache_ttl_search_s)
-            if data and data.get("status") == "ok":
-                for cell in data.get("cells", []) or []:
-                    devices.append(
-                        {
-                            "lat": cell.get("lat"),
-                            "lon": cell.get("lon"),
-                            "cell_id": str(cell.get("cellid")),
-                            "signal": cell.get("signal"),
-                            "accuracy": cell.get("accuracy"),
-                            "timestamp": cell.get("updated"),
-                            "type": "cell_tower",
-                        }
-                    )
+            try:
+                data, _ = lookups.unwired_cells(
+                    settings, lat=lat, lon=lon, ttls=(soft_ttl, hard_ttl)
+                )
+            except CircuitOpenError:
+                skipped.append("opencellid")
+                data = None
+            for chunk in streaming.chunks(lookups.normalize_unwired_cells(data)):
+                sent += len(chunk)
+                yield {"provider": "opencellid", "devices": chunk}
 
     elif search_type == "bssid":
-        if settings.wigle_api_name and settings.wigle_api_token:
-            cache_key = f"search:wigle:bssid:{query}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = wigle.search_by_bssid(
+        if has_wigle:
+            try:
+                cached, truncated = _wigle_search(
+                    f"search:wigle:bssid:{query}",
+                    lambda: wigle.search_by_bssid(
                         api_name=settings.wigle_api_name,
                         api_token=settings.wigle_api_token,
                         bssid=query,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_search_s)
-
-            for network in cached:
-                devices.append(
-                    {
-                        "lat": network.get("trilat"),
-                        "lon": network.get("trilong"),
-                        "ssid": network.get("ssid"),
-                        "bssid": network.get("netid"),
-                        "vendor": network.get("vendor"),
-                        "signal": network.get("level"),
-                        "timestamp": network.get("lastupdt"),
-                        "type": "router",
-                    }
+                        max_records=settings.wigle_max_records,
+                        max_pages=settings.wigle_max_pages,
+                    ),
+                    ttls=(soft_ttl, hard_ttl),
                 )
+            except CircuitOpenError:
+                skipped.append("wigle")
+                cached = []
+            for chunk in streaming.chunks([_search_network(network) for network in cached]):
+                sent += len(chunk)
+                yield {"provider": "wigle", "devices": chunk}
 
     elif search_type == "ssid":
-        if settings.wigle_api_name and settings.wigle_api_token:
-            cache_key = f"search:wigle:ssid:{query}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = wigle.search_by_ssid(
+        if has_wigle:
+            try:
+                cached, truncated = _wigle_search(
+                    f"search:wigle:ssid:{query}",
+                    lambda: wigle.search_by_ssid(
                         api_name=settings.wigle_api_name,
                         api_token=settings.wigle_api_token,
                         ssid=query,
-                    )
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_search_s)
-
-            for network in cached:
-                devices.append(
-                    {
-                        "lat": network.get("trilat"),
-                        "lon": network.get("trilong"),
-                        "ssid": network.get("ssid"),
-                        "bssid": network.get("netid"),
-                        "vendor": network.get("vendor"),
-                        "signal": network.get("level"),
-                        "timestamp": network.get("lastupdt"),
-                        "type": "router",
-                    }
+                        max_records=settings.wigle_max_records,
+                        max_pages=settings.wigle_max_pages,
+                    ),
+                    ttls=(soft_ttl, hard_ttl),
                 )
+            except CircuitOpenError:
+                skipped.append("wigle")
+                cached = []
+            for chunk in streaming.chunks([_search_network(network) for network in cached]):
+                sent += len(chunk)
+                yield {"provider": "wigle", "devices": chunk}
 
     elif search_type == "network":
         if settings.shodan_api_key:
-            cache_key = f"search:shodan:{query}"
-            cached = cache.get(cache_key)
-            if cached is None:
-                try:
-                    cached = shodan.host_search(api_key=settings.shodan_api_key, query=query)
-                except UpstreamError as e:
-                    return jsonify({"error": str(e)}), 502
-                cache.set(cache_key, cached, ttl_s=settings.cache_ttl_search_s)
-
-            for host in cached:
-                devices.append(
-                    {
-                        "lat": (host.get("location", {}) or {}).get("latitude"),
-                        "lon": (host.get("location", {}) or {}).get("longitude"),
-                        "ip": host.get("ip_str"),
-                        "vendor": host.get("org"),
-                        "type": host.get("product", "iot"),
-                    }
+            try:
+                cached, _ = cache.get_or_fetch(
+                    f"search:shodan:{query}",
+                    lambda: shodan.host_search(api_key=settings.shodan_api_key, query=query),
+                    ttl_s=soft_ttl,
+                    hard_ttl_s=hard_ttl,
                 )
+            except CircuitOpenError:
+                skipped.append("shodan")
+                cached = []
+            hosts = [
+                {
+                    "lat": (host.get("location", {}) or {}).get("latitude"),
+                    "lon": (host.get("location", {}) or {}).get("longitude"),
+                    "ip": host.get("ip_str"),
+                    "vendor": host.get("org"),
+                    "type": host.get("product", "iot"),
+                }
+                for host in cached
+            ]
+            for chunk in streaming.chunks(hosts):
+                sent += len(chunk)
+                yield {"provider": "shodan", "devices": chunk}
 
-    if not devices and search_type in {"location", "ssid", "bssid", "network"}:
+    if not sent and search_type in {"location", "ssid", "bssid", "network"}:
+        devices: list[dict[str, Any]] = []
         if search_type == "location":
-            lat, lon = map(float, query.split(","))
+            lat, lon = _parse_point(query)
             devices = [
                 d for d in DUMMY_DATA if abs(d["lat"] - lat) < 0.1 and abs(d["lon"] - lon) < 0.1
             ]
@@ -608,5 +671,45 @@ def search():
             devices = [d for d in DUMMY_DATA if (d.get("bssid", "") or "").lower() == query.lower()]
         elif search_type == "network":
             devices = [d for d in DUMMY_DATA if (d.get("ip", "") or "") == query]
+        sent = len(devices)
+        yield {"provider": "dummy", "devices": devices}
 
+    meta: dict[str, Any] = {"count": sent}
+    if truncated:
+        # Wigle had more than `wigle_max_records` / `wigle_max_pages` allowed.
+        meta["truncated"] = True
+    if skipped:
+        meta["skipped"] = skipped
+    yield {"meta": meta}
+
+
+@bp.get("/searchzz")
+def search():
+    settings = _settings()
+
+    search_type = request.args.get("type")
+    query = request.args.get("query")
+    if not search_type or not query:
+        return jsonify({"error": "Missing search parameters"}), 400
+
+    try:
+        _enforce_rate_limit("search", per_minute=settings.rate_limit_rpm)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 429
+
+    if search_type == "location":
+        try:
+            _parse_point(query)
+        except ValueError:
+            return jsonify({"error": "Invalid location format"}), 400
+
+    records = _search_records(settings, search_type=search_type, query=query)
+    fmt = _stream_format()
+    if fmt:
+        return _stream(records, fmt)
+
+    try:
+        devices, _ = streaming.collect(records)
+    except UpstreamError as e:
+        return _upstream_error(e)
     return jsonify({"devices": devices})
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from typing import Any
+
+from ... import timing
+from ...errors import UpstreamError
+from .. import http as blocking
+from .. import replay, timeouts
+
+try:
+    import httpx
+except ImportError:  # optional; only the ASGI entry point needs it
+    httpx = None  # type: ignore[assignment]
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 is negotiated only when `h2` is installed
+    HTTP2 = False
+else:
+    HTTP2 = True
+
+# Non-blocking counterpart of `wiretapper.services.http`. It goes through the same
+# per-provider quota schedulers, back-off, error mapping, timeouts and retries,
+# but the calls wait on the event loop. httpx keeps a keep-alive pool per origin
+# and negotiates HTTP/2 where the upstream offers it.
+
+_CLIENTS: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any] = weakref.WeakKeyDictionary()
+_POOL_SIZE = 32
+_MAX_CONNECTIONS = 256
+
+
+def configure(*, pool_size: int, max_connections: int) -> None:
+    """Size the pools of clients created from now on."""
+    global _POOL_SIZE, _MAX_CONNECTIONS
+    _POOL_SIZE = max(1, pool_size)
+    _MAX_CONNECTIONS = max(_POOL_SIZE, max_connections)
+
+
+def client() -> Any:
+    """The `httpx.AsyncClient` of the running event loop."""
+    if httpx is None:
+        raise RuntimeError("The async service layer needs httpx: pip install wiretapper[async]")
+    loop = asyncio.get_running_loop()
+    found = _CLIENTS.get(loop)
+    if found is None:
+        found = _CLIENTS[loop] = httpx.AsyncClient(
+            headers=blocking.HEADERS,
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=_MAX_CONNECTIONS,
+                max_keepalive_connections=_POOL_SIZE,
+                keepalive_expiry=30.0,
+            ),
+            timeout=blocking.DEFAULT_TIMEOUT_S,
+        )
+    return found
+
+
+async def aclose() -> None:
+    """Close the running loop's client, e.g. on ASGI lifespan shutdown."""
+    found = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if found is not None:
+        await found.aclose()
+
+
+async def _attempt(
+    method: str, url: str, endpoint: timeouts.Endpoint, deadline: float, **kwargs: Any
+) -> Any:
+    provider, scheduler, circuit = blocking._guards(url)
+    try:
+        if scheduler is not None:
+            with timing.span(f"quota-{provider}"):
+                await scheduler.acquire_async(
+                    priority=blocking._PRIORITY.get(), max_wait_s=blocking._MAX_WAIT_S
+                )
+    except BaseException:
+        blocking._record(circuit, None, 0.0)
+        raise
+    connect_s, read_s = endpoint.timeout(deadline)
+    started = time.monotonic()
+    try:
+        with timing.span(f"upstream-{provider}"):
+            response = await client().request(
+                method,
+                blocking.target(url),
+                headers=blocking.trace_headers(),
+                timeout=httpx.Timeout(read_s, connect=connect_s),
+                **kwargs,
+            )
+    except httpx.HTTPError as exc:
+        latency_s = time.monotonic() - started
+        timed_out = isinstance(exc, httpx.TimeoutException)
+        endpoint.observe(latency_s, timed_out=timed_out)
+        blocking._failed(provider, circuit, latency_s, exc, timed_out=timed_out)
+        raise UpstreamError("Upstream request failed") from exc
+    except BaseException:
+        blocking._record(circuit, None, 0.0)
+        raise
+    finally:
+        if scheduler is not None:
+            scheduler.release()
+    latency_s = time.monotonic() - started
+    endpoint.observe(latency_s)
+    blocking._settle(provider, scheduler, circuit, response, latency_s)
+    return response
+
+
+async def _hedged(
+    method: str,
+    url: str,
+    endpoint: timeouts.Endpoint,
+    deadline: float,
+    after_s: float,
+    **kwargs: Any,
+) -> Any:
+    first = asyncio.ensure_future(_attempt(method, url, endpoint, deadline, **kwargs))
+    done, _ = await asyncio.wait({first}, timeout=after_s)
+    if done:
+        return first.result()
+    second = asyncio.ensure_future(_attempt(method, url, endpoint, deadline, **kwargs))
+    pending = {first, second}
+    error: UpstreamError | None = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response = task.result()
+                except UpstreamError as exc:
+                    error = error or exc
+                    continue
+                endpoint.hedged(won=task is second)
+                return response
+    finally:
+        # Unlike a thread, the slower try can be cancelled.
+        for task in pending:
+            task.cancel()
+    endpoint.hedged(won=False)
+    assert error is not None
+    raise error
+
+
+async def _fetch(method: str, url: str, **kwargs: Any) -> Any:
+    endpoint = timeouts.endpoint(url)
+    deadline = timeouts.deadline()
+    attempt = 0
+    while True:
+        try:
+            after_s = endpoint.hedge_after_s(method)
+            if after_s is not None:
+                return await _hedged(method, url, endpoint, deadline, after_s, **kwargs)
+            return await _attempt(method, url, endpoint, deadline, **kwargs)
+        except UpstreamError as exc:
+            delay = endpoint.retry_in(method, exc, attempt=attempt, deadline=deadline)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def _request(method: str, url: str, **kwargs: Any) -> Any:
+    mode, call = blocking._archived(method, url, kwargs)
+    if call is None:
+        return await _fetch(method, url, **kwargs)
+    # The archive is SQLite: read and write it off the event loop.
+    if mode == "replay":
+        with timing.span("replay"):
+            recorded = await asyncio.to_thread(replay.replay, call)
+        headers = {"Content-Type": recorded.content_type} if recorded.content_type else None
+        return httpx.Response(recorded.status, content=recorded.body, headers=headers)
+    response = await _fetch(method, url, **kwargs)
+    await asyncio.to_thread(
+        replay.record,
+        call,
+        replay.Recorded(
+            response.status_code, response.headers.get("Content-Type"), response.content
+        ),
+    )
+    return response
+
+
+async def get(url: str, *, params: dict[str, Any] | None = None, auth: Any | None = None) -> Any:
+    return await _request("GET", url, params=params, auth=auth)
+
+
+async def post_json(url: str, *, payload: dict[str, Any]) -> Any:
+    return await _request("POST", url, json=payload)
+
+
+async def get_json(url: str, *, params: dict[str, Any] | None = None) -> Any:
+    return await _request("GET", url, params=params)
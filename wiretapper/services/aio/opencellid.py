@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from ..opencellid import AJAX_CELLS_URL, GET_IN_AREA_URL, UNWIREDLABS_URL
+from .http import get, get_json, post_json
+
+
+async def unwiredlabs_process(*, token: str, lat: float, lon: float) -> dict[str, Any] | None:
+    response = await post_json(
+        UNWIREDLABS_URL, payload={"token": token, "lat": lat, "lon": lon, "address": 0}
+    )
+    return response.json()
+
+
+async def get_in_area(*, key: str, bbox: str) -> dict[str, Any] | list[Any] | None:
+    response = await get(GET_IN_AREA_URL, params={"key": key, "BBOX": bbox, "format": "json"})
+    try:
+        return response.json()
+    except json.JSONDecodeError:
+        return None
+
+
+async def ajax_get_cells(*, bbox: str) -> dict[str, Any] | None:
+    response = await get_json(AJAX_CELLS_URL, params={"bbox": bbox})
+    return response.json()
@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+from typing import Any
+
+from ..shodan import HOST_SEARCH_URL
+from .http import get
+
+
+async def host_search(
+    *, api_key: str, query: str, limit: int | None = None
+) -> list[dict[str, Any]]:
+    params: dict[str, Any] = {"key": api_key, "query": query}
+    if limit is not None:
+        params["limit"] = limit
+    response = await get(HOST_SEARCH_URL, params=params)
+    return response.json().get("matches", []) or []
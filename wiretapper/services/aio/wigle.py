@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncGenerator, AsyncIterator
+from typing import Any
+
+from .. import wigle as blocking
+from ..wigle import BLUETOOTH_SEARCH_URL, NETWORK_SEARCH_URL
+from .http import get
+
+# Async generators with the paging rules of `wiretapper.services.wigle`; the
+# next page is requested as a task while the caller consumes the current one.
+
+
+class Paged(AsyncIterator[dict[str, Any]]):
+    """The records of one search, fetched as they are iterated."""
+
+    truncated = False
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        params: dict[str, Any],
+        auth: tuple[str, str],
+        max_records: int,
+        max_pages: int,
+    ) -> None:
+        self._records = _paged(
+            self, url, params=params, auth=auth, max_records=max_records, max_pages=max_pages
+        )
+
+    async def __anext__(self) -> dict[str, Any]:
+        return await anext(self._records)
+
+    async def aclose(self) -> None:
+        await self._records.aclose()
+
+
+async def _paged(
+    search: Paged,
+    url: str,
+    *,
+    params: dict[str, Any],
+    auth: tuple[str, str],
+    max_records: int,
+    max_pages: int,
+) -> AsyncGenerator[dict[str, Any], None]:
+    per_page = max(1, min(blocking.RESULTS_PER_PAGE, max_records))
+
+    async def _page(search_after: Any) -> blocking.Page:
+        page_params = {**params, "resultsPerPage": per_page}
+        if search_after is not None:
+            page_params["searchAfter"] = search_after
+        response = await get(url, params=page_params, auth=auth)
+        data = response.json()
+        return data.get("results", []) or [], data.get("searchAfter")
+
+    if max_records <= 0 or max_pages <= 0:
+        return
+    results, cursor = await _page(None)
+    pages = 1
+    sent = 0
+    while True:
+        ahead: asyncio.Task[blocking.Page] | None = None
+        if (
+            cursor
+            and len(results) >= per_page
+            and pages < max_pages
+            and sent + len(results) < max_records
+        ):
+            ahead = asyncio.create_task(_page(cursor))
+        batch = results[: max_records - sent]
+        try:
+            for record in batch:
+                yield record
+        except GeneratorExit:
+            if ahead is not None:
+                ahead.cancel()
+            raise
+        sent += len(batch)
+        if ahead is None:
+            search.truncated = len(batch) < len(results) or bool(
+                cursor and len(results) >= per_page
+            )
+            return
+        results, cursor = await ahead
+        pages += 1
+
+
+def _area_search(
+    url: str,
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int,
+    max_pages: int,
+) -> Paged:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return Paged(
+        url,
+        params={
+            "latrange1": min_lat,
+            "latrange2": max_lat,
+            "longrange1": min_lon,
+            "longrange2": max_lon,
+        },
+        auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def bluetooth_search_bbox(
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int = blocking.DEFAULT_MAX_RECORDS,
+    max_pages: int = blocking.DEFAULT_MAX_PAGES,
+) -> Paged:
+    return _area_search(
+        BLUETOOTH_SEARCH_URL,
+        api_name=api_name,
+        api_token=api_token,
+        bbox=bbox,
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def network_search_bbox(
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int = blocking.DEFAULT_MAX_RECORDS,
+    max_pages: int = blocking.DEFAULT_MAX_PAGES,
+) -> Paged:
+    return _area_search(
+        NETWORK_SEARCH_URL,
+        api_name=api_name,
+        api_token=api_token,
+        bbox=bbox,
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def search_by_bssid(
+    *,
+    api_name: str,
+    api_token: str,
+    bssid: str,
+    max_records: int = blocking.DEFAULT_MAX_RECORDS,
+    max_pages: int = blocking.DEFAULT_MAX_PAGES,
+) -> Paged:
+    return Paged(
+        NETWORK_SEARCH_URL,
+        params={"netid": bssid},
+        auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def search_by_ssid(
+    *,
+    api_name: str,
+    api_token: str,
+    ssid: str,
+    max_records: int = blocking.DEFAULT_MAX_RECORDS,
+    max_pages: int = blocking.DEFAULT_MAX_PAGES,
+) -> Paged:
+    return Paged(
+        NETWORK_SEARCH_URL,
+        params={"ssid": ssid},
+        auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
+    )
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+from ..errors import CircuitOpenError
+
+# Circuit breakers per provider. A breaker trips when failures (transport errors,
+# 5xx) or slow calls reach `trip_rate` of the recent window, fails calls fast while
+# open, and after `open_s` lets one probe through: success closes it, failure
+# reopens it.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class Policy:
+    window: int = 20
+    min_calls: int = 5
+    trip_rate: float = 0.5
+    slow_call_s: float = 5.0
+    open_s: float = 30.0
+
+
+class Breaker:
+    def __init__(self, name: str, policy: Policy) -> None:
+        self.name = name
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=max(1, policy.window))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._last_error: str | None = None
+        self._trips = 0
+        self._rejected = 0
+
+    def _retry_in(self, now: float) -> float:
+        return max(0.0, self._opened_at + self.policy.open_s - now)
+
+    def before(self) -> None:
+        """Admit a call, or raise `CircuitOpenError` while the circuit is open."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN:
+                if self._retry_in(now) > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(
+                        f"{self.name}: circuit open ({self._last_error})",
+                        retry_after_s=self._retry_in(now),
+                    )
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN:
+                if self._probing:
+                    self._rejected += 1
+                    raise CircuitOpenError(f"{self.name}: circuit half-open, probe in flight")
+                self._probing = True
+
+    def record(self, *, failed: bool | None, latency_s: float, error: str | None = None) -> None:
+        """Count one call; `failed=None` (never sent, or a 4xx) counts for neither side."""
+        now = time.monotonic()
+        slow = failed is not None and latency_s >= self.policy.slow_call_s
+        with self._lock:
+            if error:
+                self._last_error = error
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if failed or slow:
+                    self._trip(now)
+                elif failed is False:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            if failed is None:
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.policy.min_calls:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slows = sum(1 for _, s in self._outcomes if s)
+            limit = self.policy.trip_rate * len(self._outcomes)
+            if failures >= limit or slows >= limit:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._trips += 1
+        self._outcomes.clear()
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self._state,
+                "calls": calls,
+                "failure_rate": round(sum(f for f, _ in self._outcomes) / calls, 2)
+                if calls
+                else 0.0,
+                "slow_rate": round(sum(s for _, s in self._outcomes) / calls, 2) if calls else 0.0,
+                "trips": self._trips,
+                "rejected": self._rejected,
+                "retry_after_s": round(self._retry_in(now), 1) if self._state == OPEN else 0.0,
+                "last_error": self._last_error,
+            }
+
+
+_PROVIDERS = ("wigle", "shodan", "unwiredlabs", "opencellid")
+_BREAKERS: dict[str, Breaker] = {name: Breaker(name, Policy()) for name in _PROVIDERS}
+
+
+def configure(policy: Policy) -> None:
+    """Replace every provider's breaker (all circuits start closed)."""
+    global _BREAKERS
+    _BREAKERS = {name: Breaker(name, policy) for name in _PROVIDERS}
+
+
+def get(provider: str) -> Breaker | None:
+    return _BREAKERS.get(provider)
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    return {name: breaker.stats() for name, breaker in _BREAKERS.items()}
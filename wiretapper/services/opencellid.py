@@ -6,10 +6,14 @@ import requests
 
 from .http import get, get_json, post_json
 
+UNWIREDLABS_URL = "https://us1.unwiredlabs.com/v2/process.php"
+GET_IN_AREA_URL = "http://opencellid.org/cell/getInArea"
+AJAX_CELLS_URL = "https://www.opencellid.org/ajax/getCells.php"
+
 
 def unwiredlabs_process(*, token: str, lat: float, lon: float) -> dict[str, Any] | None:
     response = post_json(
-        "https://us1.unwiredlabs.com/v2/process.php",
+        UNWIREDLABS_URL,
         payload={"token": token, "lat": lat, "lon": lon, "address": 0},
     )
     return response.json()
@@ -17,7 +21,7 @@ def unwiredlabs_process(*, token: str, lat: float, lon: float) -> dict[str, Any]
 
 def get_in_area(*, key: str, bbox: str) -> dict[str, Any] | list[Any] | None:
     response = get(
-        "http://opencellid.org/cell/getInArea",
+        GET_IN_AREA_URL,
         params={"key": key, "BBOX": bbox, "format": "json"},
     )
     try:
@@ -27,5 +31,5 @@ def get_in_area(*, key: str, bbox: str) -> dict[str, Any] | list[Any] | None:
 
 
 def ajax_get_cells(*, bbox: str) -> dict[str, Any] | None:
-    response = get_json("https://www.opencellid.org/ajax/getCells.php", params={"bbox": bbox})
+    response = get_json(AJAX_CELLS_URL, params={"bbox": bbox})
     return response.json()
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urlsplit
+
+from .. import sqlitedb
+from ..errors import ReplayMissError
+
+# Record-and-replay of upstream responses, selected per provider:
+# - `live`: call the provider (the default);
+# - `record`: call it and keep every 2xx answer in the archive;
+# - `replay`: answer from the archive only, without any network I/O.
+# The archive is a SQLite file with one zlib-compressed body per endpoint and
+# normalized parameters (API keys and tokens left out). Calls about a place also
+# index the box they cover in an R-tree, so replay can answer a new location from
+# the smallest recorded box containing it, or else the nearest recorded one.
+
+MODES = ("live", "record", "replay")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rest TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    content_type TEXT,
+    body BLOB NOT NULL,
+    recorded_at REAL NOT NULL,
+    UNIQUE (endpoint, key)
+);
+CREATE INDEX IF NOT EXISTS responses_rest ON responses (endpoint, rest);
+CREATE VIRTUAL TABLE IF NOT EXISTS responses_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+"""
+
+_SECRETS = frozenset({"key", "token", "api_key", "apikey", "access_token"})
+_SHODAN_GEO = re.compile(r"^geo:(-?[\d.]+),(-?[\d.]+)(?:,([\d.]+))?$")
+_M_PER_DEG = 111_320.0
+
+BBox = tuple[float, float, float, float]  # min_lat, min_lon, max_lat, max_lon
+
+
+@dataclass(frozen=True)
+class Call:
+    """A normalized upstream call: what the archive is keyed by."""
+
+    endpoint: str
+    key: str
+    rest: str  # `key` without the location parameters
+    box: BBox | None
+
+
+@dataclass(frozen=True)
+class Recorded:
+    status: int
+    content_type: str | None
+    body: bytes
+
+
+def _canonical(params: Mapping[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _floats(raw: Any, n: int) -> list[float] | None:
+    try:
+        values = [float(v) for v in str(raw).split(",")]
+    except ValueError:
+        return None
+    return values if len(values) == n else None
+
+
+def _location(params: dict[str, Any]) -> tuple[BBox | None, tuple[str, ...]]:
+    """The box a call is about and the parameters that describe it."""
+    names = ("latrange1", "latrange2", "longrange1", "longrange2")
+    if all(name in params for name in names):
+        lat1, lat2, lon1, lon2 = (float(params[name]) for name in names)
+        return (min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2)), names
+    if (box := _floats(params.get("BBOX"), 4)) is not None:  # OpenCellID: lat,lon,lat,lon
+        return (box[0], box[1], box[2], box[3]), ("BBOX",)
+    if (box := _floats(params.get("bbox"), 4)) is not None:  # OpenCellID ajax: lon,lat,...
+        return (box[1], box[0], box[3], box[2]), ("bbox",)
+    if "lat" in params and "lon" in params:
+        lat, lon = float(params["lat"]), float(params["lon"])
+        return (lat, lon, lat, lon), ("lat", "lon")
+    match = _SHODAN_GEO.match(str(params.get("query", "")))
+    if match:
+        lat, lon = float(match[1]), float(match[2])
+        radius = float(match[3] or 0) * 1000 / _M_PER_DEG
+        return (lat - radius, lon - radius, lat + radius, lon + radius), ("query",)
+    return None, ()
+
+
+def normalize(
+    method: str,
+    url: str,
+    *,
+    params: Mapping[str, Any] | None = None,
+    payload: Mapping[str, Any] | None = None,
+) -> Call:
+    parts = urlsplit(url)
+    merged = {
+        name: value
+        for name, value in {**(params or {}), **(payload or {})}.items()
+        if value is not None and name.lower() not in _SECRETS
+    }
+    try:
+        box, names = _location(merged)
+    except (TypeError, ValueError):
+        box, names = None, ()
+    rest = {name: value for name, value in merged.items() if name not in names}
+    return Call(
+        endpoint=f"{method.upper()} {parts.hostname}{parts.path}",
+        key=_canonical(merged),
+        rest=_canonical(rest),
+        box=box,
+    )
+
+
+class Archive:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = sqlitedb.Connections(path, schema=_SCHEMA)
+
+    def put(self, call: Call, recorded: Recorded) -> None:
+        with self._db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO responses"
+                " (endpoint, key, rest, status, content_type, body, recorded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (endpoint, key) DO UPDATE SET status = excluded.status,"
+                " content_type = excluded.content_type, body = excluded.body,"
+                " recorded_at = excluded.recorded_at",
+                (
+                    call.endpoint,
+                    call.key,
+                    call.rest,
+                    recorded.status,
+                    recorded.content_type,
+                    zlib.compress(recorded.body, 6),
+                    time.time(),
+                ),
+            )
+            if call.box is not None:
+                (row_id,) = conn.execute(
+                    "SELECT id FROM responses WHERE endpoint = ? AND key = ?",
+                    (call.endpoint, call.key),
+                ).fetchone()
+                min_lat, min_lon, max_lat, max_lon = call.box
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses_rtree VALUES (?, ?, ?, ?, ?)",
+                    (row_id, min_lat, max_lat, min_lon, max_lon),
+                )
+
+    def get(self, call: Call, *, max_distance_m: float) -> tuple[Recorded, str] | None:
+        """The best recorded answer and how it matched: exact, contains or nearest."""
+        conn = self._db.get()
+        row = conn.execute(
+            "SELECT status, content_type, body FROM responses WHERE endpoint = ? AND key = ?",
+            (call.endpoint, call.key),
+        ).fetchone()
+        match = "exact"
+        if row is None and call.box is not None:
+            min_lat, min_lon, max_lat, max_lon = call.box
+            lat, lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+            row = conn.execute(
+                "SELECT s.status, s.content_type, s.body"
+                " FROM responses_rtree r JOIN responses s ON s.id = r.id"
+                " WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ?"
+                " AND s.endpoint = ? AND s.rest = ?"
+                " ORDER BY (r.max_lat - r.min_lat) * (r.max_lon - r.min_lon) LIMIT 1",
+                (lat, lat, lon, lon, call.endpoint, call.rest),
+            ).fetchone()
+            match = "contains"
+            if row is None and max_distance_m > 0:
+                dlat = max_distance_m / _M_PER_DEG
+                scale = max(math.cos(math.radians(lat)), 0.01)
+                dlon = dlat / scale
+                # Ordered by distance between centres, in doubled coordinates.
+                row = conn.execute(
+                    "SELECT s.status, s.content_type, s.body"
+                    " FROM responses_rtree r JOIN responses s ON s.id = r.id"
+                    " WHERE r.max_lat >= :south AND r.min_lat <= :north"
+                    " AND r.max_lon >= :west AND r.min_lon <= :east"
+                    " AND s.endpoint = :endpoint AND s.rest = :rest"
+                    " ORDER BY (r.min_lat + r.max_lat - :lat2) * (r.min_lat + r.max_lat - :lat2)"
+                    " + (r.min_lon + r.max_lon - :lon2) * (r.min_lon + r.max_lon - :lon2)"
+                    " * :scale2 LIMIT 1",
+                    {
+                        "south": lat - dlat,
+                        "north": lat + dlat,
+                        "west": lon - dlon,
+                        "east": lon + dlon,
+                        "endpoint": call.endpoint,
+                        "rest": call.rest,
+                        "lat2": 2 * lat,
+                        "lon2": 2 * lon,
+                        "scale2": scale * scale,
+                    },
+                ).fetchone()
+                match = "nearest"
+        if row is None:
+            return None
+        status, content_type, body = row
+        return Recorded(status, content_type, zlib.decompress(body)), match
+
+    def stats(self) -> dict[str, Any]:
+        conn = self._db.get()
+        responses = dict(
+            conn.execute("SELECT endpoint, COUNT(*) FROM responses GROUP BY endpoint").fetchall()
+        )
+        return {"path": self.path, "responses": responses}
+
+
+_ARCHIVE: Archive | None = None
+_MODES: dict[str, str] = {}
+_MAX_DISTANCE_M = 1000.0
+_COUNTS: Counter[str] = Counter()
+_COUNTS_LOCK = threading.Lock()
+
+
+def configure(
+    *, path: str | None, modes: Mapping[str, str], max_distance_m: float = 1000.0
+) -> None:
+    """Set each provider's mode (counters start over); `record` and `replay` need a `path`.
+
+    Raises `ValueError` for an unknown mode or a missing path.
+    """
+    global _ARCHIVE, _MODES, _MAX_DISTANCE_M
+    for provider, mode in modes.items():
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r} for {provider} (expected one of {MODES})")
+    active = {provider: mode for provider, mode in modes.items() if mode != "live"}
+    if active and not path:
+        raise ValueError("Recording or replaying providers needs an archive path")
+    if not path:
+        _ARCHIVE = None
+    elif _ARCHIVE is None or _ARCHIVE.path != path:
+        _ARCHIVE = Archive(path)
+    _MODES = active
+    _MAX_DISTANCE_M = max_distance_m
+    with _COUNTS_LOCK:
+        _COUNTS.clear()
+
+
+def mode(provider: str) -> str:
+    return _MODES.get(provider, "live")
+
+
+def _count(name: str) -> None:
+    with _COUNTS_LOCK:
+        _COUNTS[name] += 1
+
+
+def record(call: Call, recorded: Recorded) -> None:
+    if _ARCHIVE is not None:
+        _ARCHIVE.put(call, recorded)
+        _count("recorded")
+
+
+def replay(call: Call) -> Recorded:
+    """The archived answer to `call`; raises `ReplayMissError` when there is none."""
+    found = _ARCHIVE.get(call, max_distance_m=_MAX_DISTANCE_M) if _ARCHIVE else None
+    if found is None:
+        _count("miss")
+        raise ReplayMissError(f"No recorded response for {call.endpoint}")
+    recorded, match = found
+    _count(match)
+    return recorded
+
+
+def stats() -> dict[str, Any]:
+    with _COUNTS_LOCK:
+        counts = dict(_COUNTS)
+    if _ARCHIVE is None:
+        return {"enabled": False, "modes": {}, "counts": counts}
+    return {"enabled": True, "modes": dict(_MODES), "counts": counts, **_ARCHIVE.stats()}
@@ -4,10 +4,12 @@ from typing import Any
 
 from .http import get
 
+HOST_SEARCH_URL = "https://api.shodan.io/shodan/host/search"
+
 
 def host_search(*, api_key: str, query: str, limit: int | None = None) -> list[dict[str, Any]]:
     params: dict[str, Any] = {"key": api_key, "query": query}
     if limit is not None:
         params["limit"] = limit
-    response = get("https://api.shodan.io/shodan/host/search", params=params)
+    response = get(HOST_SEARCH_URL, params=params)
     return response.json().get("matches", []) or []
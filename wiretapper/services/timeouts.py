@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import bisect
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urlsplit
+
+from ..errors import UpstreamError
+
+# Adaptive timeouts per endpoint (host + path). Latencies go into log-spaced
+# histograms over two rotating windows; the read timeout of the next call is
+# `multiplier` x the endpoint's p99, clamped to [read_min_s, read_max_s], and is
+# `read_max_s` until `min_samples` calls were seen. Idempotent calls are retried
+# on transport errors and 502/503/504 with full-jitter backoff while the total
+# budget lasts. With `hedge_quantile` set, a GET still unanswered after that
+# quantile of its endpoint's latency is sent a second time; the first answer wins.
+
+IDEMPOTENT = frozenset({"GET", "HEAD"})
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+# Bucket upper bounds: 1 ms growing by 25% up to ~3 min.
+_BOUNDS = tuple(0.001 * 1.25**i for i in range(55))
+
+
+@dataclass(frozen=True)
+class Policy:
+    connect_s: float = 3.05
+    read_min_s: float = 1.0
+    read_max_s: float = 10.0
+    multiplier: float = 3.0
+    quantile: float = 0.99
+    min_samples: int = 20
+    window_s: float = 300.0
+    retries: int = 2
+    budget_s: float = 10.0
+    backoff_s: float = 0.2
+    backoff_max_s: float = 2.0
+    hedge_quantile: float = 0.0  # 0 = no hedging
+
+
+class Histogram:
+    """Latency counts over the current and the previous `window_s`."""
+
+    def __init__(self, window_s: float) -> None:
+        self.window_s = window_s
+        self._current = [0] * (len(_BOUNDS) + 1)
+        self._previous = [0] * (len(_BOUNDS) + 1)
+        self._rotated_at = time.monotonic()
+
+    def _rotate(self, now: float) -> None:
+        elapsed = now - self._rotated_at
+        if elapsed < self.window_s:
+            return
+        stale = elapsed >= 2 * self.window_s
+        self._previous = [0] * len(self._current) if stale else self._current
+        self._current = [0] * len(self._previous)
+        self._rotated_at = now
+
+    def observe(self, latency_s: float) -> None:
+        self._rotate(time.monotonic())
+        self._current[bisect.bisect_left(_BOUNDS, latency_s)] += 1
+
+    def count(self) -> int:
+        self._rotate(time.monotonic())
+        return sum(self._current) + sum(self._previous)
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding quantile `q`; None without samples."""
+        self._rotate(time.monotonic())
+        counts = [a + b for a, b in zip(self._current, self._previous, strict=True)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return _BOUNDS[min(index, len(_BOUNDS) - 1)]
+        return _BOUNDS[-1]
+
+
+class Endpoint:
+    def __init__(self, name: str, policy: Policy) -> None:
+        self.name = name
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._latency = Histogram(policy.window_s)
+        self._calls = 0
+        self._timeouts = 0
+        self._retries = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def observe(self, latency_s: float, *, timed_out: bool = False) -> None:
+        # A timed-out call counts at its elapsed time, so a slowing endpoint
+        # raises its own timeout instead of timing out ever sooner.
+        with self._lock:
+            self._latency.observe(latency_s)
+            self._calls += 1
+            self._timeouts += timed_out
+
+    def read_timeout_s(self) -> float:
+        policy = self.policy
+        with self._lock:
+            if self._latency.count() < policy.min_samples:
+                return policy.read_max_s
+            tail = self._latency.quantile(policy.quantile) or policy.read_max_s
+        return min(policy.read_max_s, max(policy.read_min_s, tail * policy.multiplier))
+
+    def timeout(self, deadline: float) -> tuple[float, float]:
+        """`(connect_s, read_s)` for the next try, within the request's `deadline`."""
+        remaining = max(0.001, deadline - time.monotonic())
+        return min(self.policy.connect_s, remaining), min(self.read_timeout_s(), remaining)
+
+    def hedge_after_s(self, method: str) -> float | None:
+        policy = self.policy
+        if not policy.hedge_quantile or method not in IDEMPOTENT:
+            return None
+        with self._lock:
+            if self._latency.count() < policy.min_samples:
+                return None
+            return self._latency.quantile(policy.hedge_quantile)
+
+    def retry_in(
+        self, method: str, exc: UpstreamError, *, attempt: int, deadline: float
+    ) -> float | None:
+        """Seconds to sleep before retrying after `exc`, or None to give up."""
+        policy = self.policy
+        if method not in IDEMPOTENT or attempt >= policy.retries:
+            return None
+        # Quota refusals and open circuits are subclasses: never retried here.
+        if type(exc) is not UpstreamError or exc.status_code not in (None, *RETRY_STATUSES):
+            return None
+        delay = random.uniform(0.0, min(policy.backoff_max_s, policy.backoff_s * 2**attempt))
+        if time.monotonic() + delay + policy.read_min_s > deadline:
+            return None
+        with self._lock:
+            self._retries += 1
+        return delay
+
+    def hedged(self, *, won: bool) -> None:
+        with self._lock:
+            self._hedges += 1
+            self._hedge_wins += won
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            p50 = self._latency.quantile(0.5)
+            p99 = self._latency.quantile(0.99)
+            stats = {
+                "calls": self._calls,
+                "timeouts": self._timeouts,
+                "retries": self._retries,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "p50_ms": round(p50 * 1000) if p50 is not None else None,
+                "p99_ms": round(p99 * 1000) if p99 is not None else None,
+            }
+        stats["read_timeout_s"] = round(self.read_timeout_s(), 2)
+        return stats
+
+
+_POLICY = Policy()
+_ENDPOINTS: dict[str, Endpoint] = {}
+_LOCK = threading.Lock()
+
+
+def configure(policy: Policy) -> None:
+    """Use `policy` from now on (latency history starts over)."""
+    global _POLICY
+    with _LOCK:
+        _POLICY = policy
+        _ENDPOINTS.clear()
+
+
+def policy() -> Policy:
+    return _POLICY
+
+
+def endpoint(url: str) -> Endpoint:
+    parts = urlsplit(url)
+    name = f"{parts.hostname or ''}{parts.path}"
+    with _LOCK:
+        found = _ENDPOINTS.get(name)
+        if found is None:
+            found = _ENDPOINTS[name] = Endpoint(name, _POLICY)
+        return found
+
+
+def deadline() -> float:
+    """When a request started now must give up, retries included."""
+    return time.monotonic() + _POLICY.budget_s
+
+
+def stats() -> dict[str, dict[str, Any]]:
+    with _LOCK:
+        endpoints = dict(_ENDPOINTS)
+    return {name: found.stats() for name, found in sorted(endpoints.items())}
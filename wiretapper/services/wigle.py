@@ -1,9 +1,178 @@
 from __future__ import annotations
 
+import contextvars
+import threading
+from collections.abc import Generator, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any
 
 from .http import get
 
+# Wigle search results are paged: each response carries a `searchAfter` cursor for
+# the next page. The search functions below are generators that follow it lazily,
+# up to `max_records` records and `max_pages` requests (each page is a quota call),
+# requesting page n+1 in the background while the caller consumes page n. Once
+# iterated, a search's `truncated` says whether a cap stopped it short of the end.
+
+NETWORK_SEARCH_URL = "https://api.wigle.net/api/v2/network/search"
+BLUETOOTH_SEARCH_URL = "https://api.wigle.net/api/v2/bluetooth/search"
+
+RESULTS_PER_PAGE = 100
+DEFAULT_MAX_RECORDS = 500
+DEFAULT_MAX_PAGES = 5
+
+Page = tuple[list[dict[str, Any]], Any]
+
+# A pool of its own: a fanout worker waiting on its next page must not queue
+# behind other fanout tasks.
+_PREFETCH: ThreadPoolExecutor | None = None
+_PREFETCH_LOCK = threading.Lock()
+
+
+def _prefetcher() -> ThreadPoolExecutor:
+    global _PREFETCH
+    with _PREFETCH_LOCK:
+        if _PREFETCH is None:
+            _PREFETCH = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wiretapper-wigle")
+        return _PREFETCH
+
+
+class Paged(Iterator[dict[str, Any]]):
+    """The records of one search, fetched as they are iterated."""
+
+    truncated = False
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        params: dict[str, Any],
+        auth: tuple[str, str],
+        max_records: int,
+        max_pages: int,
+    ) -> None:
+        self._records = _paged(
+            self, url, params=params, auth=auth, max_records=max_records, max_pages=max_pages
+        )
+
+    def __next__(self) -> dict[str, Any]:
+        return next(self._records)
+
+    def close(self) -> None:
+        self._records.close()
+
+
+def _paged(
+    search: Paged,
+    url: str,
+    *,
+    params: dict[str, Any],
+    auth: tuple[str, str],
+    max_records: int,
+    max_pages: int,
+) -> Generator[dict[str, Any], None, None]:
+    per_page = max(1, min(RESULTS_PER_PAGE, max_records))
+
+    def _page(search_after: Any) -> Page:
+        page_params = {**params, "resultsPerPage": per_page}
+        if search_after is not None:
+            page_params["searchAfter"] = search_after
+        response = get(url, params=page_params, auth=auth)
+        data = response.json()
+        return data.get("results", []) or [], data.get("searchAfter")
+
+    if max_records <= 0 or max_pages <= 0:
+        return
+    results, cursor = _page(None)
+    pages = 1
+    sent = 0
+    while True:
+        ahead: Future[Page] | None = None
+        if (
+            cursor
+            and len(results) >= per_page
+            and pages < max_pages
+            and sent + len(results) < max_records
+        ):
+            # Copy the context so the prefetch keeps the caller's request priority.
+            ahead = _prefetcher().submit(contextvars.copy_context().run, _page, cursor)
+        batch = results[: max_records - sent]
+        try:
+            yield from batch
+        except GeneratorExit:
+            if ahead is not None:
+                ahead.cancel()
+            raise
+        sent += len(batch)
+        if ahead is None:
+            # A full page with a cursor means Wigle had more: only a cap stops there.
+            search.truncated = len(batch) < len(results) or bool(
+                cursor and len(results) >= per_page
+            )
+            return
+        results, cursor = ahead.result()
+        pages += 1
+
+
+def _area_search(
+    url: str,
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int,
+    max_pages: int,
+) -> Paged:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return Paged(
+        url,
+        params={
+            "latrange1": min_lat,
+            "latrange2": max_lat,
+            "longrange1": min_lon,
+            "longrange2": max_lon,
+        },
+        auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def bluetooth_search_bbox(
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return _area_search(
+        BLUETOOTH_SEARCH_URL,
+        api_name=api_name,
+        api_token=api_token,
+        bbox=bbox,
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
+
+def network_search_bbox(
+    *,
+    api_name: str,
+    api_token: str,
+    bbox: tuple[float, float, float, float],
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return _area_search(
+        NETWORK_SEARCH_URL,
+        api_name=api_name,
+        api_token=api_token,
+        bbox=bbox,
+        max_records=max_records,
+        max_pages=max_pages,
+    )
+
 
 def bluetooth_search(
     *,
@@ -12,20 +181,16 @@ def bluetooth_search(
     lat: float,
     lon: float,
     delta: float = 0.01,
-) -> list[dict[str, Any]]:
-    response = get(
-        "https://api.wigle.net/api/v2/bluetooth/search",
-        params={
-            "latrange1": lat - delta,
-            "latrange2": lat + delta,
-            "longrange1": lon - delta,
-            "longrange2": lon + delta,
-        },
-        auth=(api_name, api_token),
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return bluetooth_search_bbox(
+        api_name=api_name,
+        api_token=api_token,
+        bbox=(lat - delta, lon - delta, lat + delta, lon + delta),
+        max_records=max_records,
+        max_pages=max_pages,
     )
-    if response.status_code != 200:
-        return []
-    return response.json().get("results", []) or []
 
 
 def network_search(
@@ -35,35 +200,47 @@ def network_search(
     lat: float,
     lon: float,
     delta: float = 0.01,
-) -> list[dict[str, Any]]:
-    response = get(
-        "https://api.wigle.net/api/v2/network/search",
-        params={
-            "latrange1": lat - delta,
-            "latrange2": lat + delta,
-            "longrange1": lon - delta,
-            "longrange2": lon + delta,
-        },
-        auth=(api_name, api_token),
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return network_search_bbox(
+        api_name=api_name,
+        api_token=api_token,
+        bbox=(lat - delta, lon - delta, lat + delta, lon + delta),
+        max_records=max_records,
+        max_pages=max_pages,
     )
-    if response.status_code != 200:
-        return []
-    return response.json().get("results", []) or []
 
 
-def search_by_bssid(*, api_name: str, api_token: str, bssid: str) -> list[dict[str, Any]]:
-    response = get(
-        "https://api.wigle.net/api/v2/network/search",
+def search_by_bssid(
+    *,
+    api_name: str,
+    api_token: str,
+    bssid: str,
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return Paged(
+        NETWORK_SEARCH_URL,
         params={"netid": bssid},
         auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
     )
-    return response.json().get("results", []) or []
 
 
-def search_by_ssid(*, api_name: str, api_token: str, ssid: str) -> list[dict[str, Any]]:
-    response = get(
-        "https://api.wigle.net/api/v2/network/search",
+def search_by_ssid(
+    *,
+    api_name: str,
+    api_token: str,
+    ssid: str,
+    max_records: int = DEFAULT_MAX_RECORDS,
+    max_pages: int = DEFAULT_MAX_PAGES,
+) -> Paged:
+    return Paged(
+        NETWORK_SEARCH_URL,
         params={"ssid": ssid},
         auth=(api_name, api_token),
+        max_records=max_records,
+        max_pages=max_pages,
     )
-    return response.json().get("results", []) or []
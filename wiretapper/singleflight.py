@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+        # Set when a background call was refused before it ran; joiners retry.
+        self.dropped = False
+
+
+class Group:
+    """Coalesce concurrent calls that share a key into one in-flight call.
+
+    The first caller for a key runs `fn`; callers that arrive while it is running
+    block and receive the same value, or the same exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Return `(value, shared)`; `shared` is True when another caller did the work."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    self._leaders += 1
+                    break
+                call.waiters += 1
+                self._coalesced += 1
+            call.done.wait()
+            if call.dropped:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.value, False
+
+    def spawn(
+        self, key: str, fn: Callable[[], Any], *, submit: Callable[[Callable[[], None]], bool]
+    ) -> bool:
+        """Start `fn` in the background via `submit` unless `key` is already in flight.
+
+        Returns True when this call started it. Foreground callers of `do()` for the
+        same key join the background call. Its errors are kept on the call only.
+        `submit` returns False to refuse the call (a full queue); then nothing runs,
+        the key is released and callers that joined meanwhile run it themselves.
+        """
+        with self._lock:
+            if key in self._calls:
+                return False
+            call = self._calls[key] = _Call()
+            self._leaders += 1
+
+        def _run() -> None:
+            try:
+                call.value = fn()
+            except Exception as exc:
+                call.error = exc
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+
+        if submit(_run):
+            return True
+        call.dropped = True
+        with self._lock:
+            self._calls.pop(key, None)
+            self._leaders -= 1
+        call.done.set()
+        return False
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "leaders": self._leaders,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncGroup:
+    """`Group` for coroutines on one event loop: followers await the leader's task.
+
+    The shared task is shielded, so a cancelled caller does not cancel the call
+    for everyone else.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task[Any]] = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    def _start(self, key: str, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task[Any]:
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        self._leaders += 1
+
+        def _done(done: asyncio.Task[Any]) -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            if not done.cancelled():
+                done.exception()  # mark retrieved; callers that awaited it got it
+
+        task.add_done_callback(_done)
+        return task
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        task = self._calls.get(key)
+        if task is not None:
+            self._coalesced += 1
+            return await asyncio.shield(task), True
+        return await asyncio.shield(self._start(key, fn)), False
+
+    def spawn(self, key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+        """Start `fn` as a background task unless `key` is already in flight."""
+        if key in self._calls:
+            return False
+        self._start(key, fn)
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "leaders": self._leaders,
+            "coalesced": self._coalesced,
+            "in_flight": len(self._calls),
+        }
+
+
+_GROUP = Group()
+_ASYNC_GROUP = AsyncGroup()
+
+
+def do(key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+    return _GROUP.do(key, fn)
+
+
+def spawn(key: str, fn: Callable[[], Any], *, submit: Callable[[Callable[[], None]], bool]) -> bool:
+    return _GROUP.spawn(key, fn, submit=submit)
+
+
+async def do_async(key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+    return await _ASYNC_GROUP.do(key, fn)
+
+
+def spawn_async(key: str, fn: Callable[[], Awaitable[Any]]) -> bool:
+    return _ASYNC_GROUP.spawn(key, fn)
+
+
+def stats() -> dict[str, int]:
+    threads = _GROUP.stats()
+    coroutines = _ASYNC_GROUP.stats()
+    return {name: threads[name] + coroutines[name] for name in threads}
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import Callable
+from typing import Any
+
+from . import sqlitedb, tiles
+from .tiles import BBox
+
+# Persistent observation store: every record fetched upstream is kept in SQLite,
+# deduplicated per source by BSSID / cell identity / IP, with an R-tree over its
+# position. Fetched tiles are recorded as coverage so an area can be answered
+# locally while its coverage is fresh.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    raw TEXT NOT NULL,
+    device TEXT NOT NULL,
+    UNIQUE (source, uid)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS observations_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS coverage (
+    source TEXT NOT NULL,
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (source, zoom, x, y)
+);
+"""
+
+_LOG = logging.getLogger("wiretapper.store")
+
+# Keeps tile-aligned boxes from spilling into the neighbouring row/column.
+_EDGE = 1e-9
+
+Uid = Callable[[dict[str, Any]], "str | None"]
+Coords = Callable[[dict[str, Any]], "tuple[float, float] | None"]
+Normalize = Callable[[dict[str, Any]], dict[str, Any]]
+
+
+def _inner(bbox: BBox) -> BBox:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat + _EDGE, min_lon + _EDGE, max_lat - _EDGE, max_lon - _EDGE
+
+
+class ObservationStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = sqlitedb.Connections(path, schema=_SCHEMA)
+
+    def ingest(
+        self,
+        source: str,
+        records: list[dict[str, Any]],
+        *,
+        covered: BBox | None,
+        zoom: int,
+        uid: Uid,
+        coords: Coords,
+        normalize: Normalize,
+    ) -> int:
+        """Upsert `records` and mark the tiles of `covered`, if any, as freshly fetched."""
+        now = time.time()
+        stored = 0
+        with self._db.transaction() as conn:
+            for record in records:
+                key = uid(record)
+                point = coords(record)
+                if key is None or point is None:
+                    continue
+                lat, lon = point
+                conn.execute(
+                    "INSERT INTO observations"
+                    " (source, uid, lat, lon, first_seen, last_seen, raw, device)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (source, uid) DO UPDATE SET lat = excluded.lat,"
+                    " lon = excluded.lon, last_seen = excluded.last_seen,"
+                    " raw = excluded.raw, device = excluded.device",
+                    (
+                        source,
+                        key,
+                        lat,
+                        lon,
+                        now,
+                        now,
+                        json.dumps(record, separators=(",", ":")),
+                        json.dumps(normalize(record), separators=(",", ":")),
+                    ),
+                )
+                (row_id,) = conn.execute(
+                    "SELECT id FROM observations WHERE source = ? AND uid = ?", (source, key)
+                ).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO observations_rtree VALUES (?, ?, ?, ?, ?)",
+                    (row_id, lat, lat, lon, lon),
+                )
+                stored += 1
+            if covered is None:
+                return stored
+            conn.executemany(
+                "INSERT OR REPLACE INTO coverage (source, zoom, x, y, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(source, zoom, x, y, now) for x, y in tiles.tiles_for_bbox(_inner(covered), zoom)],
+            )
+        return stored
+
+    def try_ingest(
+        self,
+        source: str,
+        records: list[dict[str, Any]],
+        *,
+        covered: BBox | None,
+        zoom: int,
+        uid: Uid,
+        coords: Coords,
+        normalize: Normalize,
+    ) -> int:
+        """`ingest`, but a storage error (locked or full database, ...) is logged
+        and nothing is stored: the caller still has the records it fetched."""
+        try:
+            return self.ingest(
+                source,
+                records,
+                covered=covered,
+                zoom=zoom,
+                uid=uid,
+                coords=coords,
+                normalize=normalize,
+            )
+        except sqlite3.Error:
+            _LOG.warning("could not store %d %s records", len(records), source, exc_info=True)
+            return 0
+
+    def try_covered(
+        self, source: str, covering: BBox, bbox: BBox, *, zoom: int, max_age_s: float
+    ) -> list[dict[str, Any]] | None:
+        """The stored `source` records in `bbox` while every tile of `covering` is
+        fresh, else None. A storage error is logged and also gives None, so the
+        caller falls through to upstream."""
+        try:
+            if not self.is_covered(source, covering, zoom=zoom, max_age_s=max_age_s):
+                return None
+            return self.raw_in_bbox(source, bbox)
+        except sqlite3.Error:
+            _LOG.warning("could not read %s records from the store", source, exc_info=True)
+            return None
+
+    def is_covered(self, source: str, bbox: BBox, *, zoom: int, max_age_s: float) -> bool:
+        needed = tiles.tiles_for_bbox(_inner(bbox), zoom)
+        xs = [x for x, _ in needed]
+        ys = [y for _, y in needed]
+        conn = self._db.get()
+        rows = conn.execute(
+            "SELECT x, y FROM coverage WHERE source = ? AND zoom = ? AND fetched_at >= ?"
+            " AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+            (source, zoom, time.time() - max_age_s, min(xs), max(xs), min(ys), max(ys)),
+        ).fetchall()
+        return set(needed) <= {(x, y) for x, y in rows}
+
+    def _select(self, column: str, sources: list[str], bbox: BBox) -> list[dict[str, Any]]:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        marks = ",".join("?" * len(sources))
+        conn = self._db.get()
+        rows = conn.execute(
+            f"SELECT o.{column} FROM observations_rtree r JOIN observations o ON o.id = r.id"
+            " WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ?"
+            f" AND o.source IN ({marks})",
+            (min_lat, max_lat, min_lon, max_lon, *sources),
+        ).fetchall()
+        return [json.loads(value) for (value,) in rows]
+
+    def raw_in_bbox(self, source: str, bbox: BBox) -> list[dict[str, Any]]:
+        return self._select("raw", [source], bbox)
+
+    def devices_in_bbox(self, sources: list[str], bbox: BBox) -> list[dict[str, Any]]:
+        return self._select("device", sources, bbox)
+
+    def stats(self) -> dict[str, Any]:
+        conn = self._db.get()
+        observations = dict(
+            conn.execute("SELECT source, COUNT(*) FROM observations GROUP BY source").fetchall()
+        )
+        coverage = dict(
+            conn.execute("SELECT source, COUNT(*) FROM coverage GROUP BY source").fetchall()
+        )
+        return {"enabled": True, "observations": observations, "covered_tiles": coverage}
+
+
+_STORE: ObservationStore | None = None
+
+
+def configure(*, path: str | None) -> None:
+    """Open the store at `path`; `None` disables it."""
+    global _STORE
+    if not path:
+        _STORE = None
+    elif _STORE is None or _STORE.path != path:
+        _STORE = ObservationStore(path)
+
+
+def get_store() -> ObservationStore | None:
+    return _STORE
+
+
+def stats() -> dict[str, Any]:
+    if _STORE is None:
+        return {"enabled": False}
+    return _STORE.stats()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+from . import cache, fanout
+
+# The streamed-record protocol shared by the Flask routes and the ASGI entry
+# point: `{"provider", "devices"}` records as providers answer, then a final
+# `{"meta"}` or `{"error"}` record, sent as NDJSON lines or SSE events.
+
+# Devices per streamed record, so large result sets go out in pieces.
+CHUNK = 500
+
+
+def worst_freshness(a: str, b: str) -> str:
+    order = [cache.FRESH, cache.STALE, cache.REVALIDATING]
+    return max(a, b, key=order.index)
+
+
+def chunks(devices: list[dict[str, Any]]) -> Iterator[list[dict[str, Any]]]:
+    for start in range(0, len(devices), CHUNK):
+        yield devices[start : start + CHUNK]
+
+
+def negotiate(wanted: str | None, accept: str) -> str | None:
+    """Stream format from `?stream=` or the Accept header: `"sse"`, `"ndjson"` or None."""
+    wanted = (wanted or "").strip().lower()
+    if wanted == "sse" or (not wanted and "text/event-stream" in accept):
+        return "sse"
+    if wanted == "ndjson" or (not wanted and "application/x-ndjson" in accept):
+        return "ndjson"
+    return None
+
+
+def encode(record: dict[str, Any], fmt: str, dumps: Callable[[Any], str]) -> str:
+    body = dumps(record)
+    if fmt == "sse":
+        event = "devices" if "devices" in record else "error" if "error" in record else "meta"
+        return f"event: {event}\ndata: {body}\n\n"
+    return body + "\n"
+
+
+def collect(records: Iterable[dict[str, Any]]) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    """Gather streamed records into `(devices, final record)`, in provider order."""
+    by_provider: dict[str, list[dict[str, Any]]] = {}
+    final: dict[str, Any] = {}
+    for record in records:
+        if "devices" in record:
+            by_provider.setdefault(record["provider"], []).extend(record["devices"])
+        else:
+            final = record
+    order = [*final.get("meta", {}).get("providers", {}), *by_provider]
+    devices = [d for name in dict.fromkeys(order) for d in by_provider.get(name, [])]
+    return devices, final
+
+
+def stable_view(
+    devices: list[dict[str, Any]],
+    final: dict[str, Any],
+    *,
+    query: tuple[float, float, str],
+    keys: list[str],
+    tiles_before: dict[str, float],
+    tiles_after: dict[str, float],
+) -> dict[str, Any]:
+    """What identifies a `/nearby` answer, without latencies or cache freshness.
+
+    `tiles_before`/`tiles_after` are `cache.versions` of the tile `keys` taken
+    around the lookups. When every tile is cached afterwards and none that was
+    already cached got rewritten meanwhile (a stale tile refreshed in the
+    background), the query, tile versions and provider outcomes identify the
+    devices; otherwise the devices themselves do.
+    """
+    providers = final.get("meta", {}).get("providers", {})
+    outcomes = {name: p["status"] for name, p in providers.items()}
+    unchanged = all(
+        tiles_before.get(key, version) == version for key, version in tiles_after.items()
+    )
+    if keys and len(tiles_after) == len(keys) and unchanged:
+        return {"query": query, "tiles": tiles_after, "providers": outcomes}
+    return {"devices": devices, "providers": outcomes}
+
+
+class NearbyRecords:
+    """Turns settled `/nearby` provider results into streamed records."""
+
+    def __init__(self) -> None:
+        self.meta: dict[str, Any] = {"cached": False, "freshness": cache.FRESH, "providers": {}}
+        self.results: dict[str, fanout.ProviderResult] = {}
+        self.sent = 0
+
+    def add(self, name: str, result: fanout.ProviderResult) -> Iterator[dict[str, Any]]:
+        self.results[name] = result
+        if result.status != "ok":
+            return
+        self.meta["cached"] = self.meta["cached"] or result.cached
+        self.meta["freshness"] = worst_freshness(self.meta["freshness"], result.freshness)
+        if getattr(result.value, "truncated", False):
+            self.meta["truncated"] = True
+        for chunk in chunks(result.value):
+            self.sent += len(chunk)
+            yield {"provider": name, "devices": chunk}
+
+    def finish(
+        self, order: Iterable[str], dummy: Callable[[], list[dict[str, Any]]]
+    ) -> Iterator[dict[str, Any]]:
+        results = self.results
+        # Keep the provider order stable regardless of which one answered first.
+        self.meta["providers"] = {name: results[name].meta() for name in order if name in results}
+        # Providers skipped by an open circuit neither fail the request nor count
+        # towards "every provider failed".
+        tried = {name: r for name, r in results.items() if r.status != "skipped"}
+        if tried and all(r.status != "ok" for r in tried.values()):
+            errors = "; ".join(f"{name}: {r.error}" for name, r in tried.items())
+            yield {"error": f"All providers failed ({errors})", "meta": self.meta}
+            return
+        if not self.sent:
+            yield {"provider": "dummy", "devices": dummy()}
+        yield {"meta": self.meta}
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import math
+
+# Slippy-map (z/x/y) tile math. Bounding boxes are `(min_lat, min_lon, max_lat, max_lon)`.
+
+BBox = tuple[float, float, float, float]
+
+MAX_LAT = 85.05112878
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int) -> tuple[int, int]:
+    n = 1 << zoom
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> BBox:
+    n = 1 << zoom
+
+    def _lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * row / n))))
+
+    return _lat(y + 1), x / n * 360.0 - 180.0, _lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_center(zoom: int, x: int, y: int) -> tuple[float, float]:
+    min_lat, min_lon, max_lat, max_lon = tile_bounds(zoom, x, y)
+    return (min_lat + max_lat) / 2.0, (min_lon + max_lon) / 2.0
+
+
+def tiles_for_bbox(bbox: BBox, zoom: int) -> list[tuple[int, int]]:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    x0, y0 = lonlat_to_tile(min_lon, max_lat, zoom)
+    x1, y1 = lonlat_to_tile(max_lon, min_lat, zoom)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def bbox_around(lat: float, lon: float, delta: float) -> BBox:
+    return lat - delta, lon - delta, lat + delta, lon + delta
+
+
+def contains(bbox: BBox, lat: float, lon: float) -> bool:
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
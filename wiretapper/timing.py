@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import json
+import logging
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any, TypeVar
+
+# Per-request span timings. `begin()` (in the app's `before_request`) makes a
+# `Spans` current for the request; `span(name)` adds the time spent in a block to
+# it. The request ID and spans are context variables, so fanout workers that run
+# in a copy of the request's context report into the same `Spans`, and outbound
+# calls can forward the request ID. Outside a request, `span` does nothing.
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_SPANS: contextvars.ContextVar[Spans | None] = contextvars.ContextVar(
+    "wiretapper_spans", default=None
+)
+_REQUEST_ID: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "wiretapper_request_id", default=None
+)
+_LOG = logging.getLogger("wiretapper.timing")
+# Server-Timing metric names are HTTP tokens.
+_NOT_TOKEN = re.compile(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]")
+
+
+class Spans:
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._totals: dict[str, list[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            total = self._totals.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """`{name: {"ms", "count"}}` in the order spans were first seen."""
+        with self._lock:
+            totals = {name: list(total) for name, total in self._totals.items()}
+        return {
+            name: {"ms": round(s * 1000, 2), "count": int(n)} for name, (s, n) in totals.items()
+        }
+
+    def header(self) -> str:
+        """The `Server-Timing` value: one metric per span, then `total`."""
+        parts = [
+            f"{_NOT_TOKEN.sub('-', name)};dur={span['ms']}" for name, span in self.summary().items()
+        ]
+        parts.append(f"total;dur={round((time.perf_counter() - self.started) * 1000, 2)}")
+        return ", ".join(parts)
+
+    def log(self, **fields: Any) -> None:
+        """One structured line on the `wiretapper.timing` logger (INFO)."""
+        if not _LOG.isEnabledFor(logging.INFO):
+            return
+        record = {
+            "request_id": self.request_id,
+            **fields,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": self.summary(),
+        }
+        _LOG.info(json.dumps(record, separators=(",", ":")))
+
+
+def begin(request_id: str) -> Spans:
+    spans = Spans(request_id)
+    _SPANS.set(spans)
+    _REQUEST_ID.set(request_id)
+    return spans
+
+
+def end() -> None:
+    # Set rather than reset: the response may close in another context.
+    _SPANS.set(None)
+    _REQUEST_ID.set(None)
+
+
+def current() -> Spans | None:
+    return _SPANS.get()
+
+
+def request_id() -> str | None:
+    return _REQUEST_ID.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    spans = _SPANS.get()
+    if spans is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.add(name, time.perf_counter() - started)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator: count each call as a `name` span."""
+
+    def decorate(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
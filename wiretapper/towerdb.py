@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+from .tiles import BBox
+
+try:
+    import numpy as np
+except ImportError:  # optional; only the local tower index needs it
+    np = None  # type: ignore[assignment]
+
+# Local copy of the OpenCellID cell export (`cell_towers.csv.gz`) for the tower
+# routes. The importer streams the CSV into one array per column, sorted by a
+# 0.05-degree grid key, and saves them as `.npy` files that readers memory-map.
+# A small table of where each grid row starts narrows a box query to one binary
+# search per grid row it spans, then a vectorized filter of the rows found. Diff
+# exports are merged by writing a new generation of the arrays; `manifest.json`
+# names the current one and readers follow it.
+
+GRID_STEP = 0.05
+_GRID_COLS = round(360 / GRID_STEP)
+_GRID_ROWS = round(180 / GRID_STEP)
+COLUMNS = {
+    "key": "<u4",
+    "lat": "<f4",
+    "lon": "<f4",
+    "mcc": "<u2",
+    "mnc": "<u2",
+    "lac": "<u4",
+    "cellid": "<u8",
+    "radio": "u1",
+    "samples": "<u4",
+}
+RADIOS = ("GSM", "UMTS", "LTE", "CDMA", "NR", "OTHER")
+_RADIO_CODE = {name: code for code, name in enumerate(RADIOS)}
+_CSV_FIELDS = ("radio", "mcc", "net", "area", "cell", "lon", "lat", "samples")
+_CHUNK_ROWS = 1_000_000
+# How often readers look for a newer generation.
+_RELOAD_CHECK_S = 5.0
+
+Columns = dict[str, Any]  # column name -> numpy array
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("The local tower index needs numpy: pip install wiretapper[speedups]")
+
+
+def _grid(lat: Any, lon: Any) -> tuple[Any, Any]:
+    row = np.clip(np.floor((np.asarray(lat, np.float64) + 90) / GRID_STEP), 0, _GRID_ROWS - 1)
+    col = np.clip(np.floor((np.asarray(lon, np.float64) + 180) / GRID_STEP), 0, _GRID_COLS - 1)
+    return row.astype(np.int64), col.astype(np.int64)
+
+
+def _open_text(path: Path) -> io.TextIOBase:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", newline="", encoding="utf-8")  # type: ignore[return-value]
+    return open(path, newline="", encoding="utf-8")
+
+
+def _columns(rows: list[list[str]], at: dict[str, int]) -> Columns:
+    def _values(field: str, dtype: str) -> Any:
+        return np.array([row[at[field]] for row in rows]).astype(dtype)
+
+    names, name_of_row = np.unique(_values("radio", "U"), return_inverse=True)
+    radio_codes = [_RADIO_CODE.get(name.upper(), _RADIO_CODE["OTHER"]) for name in names]
+
+    lat = _values("lat", "<f8")
+    lon = _values("lon", "<f8")
+    row, col = _grid(lat, lon)
+    return {
+        "key": (row * _GRID_COLS + col).astype(COLUMNS["key"]),
+        "lat": lat.astype(COLUMNS["lat"]),
+        "lon": lon.astype(COLUMNS["lon"]),
+        "mcc": _values("mcc", COLUMNS["mcc"]),
+        "mnc": _values("net", COLUMNS["mnc"]),
+        "lac": _values("area", COLUMNS["lac"]),
+        "cellid": _values("cell", COLUMNS["cellid"]),
+        "radio": np.array(radio_codes, dtype=COLUMNS["radio"])[name_of_row.reshape(-1)],
+        "samples": _values("samples", COLUMNS["samples"]),
+    }
+
+
+def _valid(row: list[str], at: dict[str, int]) -> bool:
+    try:
+        float(row[at["lat"]]), float(row[at["lon"]])
+        return all(int(row[at[field]]) >= 0 for field in ("mcc", "net", "area", "cell", "samples"))
+    except (IndexError, ValueError):
+        return False
+
+
+def read_csv(path: str | Path, *, chunk_rows: int = _CHUNK_ROWS) -> Iterator[Columns]:
+    """Stream an OpenCellID export (plain or gzipped) as chunks of columns.
+
+    Malformed rows are skipped.
+    """
+    _require_numpy()
+    with _open_text(Path(path)) as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = [field for field in _CSV_FIELDS if field not in header]
+        if missing:
+            raise ValueError(f"{path}: not an OpenCellID export (missing {', '.join(missing)})")
+        at = {field: header.index(field) for field in _CSV_FIELDS}
+        rows: list[list[str]] = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= chunk_rows:
+                yield _parsed(rows, at)
+                rows = []
+        if rows:
+            yield _parsed(rows, at)
+
+
+def _parsed(rows: list[list[str]], at: dict[str, int]) -> Columns:
+    try:
+        return _columns(rows, at)
+    except (IndexError, ValueError, OverflowError):
+        return _columns([row for row in rows if _valid(row, at)], at)
+
+
+def _build(path: Path, chunks: Iterable[Columns], *, sources: list[str]) -> int:
+    """Write `chunks` as a new generation under `path`, sorted by grid key; returns rows."""
+    path.mkdir(parents=True, exist_ok=True)
+    target = Path(tempfile.mkdtemp(dir=path, prefix=time.strftime("gen-%Y%m%dT%H%M%S-")))
+    generation = target.name
+    with tempfile.TemporaryDirectory(dir=path, prefix=".spill-") as spill_dir:
+        spill = Path(spill_dir)
+        files = {name: open(spill / f"{name}.bin", "wb") for name in COLUMNS}
+        rows = 0
+        try:
+            for chunk in chunks:
+                for name, f in files.items():
+                    chunk[name].astype(COLUMNS[name], copy=False).tofile(f)
+                rows += len(chunk["key"])
+        finally:
+            for f in files.values():
+                f.close()
+
+        order = np.argsort(np.fromfile(spill / "key.bin", dtype=COLUMNS["key"]), kind="stable")
+        for name, dtype in COLUMNS.items():
+            out = np.lib.format.open_memmap(
+                target / f"{name}.npy", mode="w+", dtype=dtype, shape=(rows,)
+            )
+            if rows:
+                src = np.memmap(spill / f"{name}.bin", dtype=dtype, mode="r", shape=(rows,))
+                for start in range(0, rows, _CHUNK_ROWS):
+                    out[start : start + _CHUNK_ROWS] = src[order[start : start + _CHUNK_ROWS]]
+                del src
+            out.flush()
+            del out
+        # The small index: where each grid row starts in the sorted key column.
+        keys = np.load(target / "key.npy", mmap_mode="r")
+        bounds = np.arange(_GRID_ROWS + 1, dtype=np.int64) * _GRID_COLS
+        np.save(target / "row_start.npy", np.searchsorted(keys, bounds).astype(np.int64))
+        del keys
+
+    manifest = {
+        "format": 1,
+        "generation": generation,
+        "rows": rows,
+        "grid_step": GRID_STEP,
+        "radios": list(RADIOS),
+        "sources": sources,
+        "updated_at": time.time(),
+    }
+    tmp = path / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, path / "manifest.json")
+    # Readers still mapping an old generation keep their open files.
+    for old in path.glob("gen-*"):
+        if old.name != generation:
+            shutil.rmtree(old, ignore_errors=True)
+    return rows
+
+
+def import_csv(path: str | Path, exports: Iterable[str | Path]) -> int:
+    """Replace the index at `path` with the rows of the given full exports."""
+    _require_numpy()
+    exports = [Path(e) for e in exports]
+    chunks = (chunk for export in exports for chunk in read_csv(export))
+    return _build(Path(path), chunks, sources=[e.name for e in exports])
+
+
+def _identity(columns: Columns, index: Any) -> list[tuple[int, ...]]:
+    fields = ("radio", "mcc", "mnc", "lac", "cellid")
+    return list(zip(*(columns[name][index].tolist() for name in fields), strict=True))
+
+
+def apply_diff(path: str | Path, diffs: Iterable[str | Path]) -> int:
+    """Merge diff exports into the index at `path`: changed cells are replaced, new
+    cells added. Returns the rows of the new generation."""
+    _require_numpy()
+    base = TowerIndex(path)
+    diffs = [Path(d) for d in diffs]
+    parts = [chunk for diff in diffs for chunk in read_csv(diff)]
+    if not parts:
+        return base.rows
+    changed = {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+    # Later rows of the diff win over earlier ones.
+    latest = {cell: i for i, cell in enumerate(_identity(changed, slice(None)))}
+    keep_new = np.fromiter(sorted(latest.values()), dtype=np.int64, count=len(latest))
+    changed = {name: values[keep_new] for name, values in changed.items()}
+
+    def _chunks() -> Iterator[Columns]:
+        cells = set(latest)
+        for start in range(0, base.rows, _CHUNK_ROWS):
+            part = {name: base.columns[name][start : start + _CHUNK_ROWS] for name in COLUMNS}
+            # Cheap vectorized pre-filter, then an exact check of the candidates.
+            candidates = np.flatnonzero(np.isin(part["cellid"], changed["cellid"]))
+            keep = np.ones(len(part["key"]), dtype=bool)
+            for i, cell in zip(candidates, _identity(part, candidates), strict=True):
+                if cell in cells:
+                    keep[i] = False
+            yield {name: values[keep] for name, values in part.items()}
+        yield changed
+
+    rows = _build(Path(path), _chunks(), sources=base.sources + [d.name for d in diffs])
+    base.close()
+    return rows
+
+
+class TowerIndex:
+    def __init__(self, path: str | Path) -> None:
+        _require_numpy()
+        self.path = Path(path)
+        manifest_path = self.path / "manifest.json"
+        self.mtime_ns = manifest_path.stat().st_mtime_ns
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("format") != 1 or manifest.get("grid_step") != GRID_STEP:
+            raise ValueError(f"{self.path}: unsupported tower index format")
+        self.generation: str = manifest["generation"]
+        self.rows: int = manifest["rows"]
+        self.sources: list[str] = manifest.get("sources", [])
+        self.updated_at: float = manifest.get("updated_at", 0.0)
+        self.radios: list[str] = manifest["radios"]
+        directory = self.path / self.generation
+        # Plain views of the maps: slicing a `np.memmap` costs more than the search.
+        self.columns: Columns = {
+            name: np.asarray(np.load(directory / f"{name}.npy", mmap_mode="r")) for name in COLUMNS
+        }
+        self.row_start = np.load(directory / "row_start.npy").tolist()
+
+    def close(self) -> None:
+        self.columns = {}
+
+    def _ranges(self, bbox: BBox) -> Iterator[tuple[int, int]]:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        (row0, row1), (col0, col1) = _grid([min_lat, max_lat], [min_lon, max_lon])
+        keys = self.columns["key"]
+        key_type = keys.dtype.type  # a Python int would make numpy cast the whole column
+        for row in range(int(row0), int(row1) + 1):
+            start, end = self.row_start[row], self.row_start[row + 1]
+            if start == end:
+                continue
+            span = keys[start:end]
+            lo = start + int(span.searchsorted(key_type(row * _GRID_COLS + col0), side="left"))
+            hi = start + int(span.searchsorted(key_type(row * _GRID_COLS + col1), side="right"))
+            if hi > lo:
+                yield lo, hi
+
+    def query(self, bbox: BBox) -> list[dict[str, Any]]:
+        """Towers inside `bbox`, shaped like the OpenCellID-backed tower routes."""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        out: list[dict[str, Any]] = []
+        cols = self.columns
+        radios = self.radios
+        for lo, hi in self._ranges(bbox):
+            lat = cols["lat"][lo:hi].astype(np.float64)
+            lon = cols["lon"][lo:hi].astype(np.float64)
+            inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+            found = np.flatnonzero(inside)
+            if not len(found):
+                continue
+            rows = lo + found
+            out.extend(
+                {
+                    "id": str(cellid),
+                    "lat": tower_lat,
+                    "lon": tower_lon,
+                    "lac": lac,
+                    "mcc": mcc,
+                    "mnc": mnc,
+                    "signal": samples,  # the sample count, as the GeoJSON endpoint reports
+                    "radio": radios[radio],
+                }
+                for cellid, tower_lat, tower_lon, lac, mcc, mnc, samples, radio in zip(
+                    cols["cellid"][rows].tolist(),
+                    np.round(lat[found], 5).tolist(),
+                    np.round(lon[found], 5).tolist(),
+                    cols["lac"][rows].tolist(),
+                    cols["mcc"][rows].tolist(),
+                    cols["mnc"][rows].tolist(),
+                    cols["samples"][rows].tolist(),
+                    cols["radio"][rows].tolist(),
+                    strict=True,
+                )
+            )
+        return out
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": True,
+            "rows": self.rows,
+            "generation": self.generation,
+            "sources": self.sources,
+            "updated_at": self.updated_at,
+        }
+
+
+_PATH: Path | None = None
+_INDEX: TowerIndex | None = None
+_CHECKED_AT = 0.0
+_LOCK = threading.Lock()
+
+
+def configure(*, path: str | None) -> None:
+    """Serve towers from the index at `path` (once imported); `None` disables it."""
+    global _PATH, _INDEX, _CHECKED_AT
+    if path:
+        _require_numpy()
+    with _LOCK:
+        _PATH = Path(path) if path else None
+        _INDEX = None
+        _CHECKED_AT = 0.0
+
+
+def get() -> TowerIndex | None:
+    """The current index, reopened when a newer generation has been published."""
+    global _INDEX, _CHECKED_AT
+    if _PATH is None:
+        return None
+    now = time.monotonic()
+    if now - _CHECKED_AT < _RELOAD_CHECK_S:
+        return _INDEX
+    with _LOCK:
+        if now - _CHECKED_AT >= _RELOAD_CHECK_S and _PATH is not None:
+            _CHECKED_AT = now
+            try:
+                mtime_ns = (_PATH / "manifest.json").stat().st_mtime_ns
+            except FileNotFoundError:
+                _INDEX = None
+            else:
+                if _INDEX is None or _INDEX.mtime_ns != mtime_ns:
+                    _INDEX = TowerIndex(_PATH)
+        return _INDEX
+
+
+def stats() -> dict[str, Any]:
+    index = get()
+    if index is None:
+        return {"enabled": False, "path": str(_PATH) if _PATH else None}
+    return index.stats()